@@ -0,0 +1,121 @@
+#! /usr/bin/env python3
+
+# Non-blocking valve and servo sweep control for the Water Blaster.
+
+# A shot is a timed sequence of commands: open the valve, swing the servo to
+# either side of the target a few times, then close the valve and recenter.
+# The sequence runs on its own thread so detection, display and the debug
+# switch keep running while the valve is open. The sweep is centred on the
+# live target position, which the main loop updates with set_center(). Servo
+# moves go through the shared ServoDriver, so they are slew limited like any
+# other aiming command.
+
+# A separate watchdog timer closes the valve at a hard deadline after it was
+# opened, independent of both the sequence thread and the main loop.
+
+# If an observe callback is given, it is called with ("decision_to_valve",
+# seconds) when the valve opens, timed from the fire() call.
+
+import threading
+import time
+
+import lgpio
+
+
+class FiringScheduler:
+    """Runs the trigger relay and servo sweep as a timed command sequence."""
+
+    def __init__(self, h, trigger_pin, servo, sweep, sweeps=5, step=0.2, max_open_time=3.0, observe=None):
+        self.h = h
+        self.trigger_pin = trigger_pin
+        self.servo = servo
+        self.sweep = sweep
+        self.sweeps = sweeps
+        self.step = step
+        self.max_open_time = max_open_time
+        self.observe = observe
+        self.center = None
+        self._fired = None
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        self._thread = None
+        self._watchdog = None
+
+    @property
+    def busy(self):
+        """True while a shot sequence is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def set_center(self, duty):
+        """Move the centre of the sweep to follow the live target."""
+        self.center = int(duty)
+
+    def fire(self, center):
+        """Start a shot centred on the given servo pulse width.
+
+        Returns False without doing anything if a shot is already running.
+        """
+        if self.busy:
+            return False
+        self.center = int(center)
+        self._fired = time.monotonic()
+        self._abort.clear()
+        self._thread = threading.Thread(target=self._run, name="firing", daemon=True)
+        self._thread.start()
+        return True
+
+    def _commands(self):
+        """The shot as a list of (offset in seconds, command) pairs."""
+        commands = [(0.0, "open")]
+        for i in range(self.sweeps):
+            commands.append(((2 * i) * self.step, "right"))
+            commands.append(((2 * i + 1) * self.step, "left"))
+        commands.append((2 * self.sweeps * self.step, "close"))
+        return commands
+
+    def _run(self):
+        start = time.monotonic()
+        try:
+            for offset, command in self._commands():
+                # Sleep until the command is due, waking early on abort
+                if self._abort.wait(max(0.0, start + offset - time.monotonic())):
+                    break
+                self._execute(command)
+        finally:
+            self._valve_off()
+
+    def _execute(self, command):
+        if command == "open":
+            self._valve_on()
+        elif command == "right":
+            self.servo.set(self.center + self.sweep)
+        elif command == "left":
+            self.servo.set(self.center - self.sweep)
+        elif command == "close":
+            self._valve_off()
+            self.servo.set(self.center)
+
+    def _valve_on(self):
+        with self._lock:
+            lgpio.gpio_write(self.h, self.trigger_pin, 1)
+            # Hard deadline: the valve is closed after max_open_time no matter
+            # what happens to the sequence thread or the main loop.
+            self._watchdog = threading.Timer(self.max_open_time, self._valve_off)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+        if self.observe is not None:
+            self.observe("decision_to_valve", time.monotonic() - self._fired)
+
+    def _valve_off(self):
+        with self._lock:
+            lgpio.gpio_write(self.h, self.trigger_pin, 0)
+            if self._watchdog is not None and self._watchdog is not threading.current_thread():
+                self._watchdog.cancel()
+            self._watchdog = None
+
+    def stop(self):
+        """Abort any running shot and make sure the valve is closed."""
+        self._abort.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self._valve_off()
@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+
+# Background models for Water Blaster motion detection.
+
+# Every engine takes the blurred grayscale frame and returns a binary
+# foreground mask (0 or 255), ready for dilation and contour extraction.
+# The static engine is the original behaviour: one reference frame that is
+# replaced wholesale on refresh. The adaptive engines update a little on
+# every frame, so slow lighting changes are absorbed without a blind window.
+# Updates can be frozen inside rectangles (the regions of active targets) so
+# a deer standing still is not learned into the background.
+
+# apply() writes the mask into dst when one is given, and each engine keeps
+# its intermediate arrays between frames (they are allocated on reset()), so
+# a frame does not allocate any new arrays.
+
+import cv2
+import numpy as np
+
+
+def _update_mask(shape, freeze, out=None):
+    """A uint8 mask that is 255 where the model may learn and 0 inside freeze rects."""
+    if out is None:
+        out = np.empty(shape, np.uint8)
+    out.fill(255)
+    for (x, y, w, h) in freeze:
+        out[max(y, 0):y + h, max(x, 0):x + w] = 0
+    return out
+
+
+class StaticBackground:
+    """A single reference frame, replaced only by reset()."""
+
+    adaptive = False
+
+    def __init__(self, threshold=25):
+        self.threshold = threshold
+        self.reference = None
+        self._delta = None
+
+    def reset(self, gray):
+        self.reference = gray.copy()
+        self._delta = np.empty_like(gray)
+
+    def apply(self, gray, freeze=(), dst=None):
+        cv2.absdiff(self.reference, gray, dst=self._delta)
+        return cv2.threshold(self._delta, self.threshold, 255, cv2.THRESH_BINARY, dst=dst)[1]
+
+    def background(self):
+        return self.reference
+
+
+class RunningAverageBackground:
+    """Exponential running average of past frames (cv2.accumulateWeighted)."""
+
+    adaptive = True
+
+    def __init__(self, threshold=25, alpha=0.02):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.average = None
+        self._reference = None
+        self._delta = None
+        self._learn = None
+
+    def reset(self, gray):
+        self.average = gray.astype(np.float32)
+        self._reference = np.empty_like(gray)
+        self._delta = np.empty_like(gray)
+        self._learn = np.empty_like(gray)
+
+    def apply(self, gray, freeze=(), dst=None):
+        cv2.convertScaleAbs(self.average, dst=self._reference)
+        cv2.absdiff(self._reference, gray, dst=self._delta)
+        mask = cv2.threshold(self._delta, self.threshold, 255, cv2.THRESH_BINARY, dst=dst)[1]
+        if freeze:
+            cv2.accumulateWeighted(gray, self.average, self.alpha,
+                                   mask=_update_mask(gray.shape, freeze, self._learn))
+        else:
+            cv2.accumulateWeighted(gray, self.average, self.alpha)
+        return mask
+
+    def background(self):
+        return cv2.convertScaleAbs(self.average)
+
+
+class GaussianBackground:
+    """Per-pixel running mean and variance, thresholded at k standard deviations."""
+
+    adaptive = True
+
+    def __init__(self, alpha=0.02, k=3.0, min_std=8.0):
+        self.alpha = alpha
+        self.k2 = k * k
+        self.min_var = min_std * min_std
+        self.mean = None
+        self.var = None
+        self._diff = self._diff2 = self._work = self._rate = None
+        self._foreground = None
+        self._learn = None
+
+    def reset(self, gray):
+        self.mean = gray.astype(np.float32)
+        self.var = np.full(gray.shape, self.min_var, np.float32)
+        self._diff = np.empty(gray.shape, np.float32)
+        self._diff2 = np.empty(gray.shape, np.float32)
+        self._work = np.empty(gray.shape, np.float32)
+        self._rate = np.empty(gray.shape, np.float32)
+        self._foreground = np.empty(gray.shape, bool)
+        self._learn = np.empty(gray.shape, np.uint8)
+
+    def apply(self, gray, freeze=(), dst=None):
+        # Converting with copyto, unlike a mixed-type ufunc, needs no scratch buffer
+        diff = self._diff
+        np.copyto(diff, gray)
+        diff -= self.mean
+        diff2 = np.multiply(diff, diff, out=self._diff2)
+        limit = np.maximum(self.var, self.min_var, out=self._work)
+        limit *= self.k2
+        foreground = np.greater(diff2, limit, out=self._foreground)
+        if dst is None:
+            dst = np.empty(gray.shape, np.uint8)
+        np.multiply(foreground.view(np.uint8), np.uint8(255), out=dst)
+
+        rate = self.alpha
+        if freeze:
+            rate = self._rate
+            np.copyto(rate, _update_mask(gray.shape, freeze, self._learn))
+            rate *= self.alpha / 255.0
+        work = np.multiply(diff, rate, out=self._work)
+        self.mean += work
+        work = np.subtract(diff2, self.var, out=self._work)
+        work *= rate
+        self.var += work
+        return dst
+
+    def background(self):
+        return cv2.convertScaleAbs(self.mean)
+
+
+class SubtractorBackground:
+    """OpenCV's MOG2 or KNN background subtractor.
+
+    OpenCV learns the whole frame at one rate, so freezing is all or nothing:
+    while any target region is active the model is not updated at all.
+    """
+
+    adaptive = True
+
+    def __init__(self, kind="mog2", history=500, threshold=None):
+        self.kind = kind
+        self.history = history
+        self.threshold = threshold
+        self.subtractor = None
+
+    def _create(self):
+        if self.kind == "knn":
+            threshold = 400.0 if self.threshold is None else self.threshold
+            return cv2.createBackgroundSubtractorKNN(self.history, threshold, False)
+        threshold = 16.0 if self.threshold is None else self.threshold
+        return cv2.createBackgroundSubtractorMOG2(self.history, threshold, False)
+
+    def reset(self, gray):
+        self.subtractor = self._create()
+        self.subtractor.apply(gray, learningRate=1.0)
+
+    def apply(self, gray, freeze=(), dst=None):
+        return self.subtractor.apply(gray, dst, 0.0 if freeze else -1)
+
+    def background(self):
+        return self.subtractor.getBackgroundImage()
+
+
+ENGINES = ["static", "running", "gaussian", "mog2", "knn"]
+
+
+def create_background(name, threshold=25):
+    """Create a background engine by name (one of ENGINES)."""
+    if name == "static":
+        return StaticBackground(threshold)
+    if name == "running":
+        return RunningAverageBackground(threshold)
+    if name == "gaussian":
+        return GaussianBackground()
+    if name in ("mog2", "knn"):
+        return SubtractorBackground(name)
+    raise ValueError(f"Unknown background engine: {name}")
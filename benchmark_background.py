@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark the background engines on recorded footage.
+
+Runs every engine in background.py over the same video (any file or image
+sequence pattern cv2.VideoCapture can open) using the Water Blaster detection
+steps, and reports the per-frame cost and how often each engine would have
+reported a target. Footage of an empty scene gives the false-trigger rate
+directly; frames that really contain an animal can be excluded with --targets.
+
+Usage:
+    python3 benchmark_background.py night.mp4
+    python3 benchmark_background.py dusk.mp4 --targets 300-420 900-1010
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from background import ENGINES, create_background
+
+
+def load_frames(path, width, height, limit):
+    """Read the footage once into grayscale frames at the detection size (run_engine blurs them)."""
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while limit is None or len(frames) < limit:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    capture.release()
+    return frames
+
+
+def parse_ranges(ranges):
+    """Turn ["10-20", "35-40"] into a set of frame indices."""
+    frames = set()
+    for item in ranges:
+        start, end = item.split("-")
+        frames.update(range(int(start), int(end) + 1))
+    return frames
+
+
+def run_engine(name, frames, args, target_frames):
+    """Return (mean ms, p95 ms, false triggers, frames scored) for one engine."""
+    engine = create_background(name, args.threshold)
+    times = []
+    false_triggers = 0
+    scored = 0
+    last_refresh = 0
+    for index, gray in enumerate(frames):
+        start = time.perf_counter()
+        gray = cv2.GaussianBlur(gray, (args.blur, args.blur), 0)
+        if index == 0 or (not engine.adaptive and index - last_refresh > args.refresh_frames):
+            engine.reset(gray)
+            last_refresh = index
+            continue
+        thresh = engine.apply(gray)
+        thresh = cv2.dilate(thresh, None, iterations=2)
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        triggered = any(cv2.contourArea(c) > args.min_area for c in contours)
+        times.append((time.perf_counter() - start) * 1000.0)
+
+        if index not in target_frames:
+            scored += 1
+            false_triggers += triggered
+    times = np.array(times)
+    return times.mean(), np.percentile(times, 95), false_triggers, scored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark background engines on recorded footage")
+    parser.add_argument("video", help="video file or image sequence pattern")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=ENGINES)
+    parser.add_argument("--targets", nargs="*", default=[],
+                        help="frame ranges (start-end) that contain real targets")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--blur", type=int, default=21)
+    parser.add_argument("--threshold", type=int, default=25)
+    parser.add_argument("--min-area", type=int, default=500)
+    parser.add_argument("--refresh-frames", type=int, default=120 * 30,
+                        help="frames between static reference refreshes")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N frames")
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.width, args.height, args.limit)
+    if len(frames) < 2:
+        print(f"Could not read enough frames from {args.video}")
+        return
+    target_frames = parse_ranges(args.targets)
+    print(f"{len(frames)} frames at {args.width}x{args.height}, "
+          f"{len(target_frames)} marked as containing targets\n")
+
+    print(f"{'engine':<10} {'mean ms':>8} {'p95 ms':>8} {'false':>6} {'rate':>7}")
+    for name in args.engines:
+        mean_ms, p95_ms, false_triggers, scored = run_engine(name, frames, args, target_frames)
+        rate = false_triggers / scored if scored else 0.0
+        print(f"{name:<10} {mean_ms:8.2f} {p95_ms:8.2f} {false_triggers:6d} {rate:7.1%}")
+
+
+if __name__ == "__main__":
+    main()
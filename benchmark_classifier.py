@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Measure the per-frame cost of the target verification classifier.
+
+Runs an ONNX classifier (see classifier.py) on 1 to 8 target crops of a
+640x480 frame. Each count is timed three ways: all crops in one batch, one
+crop at a time, and through the per-track cache of TrackVerifier over a
+simulated 30 fps scene in which the same tracks stay in view. The last is
+what the Water Blaster pays per frame on average. The frame is taken from
+a video if one is given, otherwise it is noise.
+
+Usage:
+    python3 benchmark_classifier.py models/deer.onnx
+    python3 benchmark_classifier.py models/deer.onnx --labels models/deer.txt --size 160 --video garden.mp4
+"""
+
+import argparse
+import os
+import time
+import types
+
+import cv2
+import numpy as np
+
+from classifier import RoiClassifier, TrackVerifier, load_labels
+
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
+
+def time_per_frame(classifier, frame, boxes, repeats):
+    classifier.classify(frame, boxes)   # Warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        classifier.classify(frame, boxes)
+    return 1000 * (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame cost of the target verification classifier")
+    parser.add_argument("model", help="ONNX classification model")
+    parser.add_argument("--labels", help="class labels, one per line (default: the model path with .txt)")
+    parser.add_argument("--size", type=int, default=224, help="model input size")
+    parser.add_argument("--video", help="take the frame from this video instead of using noise")
+    parser.add_argument("--rois", type=int, nargs="+", default=[1, 2, 4, 8], help="targets per frame")
+    parser.add_argument("--repeats", type=int, default=20, help="timed runs per measurement")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of the simulated scene")
+    parser.add_argument("--checks", type=int, default=3, help="classifications per track")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between a track's classifications")
+    args = parser.parse_args()
+
+    labels_path = args.labels or os.path.splitext(args.model)[0] + ".txt"
+    labels = load_labels(labels_path) if os.path.exists(labels_path) else None
+    frame = np.random.default_rng(0).integers(0, 256, (FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    if args.video:
+        ok, bgr = cv2.VideoCapture(args.video).read()
+        if ok:
+            frame = cv2.cvtColor(cv2.resize(bgr, (FRAME_WIDTH, FRAME_HEIGHT)), cv2.COLOR_BGR2RGB)
+
+    batched = RoiClassifier(args.model, labels, input_size=args.size)
+    single = RoiClassifier(args.model, labels, input_size=args.size, max_batch=1)
+    rng = np.random.default_rng(1)
+    print(f"{args.model} at {args.size}x{args.size}, {FRAME_WIDTH}x{FRAME_HEIGHT} frame")
+    print(f"{'targets':>8}{'batched ms':>12}{'one by one':>12}{'cached ms':>11}{'runs':>7}")
+    for n in args.rois:
+        sizes = rng.integers(40, 200, (n, 2))
+        boxes = [(int(rng.integers(0, FRAME_WIDTH - w)), int(rng.integers(0, FRAME_HEIGHT - h)), int(w), int(h))
+                 for w, h in sizes]
+        batch_ms = time_per_frame(batched, frame, boxes, args.repeats)
+        single_ms = time_per_frame(single, frame, boxes, args.repeats)
+
+        # The same n tracks in view for the whole scene, at 30 fps
+        cached = RoiClassifier(args.model, labels, input_size=args.size)
+        positive = [cached.label(0)]
+        verifier = TrackVerifier(cached, positive, checks=args.checks, interval=args.interval)
+        tracks = [types.SimpleNamespace(id=i, box=box) for i, box in enumerate(boxes)]
+        frames = int(args.seconds * 30)
+        for i in range(frames):
+            verifier.update(frame, tracks, i / 30)
+        cached_ms = 1000 * cached.total_time / frames
+        print(f"{n:>8}{batch_ms:>12.2f}{single_ms:>12.2f}{cached_ms:>11.3f}{cached.calls:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark ROI-cropped hand detection against full-frame MediaPipe.
+
+Runs every frame of a video (any file cv2.VideoCapture can open, ideally
+recorded at the camera's 1920x1080) through two detectors from
+hand_detector.py. The first runs MediaPipe on the full frame, as
+minimal_camera_servo.py used to. The second searches a downscaled frame and
+tracks the hand on a crop. The report gives the frame rate of each, how
+often each found the hand, and how far the cropped detector's landmarks are
+from the full-frame ones.
+
+Usage:
+    python3 benchmark_hands.py hand.mp4
+    python3 benchmark_hands.py hand.mp4 --search-width 480 --roi-size 192 --frames 600
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from hand_detector import RoiHandDetector
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ROI-cropped and full-frame hand detection")
+    parser.add_argument("video", help="video file or image sequence pattern")
+    parser.add_argument("--frames", type=int, help="stop after this many frames")
+    parser.add_argument("--fps", type=float, help="frame rate for the motion model (default: from the video)")
+    parser.add_argument("--search-width", type=int, default=640, help="width of the downscaled search frame")
+    parser.add_argument("--roi-size", type=int, default=256, help="side the tracking crop is resized to")
+    parser.add_argument("--roi-scale", type=float, default=2.0, help="crop side relative to the hand size")
+    args = parser.parse_args()
+
+    capture = cv2.VideoCapture(args.video)
+    fps = args.fps or capture.get(cv2.CAP_PROP_FPS) or 30.0
+    full = RoiHandDetector(full_frame=True)
+    roi = RoiHandDetector(search_width=args.search_width, roi_size=args.roi_size, roi_scale=args.roi_scale)
+
+    frames = 0
+    full_time = roi_time = 0.0
+    full_found = roi_found = 0
+    errors = []         # Mean landmark error per frame, pixels
+    wrist_errors = []
+    relative = []       # Mean landmark error as a fraction of the hand size
+    while args.frames is None or frames < args.frames:
+        ok, bgr = capture.read()
+        if not ok:
+            break
+        frame = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)  # The camera delivers RGB
+        now = frames / fps
+        frames += 1
+
+        start = time.perf_counter()
+        reference = full.process(frame, now)
+        full_time += time.perf_counter() - start
+        start = time.perf_counter()
+        landmarks = roi.process(frame, now)
+        roi_time += time.perf_counter() - start
+
+        full_found += reference is not None
+        roi_found += landmarks is not None
+        if reference is not None and landmarks is not None:
+            distance = np.linalg.norm(landmarks - reference, axis=1)
+            size = np.linalg.norm(reference.max(axis=0) - reference.min(axis=0))
+            errors.append(distance.mean())
+            wrist_errors.append(distance[0])
+            relative.append(distance.mean() / max(size, 1.0))
+
+    if not frames:
+        print(f"Could not read {args.video}")
+        return
+    height, width = frame.shape[:2]
+    print(f"{frames} frames at {width}x{height}")
+    print(f"{'detector':<14}{'fps':>8}{'ms/frame':>10}{'found':>8}")
+    print(f"{'full frame':<14}{frames / full_time:>8.1f}{1000 * full_time / frames:>10.1f}"
+          f"{100 * full_found / frames:>7.0f}%")
+    print(f"{'roi':<14}{frames / roi_time:>8.1f}{1000 * roi_time / frames:>10.1f}"
+          f"{100 * roi_found / frames:>7.0f}%")
+    print(roi.summary())
+    if errors:
+        print(f"Landmark error vs full frame over {len(errors)} frames: "
+              f"mean {np.mean(errors):.1f} px (p95 {np.percentile(errors, 95):.1f}), "
+              f"wrist {np.mean(wrist_errors):.1f} px, {100 * np.mean(relative):.1f}% of hand size")
+    full.close()
+    roi.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Run the Water Blaster loop on a frame recording and report its performance.
+
+The picamera2 and lgpio modules are replaced by the replay backends in
+replay.py, and water_blaster_pi5.py runs unchanged (headless, in a scratch
+directory) until the recording ends. The report shows the time spent in each
+stage of the loop, the processing frame rate, the capture-to-decision and
+decision-to-actuation latencies, the servo command trace and the frames on
+which shots were fired. Save a run with --output and compare later
+runs against it with --baseline to catch performance regressions.
+
+Shot decisions depend on how many seconds a target has been still, so they
+are only comparable between runs with --realtime. Without it, frames are
+processed as fast as the loop can take them. That only works with
+"--capture sync" (the default here): a capture thread would read the whole
+recording into its ring before the loop had started, so a fast replay with
+"--capture threaded" is switched to sync capture.
+
+Usage:
+    python3 benchmark_replay.py recordings/garden
+    python3 benchmark_replay.py recordings/synthetic --synthetic --realtime --output baseline.json
+    python3 benchmark_replay.py recordings/garden --baseline benchmarks/garden.json -- --pyramid 2
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import runpy
+import sys
+import tempfile
+
+import replay
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SCRIPT_ARGS = ["--headless", "--capture", "sync"]
+
+
+def capture_mode(script_args):
+    """The --capture value the script will see (the last one given), or None."""
+    mode = None
+    for i, arg in enumerate(script_args):
+        if arg == "--capture" and i + 1 < len(script_args):
+            mode = script_args[i + 1]
+        elif arg.startswith("--capture="):
+            mode = arg.split("=", 1)[1]
+    return mode
+
+
+def run(args):
+    if not os.path.exists(os.path.join(args.recording, "meta.json")):
+        if not args.synthetic:
+            sys.exit(f"No recording at {args.recording}")
+        print(f"Writing synthetic recording to {args.recording}")
+        replay.make_synthetic(args.recording)
+    recording = replay.Recording(args.recording)
+    gpio = replay.install(recording, realtime=args.realtime, debug_switch=args.debug_switch)
+
+    if not args.realtime and capture_mode(DEFAULT_SCRIPT_ARGS + args.script_args) != "sync":
+        # Frames are served as fast as they are asked for, so a capture thread
+        # would reach the end of the recording before the loop processed any
+        print("Replaying without --realtime: using --capture sync")
+        args.script_args = args.script_args + ["--capture", "sync"]
+
+    script = os.path.join(REPO_DIR, args.script)
+    sys.path.insert(0, REPO_DIR)
+    sys.argv = [script] + DEFAULT_SCRIPT_ARGS + args.script_args
+    output = io.StringIO() if args.quiet else sys.stdout
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            with contextlib.redirect_stdout(output):
+                namespace = runpy.run_path(script, run_name="__main__")
+        except SystemExit:
+            sys.exit(f"{args.script} exited early" + (f":\n{output.getvalue()}" if args.quiet else ""))
+        finally:
+            os.chdir(REPO_DIR)
+
+    stages = namespace["stageTimer"].stats()
+    frames = max((s["count"] for s in stages.values()), default=0)
+    busy = sum(s["mean_ms"] * s["count"] for s in stages.values()) / 1000
+    servo_trace = [entry for entry in gpio.trace if entry[2] == "servo"]
+    shots = [entry[0] for entry in gpio.trace if entry[2] == "write" and entry[4] == 1]
+    return {
+        "script": args.script,
+        "script_args": DEFAULT_SCRIPT_ARGS + args.script_args,
+        "recording": os.path.basename(os.path.normpath(args.recording)),
+        "realtime": args.realtime,
+        "frames": frames,
+        "fps": frames / busy if busy else 0.0,
+        "stages": stages,
+        "latencies": namespace["stageTimer"].latency_stats(),
+        "shots": shots,
+        "servo_commands": len(servo_trace),
+        "servo_trace": servo_trace,
+    }
+
+
+def report(result):
+    print(f"\n{result['frames']} frames of {result['recording']} "
+          f"({'recorded speed' if result['realtime'] else 'as fast as possible'}), "
+          f"{result['fps']:.1f} fps")
+    print(f"{'stage':<12}{'frames':>8}{'mean ms':>10}{'p50':>8}{'p95':>8}{'p99':>8}{'max ms':>10}")
+    for name, s in result["stages"].items():
+        print(f"{name:<12}{s['count']:>8}{s['mean_ms']:>10.3f}{s['p50_ms']:>8.3f}{s['p95_ms']:>8.3f}"
+              f"{s['p99_ms']:>8.3f}{s['max_ms']:>10.2f}")
+    if result.get("latencies"):
+        print(f"{'latency':<20}{'count':>8}{'mean ms':>10}{'p50':>8}{'p95':>8}{'p99':>8}{'max ms':>10}")
+    for name, s in result.get("latencies", {}).items():
+        print(f"{name:<20}{s['count']:>8}{s['mean_ms']:>10.3f}{s['p50_ms']:>8.3f}{s['p95_ms']:>8.3f}"
+              f"{s['p99_ms']:>8.3f}{s['max_ms']:>10.2f}")
+    print(f"Servo commands: {result['servo_commands']}")
+    for frame, t, _, pin, width in result["servo_trace"][:10]:
+        print(f"  frame {frame:>5} {t:>8.3f}s  pin {pin} -> {width} us")
+    if result["servo_commands"] > 10:
+        print(f"  ... {result['servo_commands'] - 10} more (see --output)")
+    print(f"Shots: {len(result['shots'])}" + (f" at frames {result['shots']}" if result["shots"] else ""))
+
+
+def compare(result, baseline, tolerance, shot_tolerance=1):
+    """Print the change from a baseline run; return True if nothing regressed.
+
+    Realtime replays are paced by the wall clock, so a shot may land a frame
+    earlier or later from run to run; shots within shot_tolerance frames of
+    the baseline's count as unchanged.
+    """
+    ok = True
+    print(f"\nAgainst baseline ({baseline['frames']} frames, {baseline['fps']:.1f} fps):")
+    for name, s in result["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            print(f"  {name:<12}{s['mean_ms']:>9.3f} ms  (new stage)")
+            continue
+        change = 100 * (s["mean_ms"] - base["mean_ms"]) / base["mean_ms"] if base["mean_ms"] else 0.0
+        slower = change > tolerance and s["mean_ms"] - base["mean_ms"] > 0.05
+        ok &= not slower
+        print(f"  {name:<12}{base['mean_ms']:>9.3f} -> {s['mean_ms']:.3f} ms  {change:+6.1f}%"
+              + ("  SLOWER" if slower else ""))
+    change = 100 * (result["fps"] - baseline["fps"]) / baseline["fps"] if baseline["fps"] else 0.0
+    print(f"  {'fps':<12}{baseline['fps']:>9.1f} -> {result['fps']:.1f}     {change:+6.1f}%")
+    if result["realtime"] and baseline["realtime"]:
+        shots, base_shots = result["shots"], baseline["shots"]
+        if len(shots) != len(base_shots) or any(abs(a - b) > shot_tolerance for a, b in zip(shots, base_shots)):
+            ok = False
+            print(f"  Shots changed: {base_shots} -> {shots}")
+        elif shots != base_shots:
+            print(f"  Shot decisions unchanged within jitter: {base_shots} -> {shots}")
+        else:
+            print("  Shot decisions unchanged")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recording through the Water Blaster loop",
+                                     epilog="Arguments after -- are passed to the script, "
+                                            f"after the defaults {' '.join(DEFAULT_SCRIPT_ARGS)}")
+    parser.add_argument("recording", help="recording directory (see record_frames.py)")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="create a synthetic test recording if the directory has none")
+    parser.add_argument("--realtime", action="store_true", help="deliver frames at the recorded frame times")
+    parser.add_argument("--debug-switch", action="store_true", help="replay with the debug switch on (no firing)")
+    parser.add_argument("--script", default="water_blaster_pi5.py", help="script to run")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--baseline", help="compare against results saved with --output")
+    parser.add_argument("--tolerance", type=float, default=20.0,
+                        help="percent a stage may slow down before it counts as a regression")
+    parser.add_argument("--shot-tolerance", type=int, default=1,
+                        help="frames a realtime shot may move before it counts as a change")
+    parser.add_argument("--quiet", action="store_true", help="hide the script's own output")
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+    args.script_args = argv[split + 1:]
+
+    result = run(args)
+    report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.tolerance, args.shot_tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#! /usr/bin/env python3
+
+# Target verification with a small image classifier.
+
+# The motion pipeline fires at anything that moves and then stands still:
+# deer, but also cats, people and shadows. RoiClassifier runs an ONNX image
+# classifier through OpenCV's dnn module, on the CPU, over the bounding-box
+# crops of the targets in a frame. All crops of a frame go through the
+# network as one batch. Models exported with a fixed batch size of 1 are
+# detected on the first batch and then fed one crop at a time.
+
+# TrackVerifier classifies each track a few times (CLASSIFIER_CHECKS, spaced
+# CLASSIFIER_INTERVAL apart) and caches the result, so the network runs on a
+# handful of frames per animal rather than on every frame. A track's verdict
+# is undecided until all its checks are in; then it is positive if the mean
+# probability of the positive classes reaches the threshold.
+
+import time
+
+import cv2
+import numpy as np
+
+
+def load_labels(path):
+    """One class label per line, in the model's output order."""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class RoiClassifier:
+    """Batched ONNX classification of regions of a frame with cv2.dnn."""
+
+    def __init__(self, model_path, labels=None, input_size=224, scale=1 / 255.0, mean=(0, 0, 0),
+                 swap_rb=False, padding=0.1, max_batch=8):
+        # input_size: side of the square the model takes
+        # scale, mean: blob = (pixel - mean) * scale, per channel mean
+        # swap_rb: the model wants BGR (frames are RGB)
+        # padding: fraction of the box size added on each side of a crop
+        self.net = cv2.dnn.readNetFromONNX(model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)   # The CPU is the default target
+        self.labels = labels
+        self.input_size = (input_size, input_size)
+        self.scale = scale
+        self.mean = mean
+        self.swap_rb = swap_rb
+        self.padding = padding
+        self.max_batch = max_batch
+        self.calls = 0
+        self.batches = 0
+        self.crops = 0
+        self.total_time = 0.0
+
+    def label(self, index):
+        if self.labels is not None and index < len(self.labels):
+            return self.labels[index]
+        return str(index)
+
+    def _crop(self, frame, box):
+        height, width = frame.shape[:2]
+        x, y, w, h = box
+        pad_x, pad_y = int(w * self.padding), int(h * self.padding)
+        x0, y0 = max(int(x) - pad_x, 0), max(int(y) - pad_y, 0)
+        x1, y1 = min(int(x + w) + pad_x, width), min(int(y + h) + pad_y, height)
+        return frame[y0:max(y1, y0 + 1), x0:max(x1, x0 + 1)]
+
+    def _forward(self, crops):
+        blob = cv2.dnn.blobFromImages(crops, self.scale, self.input_size, self.mean,
+                                      swapRB=self.swap_rb, crop=False)
+        self.net.setInput(blob)
+        return self.net.forward().reshape(len(crops), -1)
+
+    def classify(self, frame, boxes):
+        """Class probabilities for each (x, y, w, h) box, as an (n, classes) array."""
+        if not boxes:
+            return np.empty((0, len(self.labels or ())), np.float32)
+        start = time.perf_counter()
+        crops = [self._crop(frame, box) for box in boxes]
+        outputs = []
+        for i in range(0, len(crops), self.max_batch):
+            batch = crops[i:i + self.max_batch]
+            try:
+                outputs.append(self._forward(batch))
+            except cv2.error:
+                if len(batch) == 1:
+                    raise
+                # The model has a fixed batch size of 1
+                self.max_batch = 1
+                outputs.extend(self._forward([crop]) for crop in batch)
+                self.batches += len(batch) - 1
+            self.batches += 1
+        scores = np.concatenate(outputs).astype(np.float32)
+        # Models exported without a final softmax give logits
+        if scores.min() < 0 or not np.allclose(scores.sum(axis=1), 1.0, atol=0.01):
+            scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+            scores /= scores.sum(axis=1, keepdims=True)
+        self.calls += 1
+        self.crops += len(crops)
+        self.total_time += time.perf_counter() - start
+        return scores
+
+
+class TrackVerifier:
+    """Classifies each track a few times and caches the verdict."""
+
+    def __init__(self, classifier, positive, threshold=0.5, checks=3, interval=0.5):
+        self.classifier = classifier
+        labels = classifier.labels or []
+        self.positive = [labels.index(name) for name in positive if name in labels]
+        if not self.positive:
+            raise ValueError(f"None of the positive classes {positive} are in the model's labels")
+        self.threshold = threshold
+        self.checks = checks
+        self.interval = interval
+        self.decided = 0
+        self.confirmed = 0
+        self._results = {}      # track id -> list of class probability rows
+        self._last = {}         # track id -> time of the last check
+        self._verdicts = {}     # track id -> (positive, label, score)
+
+    def update(self, frame, tracks, now):
+        """Classify the tracks that are due, in one batch; returns the ids decided now."""
+        due = [t for t in tracks if t.id not in self._verdicts
+               and now - self._last.get(t.id, float("-inf")) >= self.interval]
+        if not due:
+            return []
+        scores = self.classifier.classify(frame, [t.box for t in due])
+        decided = []
+        for track, row in zip(due, scores):
+            self._last[track.id] = now
+            results = self._results.setdefault(track.id, [])
+            results.append(row)
+            if len(results) >= self.checks:
+                mean = np.mean(results, axis=0)
+                score = float(mean[self.positive].sum())
+                best = int(np.argmax(mean))
+                self._verdicts[track.id] = (score >= self.threshold, self.classifier.label(best), score)
+                del self._results[track.id]
+                self.decided += 1
+                self.confirmed += score >= self.threshold
+                decided.append(track.id)
+        return decided
+
+    def verdict(self, track_id):
+        """True (fire), False (do not fire) or None (not classified enough yet)."""
+        verdict = self._verdicts.get(track_id)
+        return None if verdict is None else verdict[0]
+
+    def describe(self, track_id):
+        """(label, positive-class score) of a decided track, or None."""
+        verdict = self._verdicts.get(track_id)
+        return None if verdict is None else verdict[1:]
+
+    def prune(self, live_ids):
+        """Forget tracks that no longer exist."""
+        for cache in (self._results, self._last, self._verdicts):
+            for track_id in [i for i in cache if i not in live_ids]:
+                del cache[track_id]
+
+    def __len__(self):
+        return len(self._last)
+
+    def summary(self):
+        c = self.classifier
+        mean = 1000 * c.total_time / c.calls if c.calls else 0.0
+        return (f"Verifier: {c.crops} crops in {c.batches} batches on {c.calls} frames ({mean:.1f} ms per frame), "
+                f"{self.decided} tracks decided, {self.confirmed} positive")
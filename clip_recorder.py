@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+
+# Pre/post-event video clips for the Water Blaster.
+
+# ClipRecorder keeps the last few seconds of video in a fixed-size circular
+# buffer of small, already JPEG-encoded frames, so memory stays bounded no
+# matter how long the system runs. When an event happens (a target is
+# acquired, a shot is fired) it keeps collecting frames for a few more
+# seconds, then hands the pre- and post-event frames to a worker process that
+# decodes them and writes the video file. Further events while a clip is
+# still collecting extend that clip instead of starting a new one, up to
+# max_seconds: a clip that long is saved and a new one, starting with the
+# buffered frames, carries on, so sustained activity (a deer grazing, shot
+# after shot) cannot grow a clip without limit.
+
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+def _write_clip(path, frames, fps):
+    """Decode JPEG frames and write them to a video file (runs in the worker)."""
+    writer = None
+    for jpeg in frames:
+        image = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        if writer is None:
+            height, width = image.shape[:2]
+            codec = "MJPG" if path.endswith(".avi") else "mp4v"
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+        writer.write(image)
+    if writer is not None:
+        writer.release()
+    return path, len(frames)
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class ClipRecorder:
+    """A circular buffer of encoded frames that is saved around events."""
+
+    def __init__(self, directory, pre_seconds=5.0, post_seconds=5.0, fps=10, size=(320, 240),
+                 quality=70, extension="mp4", max_seconds=60.0):
+        self.directory = directory
+        self.post_seconds = post_seconds
+        self.max_frames = max(1, int(max_seconds * fps))
+        self.fps = fps
+        self.size = size
+        self.quality = quality
+        self.extension = extension
+        self.clips = 0
+        self._buffer = collections.deque(maxlen=max(1, int(pre_seconds * fps)))
+        self._small = np.empty((size[1], size[0], 3), np.uint8)
+        self._last_frame = 0.0
+        self._event = None
+        os.makedirs(directory, exist_ok=True)
+
+        # Start the worker now, while the process has few threads to fork
+        context = multiprocessing.get_context("fork")
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context)
+        self._pool.submit(_warm_up).result()
+
+    def add(self, frame, conversion=None):
+        """Offer a frame; it is downscaled and encoded at most fps times a second."""
+        now = time.monotonic()
+        if now - self._last_frame < 1.0 / self.fps:
+            return
+        self._last_frame = now
+
+        cv2.resize(frame, self.size, dst=self._small, interpolation=cv2.INTER_AREA)
+        small = self._small if conversion is None else cv2.cvtColor(self._small, conversion)
+        ok, jpeg = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return
+        jpeg = jpeg.tobytes()
+        self._buffer.append(jpeg)
+
+        if self._event is not None:
+            self._event["frames"].append(jpeg)
+            if now >= self._event["until"]:
+                self._flush()
+            elif len(self._event["frames"]) >= self.max_frames:
+                event = self._event
+                self._flush()
+                self._start(event["name"], event["until"])
+
+    def trigger(self, name):
+        """Mark an event: save the buffered frames plus post_seconds more."""
+        until = time.monotonic() + self.post_seconds
+        if self._event is not None:
+            self._event["until"] = until
+            return
+        self._start(name, until)
+
+    def _start(self, name, until):
+        self.clips += 1
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(self.directory, f"clip_{stamp}_{self.clips}_{name}.{self.extension}")
+        self._event = {"path": path, "name": name, "frames": list(self._buffer), "until": until}
+
+    def _flush(self):
+        event, self._event = self._event, None
+        self._pool.submit(_write_clip, event["path"], event["frames"], self.fps)
+
+    def close(self):
+        """Save any clip still collecting and wait for the worker to finish."""
+        if self._event is not None:
+            self._flush()
+        self._pool.shutdown(wait=True)
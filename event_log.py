@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+
+# Structured event log for the Water Blaster.
+
+# Events are JSON objects, one per line, with a wall-clock timestamp ("ts"),
+# a type and type-specific fields, for example:
+#   {"ts": 1697312345.2, "type": "shot", "x": 330, "y": 230, "shot": 1, "total": 4}
+# emit() only appends to an in-memory batch. A writer thread writes the batch
+# when it reaches flush_size events or every flush_interval seconds, so the
+# detection loop never waits on a file flush. Files are named
+# events_<date>_<n>.jsonl and rotate at midnight or when they reach max_bytes;
+# files older than retention_days are deleted. Use query_events.py to read them.
+
+import collections
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+
+EVENT_TYPES = ["message", "state", "shot", "refresh", "perf", "track", "verify", "power"]
+
+
+class EventLog:
+    """A batched, rotating JSONL event log written by a background thread."""
+
+    def __init__(self, directory="logs", prefix="events", max_bytes=10_000_000, retention_days=30,
+                 flush_interval=2.0, flush_size=100):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.path = None
+        self._file = None
+        self._day = None
+        self._batch = collections.deque()
+        self._cond = threading.Condition()
+        self._running = True
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def emit(self, event_type, **fields):
+        """Record an event of one of EVENT_TYPES."""
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type: {event_type}")
+        event = {"ts": round(time.time(), 3), "type": event_type}
+        event.update(fields)
+        with self._cond:
+            self._batch.append(event)
+            if len(self._batch) >= self.flush_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._batch) >= self.flush_size or not self._running,
+                                    timeout=self.flush_interval)
+                batch = list(self._batch)
+                self._batch.clear()
+                running = self._running
+            if batch:
+                self._write(batch)
+            if not running:
+                break
+        if self._file is not None:
+            self._file.close()
+
+    def _write(self, batch):
+        lines = "".join(json.dumps(event, separators=(",", ":")) + "\n" for event in batch)
+        self._rotate_if_needed(len(lines))
+        self._file.write(lines)
+        self._file.flush()
+
+    def _rotate_if_needed(self, incoming):
+        day = datetime.date.today().isoformat()
+        if self._file is not None and day == self._day and self._file.tell() + incoming <= self.max_bytes:
+            return
+        if self._file is not None:
+            self._file.close()
+        self._day = day
+        index = 1
+        while True:
+            path = os.path.join(self.directory, f"{self.prefix}_{day}_{index}.jsonl")
+            if not os.path.exists(path) or os.path.getsize(path) + incoming <= self.max_bytes:
+                break
+            index += 1
+        self.path = path
+        self._file = open(path, "a")
+        self._remove_expired()
+
+    def _remove_expired(self):
+        cutoff = time.time() - self.retention_days * 86400
+        for path in glob.glob(os.path.join(self.directory, f"{self.prefix}_*.jsonl")):
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+    def close(self):
+        """Write everything still batched and stop the writer thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=5.0)
+
+
+def read_events(directory="logs", prefix="events", types=None, since=None, until=None):
+    """Yield events from all log files in time order, optionally filtered.
+
+    types is a collection of event types; since and until are Unix times.
+    """
+    for path in sorted(glob.glob(os.path.join(directory, f"{prefix}_*.jsonl")), key=_file_order):
+        with open(path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash or power loss
+                if types is not None and event.get("type") not in types:
+                    continue
+                if since is not None and event["ts"] < since:
+                    continue
+                if until is not None and event["ts"] >= until:
+                    continue
+                yield event
+
+
+def _file_order(path):
+    # events_<date>_<n>.jsonl: order by date, then numerically by n
+    stem = os.path.basename(path).rsplit(".", 1)[0]
+    rest, _, index = stem.rpartition("_")
+    return rest, int(index) if index.isdigit() else 0
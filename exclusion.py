@@ -0,0 +1,147 @@
+#! /usr/bin/env python3
+
+# Exclusion zones and the false-trigger heatmap.
+
+# Some parts of a garden move all night: bushes in the wind, a flag, cars on
+# a road at the edge of the frame. ExclusionZones holds polygons, in main
+# frame pixels, loaded from a per-camera JSON file. They are rasterized once
+# into a mask at whatever size a stage works at (the motion gate, the
+# background model), and that stage drops the zones from its threshold mask
+# with a single bitwise AND, so nothing in them is ever dilated, labelled or
+# tracked.
+
+# TriggerHeatmap learns where such zones are. It marks the cells each track
+# covers in a bitmap of its own as the track is seen, so a track that sways on
+# the spot for hours costs no more than one that passes by. When a track ends
+# without having been confirmed (fired at, or accepted by the classifier) its
+# footprint is added to a per-cell count. The counts are saved across runs;
+# suggest_exclusions.py turns the hot areas into polygons for the exclusion
+# file.
+
+# The exclusion file looks like this, in pixels of a frame of frame_size
+# (polygons are rescaled if the camera runs at another size):
+#   {"frame_size": [640, 480], "polygons": [[[0, 400], [640, 400], [640, 480], [0, 480]]]}
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+
+class ExclusionZones:
+    """Polygons, in main frame pixels, where motion is ignored."""
+
+    def __init__(self, polygons, frame_size):
+        # polygons: lists of (x, y) points; frame_size: (width, height) they refer to
+        self.polygons = [np.asarray(p, np.float64).reshape(-1, 2) for p in polygons if len(p) >= 3]
+        self.frame_size = tuple(frame_size)
+
+    @classmethod
+    def load(cls, path, frame_size=None):
+        """Read an exclusion file, rescaled to frame_size (width, height) if it differs."""
+        with open(path) as f:
+            config = json.load(f)
+        zones = cls(config.get("polygons", []), config.get("frame_size", frame_size))
+        if frame_size is not None and tuple(frame_size) != zones.frame_size:
+            sx = frame_size[0] / zones.frame_size[0]
+            sy = frame_size[1] / zones.frame_size[1]
+            zones = cls([p * (sx, sy) for p in zones.polygons], frame_size)
+        return zones
+
+    def save(self, path):
+        # One polygon per line, so the file is easy to edit by hand
+        polygons = [json.dumps([[int(round(x)), int(round(y))] for x, y in p]) for p in self.polygons]
+        with open(path, "w") as f:
+            f.write(f'{{"frame_size": {json.dumps(list(self.frame_size))}, "polygons": [\n  '
+                    + ",\n  ".join(polygons) + "\n]}\n")
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def rasterize(self, shape):
+        """A uint8 mask of (height, width) covering the whole frame: 0 in the zones, 255 elsewhere."""
+        height, width = shape[:2]
+        sx = width / self.frame_size[0]
+        sy = height / self.frame_size[1]
+        mask = np.full((height, width), 255, np.uint8)
+        if self.polygons:
+            points = [np.round(p * (sx, sy)).astype(np.int32) for p in self.polygons]
+            cv2.fillPoly(mask, points, 0)
+        return mask
+
+    def coverage(self):
+        """Fraction of the frame inside the zones."""
+        width, height = self.frame_size
+        mask = self.rasterize((max(1, height // 4), max(1, width // 4)))
+        return 1.0 - cv2.countNonZero(mask) / mask.size
+
+
+class TriggerHeatmap:
+    """Per-cell counts of the tracks that ended without a confirmed target."""
+
+    def __init__(self, frame_size, cell=4):
+        # frame_size: (width, height) of the main frame; cell: pixels per heatmap cell
+        width, height = frame_size
+        self.frame_size = tuple(frame_size)
+        self.cell = cell
+        self.heat = np.zeros((height // cell, width // cell), np.float32)
+        self.triggers = 0       # Unconfirmed tracks added
+        self.confirmed = 0      # Confirmed tracks, not added
+        self._footprints = {}   # Track id -> bitmap of the cells it covered
+        self._spare = []        # Bitmaps of settled tracks, for reuse
+
+    @classmethod
+    def load(cls, path, frame_size, cell=4):
+        """Continue a saved heatmap, or start a new one if there is none for this frame size."""
+        heatmap = cls(frame_size, cell)
+        if os.path.exists(path):
+            with np.load(path) as saved:
+                if tuple(saved["frame_size"]) == heatmap.frame_size and int(saved["cell"]) == cell:
+                    heatmap.heat[:] = saved["heat"]
+                    heatmap.triggers = int(saved["triggers"])
+        return heatmap
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez(path, heat=self.heat, cell=self.cell, frame_size=self.frame_size, triggers=self.triggers)
+
+    def update(self, visible, live_ids, confirmed=()):
+        """Record where the visible tracks are and settle the tracks that are gone.
+
+        visible: tracks seen in this frame, with boxes in main frame pixels
+        live_ids: ids of all tracks the tracker still holds
+        confirmed: ids of tracks that were confirmed as real targets
+        """
+        c = self.cell
+        for track in visible:
+            footprint = self._footprints.get(track.id)
+            if footprint is None:
+                footprint = self._spare.pop() if self._spare else np.empty(self.heat.shape, np.uint8)
+                footprint.fill(0)
+                self._footprints[track.id] = footprint
+            x, y, w, h = track.box
+            footprint[max(int(y) // c, 0):-(-int(y + h) // c), max(int(x) // c, 0):-(-int(x + w) // c)] = 1
+        for track_id in [i for i in self._footprints if i not in live_ids]:
+            self._settle(track_id, track_id in confirmed)
+
+    def _settle(self, track_id, confirmed):
+        footprint = self._footprints.pop(track_id)
+        self._spare.append(footprint)
+        if confirmed:
+            self.confirmed += 1
+            return
+        # Each cell counts once per track, however long it stayed there
+        self.heat += footprint
+        self.triggers += 1
+
+    def discard(self):
+        """Forget the tracks in progress, for when the tracker is reset."""
+        self._spare += self._footprints.values()
+        self._footprints.clear()
+
+    def summary(self):
+        return (f"Heatmap: {self.triggers} unconfirmed triggers recorded, {self.confirmed} confirmed this run, "
+                f"hottest cell {self.heat.max():.0f}")
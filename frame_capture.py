@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+
+# Threaded frame capture for the Water Blaster.
+
+# A background thread pulls frames from the camera and copies them into a
+# small ring of preallocated buffers. A frame may be a single array or a tuple
+# of arrays (for example the display image and the detection luma plane). Each
+# slot carries a sequence number and a monotonic capture timestamp. The
+# detection loop always takes the newest frame, so a slow processing step no
+# longer stalls the camera; frames that were overwritten before the detector
+# got to them are counted as dropped.
+
+# Capture times come from the camera: each frame's SensorTimestamp (when its
+# exposure started, in nanoseconds) is mapped onto time.monotonic() by
+# FrameClock, so timers that run on frame times measure when the scene was
+# seen rather than when the loop got round to it.
+
+import threading
+import time
+
+import numpy as np
+
+
+class FrameRing:
+    """A fixed ring of frame buffers shared by one writer and one reader.
+
+    The writer never touches the newest slot or the slot the reader is
+    currently holding, so a frame returned by latest() stays valid until the
+    next call to latest(). Three slots is the minimum that guarantees the
+    writer always has somewhere to go.
+    """
+
+    def __init__(self, slots=3):
+        if slots < 3:
+            raise ValueError("FrameRing needs at least 3 slots")
+        self.slots = slots
+        self.buffers = None
+        self.sequence = [0] * slots
+        self.timestamp = [0.0] * slots
+        self.sensor_timestamp = [0] * slots
+        self.dropped = 0
+        self._cond = threading.Condition()
+        self._newest = -1
+        self._held = -1
+        self._next_seq = 1
+        self._last_read_seq = 0
+
+    def _free_slot(self):
+        for offset in range(1, self.slots + 1):
+            index = (self._newest + offset) % self.slots
+            if index != self._newest and index != self._held:
+                return index
+
+    def write(self, frame, timestamp, sensor_timestamp=0):
+        """Copy a frame (an array or tuple of arrays) into a free slot and publish it."""
+        with self._cond:
+            if self.buffers is None:
+                self.buffers = [_empty_like(frame) for _ in range(self.slots)]
+            index = self._free_slot()
+        # The slot is neither newest nor held, so the reader cannot pick it up
+        # while we are copying into it.
+        if isinstance(frame, tuple):
+            for buffer, array in zip(self.buffers[index], frame):
+                np.copyto(buffer, array)
+        else:
+            np.copyto(self.buffers[index], frame)
+        with self._cond:
+            self.sequence[index] = self._next_seq
+            self.timestamp[index] = timestamp
+            self.sensor_timestamp[index] = sensor_timestamp
+            self._next_seq += 1
+            self._newest = index
+            self._cond.notify()
+
+    def latest(self, timeout=1.0):
+        """Wait for a frame newer than the last one read and return it.
+
+        Returns (sequence, timestamp, sensor timestamp, frame), or None if no
+        new frame arrived within the timeout. Any frames published since the
+        previous read but never returned are added to the dropped count.
+        """
+        with self._cond:
+            if not self._cond.wait_for(self._has_new_frame, timeout):
+                return None
+            index = self._newest
+            self._held = index
+            seq = self.sequence[index]
+            if self._last_read_seq:
+                self.dropped += seq - self._last_read_seq - 1
+            self._last_read_seq = seq
+            return seq, self.timestamp[index], self.sensor_timestamp[index], self.buffers[index]
+
+    def _has_new_frame(self):
+        return self._newest >= 0 and self.sequence[self._newest] > self._last_read_seq
+
+
+def _empty_like(frame):
+    if isinstance(frame, tuple):
+        return tuple(np.empty_like(array) for array in frame)
+    return np.empty_like(frame)
+
+
+class FrameClock:
+    """Turns camera SensorTimestamps into time.monotonic() capture times.
+
+    libcamera normally stamps frames on the monotonic clock, in which case the
+    timestamp is used as it is. If it is on another clock (a recording being
+    replayed, say), the offset between the clocks is taken from the frame
+    that arrived soonest after its timestamp, so capture times are late by at
+    most the camera's smallest delivery delay.
+    """
+
+    MAX_DELAY = 1.0     # Seconds between exposure and delivery on the same clock
+
+    def __init__(self):
+        self.offset = None
+
+    def capture_time(self, sensor_timestamp, received=None):
+        """Monotonic capture time in seconds of a frame received at `received`."""
+        if received is None:
+            received = time.monotonic()
+        if not sensor_timestamp:
+            return received
+        sensor = sensor_timestamp / 1e9
+        delay = received - sensor
+        if self.offset is None or delay < self.offset:
+            self.offset = 0.0 if 0.0 <= delay < self.MAX_DELAY else delay
+        return sensor + self.offset
+
+
+class CaptureThread(threading.Thread):
+    """Continuously captures frames into a FrameRing.
+
+    grab is called with no arguments and returns the next frame, for example
+    picam2.capture_array. With a FrameClock, grab returns (frame, sensor
+    timestamp) instead and frames are stamped with their capture time.
+    """
+
+    def __init__(self, grab, ring, clock=None):
+        super().__init__(name="capture", daemon=True)
+        self.grab = grab
+        self.ring = ring
+        self.clock = clock
+        self.meter = RateMeter()
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                if self.clock is None:
+                    self.ring.write(self.grab(), time.monotonic())
+                else:
+                    frame, sensor_timestamp = self.grab()
+                    self.ring.write(frame, self.clock.capture_time(sensor_timestamp), sensor_timestamp)
+                self.meter.tick()
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=2.0)
+
+
+class RateMeter:
+    """Counts events and reports the rate over the last completed second."""
+
+    def __init__(self):
+        self.count = 0
+        self.rate = 0.0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def tick(self, n=1):
+        self.count += n
+        self._window_count += n
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.rate = self._window_count / elapsed
+            self._window_start = now
+            self._window_count = 0
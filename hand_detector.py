@@ -0,0 +1,319 @@
+#! /usr/bin/env python3
+
+# Region-of-interest hand detection with MediaPipe.
+
+# Running MediaPipe Hands on a full 1920x1080 frame is slow, and most of that
+# time goes into handling the large image: the models themselves only look at
+# a small, resized input. RoiHandDetector therefore searches for a hand on a
+# downscaled copy of the frame, and once it has one, runs the landmark model
+# on a small square crop around the previous landmarks instead. The crop is
+# shifted by the hand's velocity and widened by how far it may have moved, so
+# a moving hand stays inside it. Only when the hand is lost from the crop does
+# it go back to searching the whole (downscaled) frame. A caller that knows
+# where something moved (see cascade.py) can pass that region, and the search
+# then only looks at a crop around it.
+
+# Frames are passed in as the camera's RGB arrays, which is what MediaPipe
+# expects, so no colour conversion is needed. Landmarks are returned as
+# full-frame pixel coordinates.
+
+# HandDetectorPool runs detectors in worker processes, so an inference spike
+# never stalls capture, display or the servo. Each worker has a shared memory
+# frame buffer: the main process copies a frame into an idle worker's buffer
+# and sends it only a sequence number and timestamp, and the worker sends back
+# the landmarks as raw float32 bytes. Nothing is pickled. With several
+# workers, frames go to whichever is idle, in round-robin order; a frame that
+# arrives while all workers are busy is skipped.
+
+import collections
+import multiprocessing
+import signal
+import struct
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+WRIST = 0
+HAND_CONNECTIONS = list(mp.solutions.hands.HAND_CONNECTIONS)
+
+HandResult = collections.namedtuple("HandResult", "seq timestamp landmarks roi")
+
+_REQUEST = struct.Struct("<qd4i")       # seq, frame timestamp, search region (x, y, w, h; w = 0 for none)
+_RESULT = struct.Struct("<qdB3i")       # seq, frame timestamp, found, roi (x0, y0, side)
+
+
+def draw_hand(frame, landmarks, roi=None, color=(0, 0, 255), roi_color=(255, 255, 0)):
+    """Draw hand landmarks, and the tracking crop if any, on a full-size frame."""
+    points = landmarks.astype(np.int32)
+    for a, b in HAND_CONNECTIONS:
+        cv2.line(frame, tuple(points[a]), tuple(points[b]), (255, 255, 255), 2)
+    for x, y in points:
+        cv2.circle(frame, (int(x), int(y)), 4, color, -1)
+    if roi is not None:
+        x0, y0, side = roi
+        cv2.rectangle(frame, (x0, y0), (x0 + side, y0 + side), roi_color, 1)
+
+
+class RoiHandDetector:
+    """Finds one hand, tracking it on a crop around its last position."""
+
+    def __init__(self, detection_confidence=0.5, tracking_confidence=0.5, search_width=640,
+                 roi_size=256, roi_scale=2.0, full_frame=False):
+        # search_width: width of the downscaled frame used to find a hand
+        # roi_size: side of the square the tracking crop is resized to
+        # roi_scale: crop side relative to the longest side of the hand
+        # full_frame: always run on the full frame (the original behaviour)
+        self.search_width = search_width
+        self.roi_size = roi_size
+        self.roi_scale = roi_scale
+        self.full_frame = full_frame
+        self.mp_hands = mp.solutions.hands
+        options = dict(max_num_hands=1, min_detection_confidence=detection_confidence,
+                       min_tracking_confidence=tracking_confidence)
+        # The search and the crop get separate graphs, so the crop's
+        # frame-to-frame tracking stays valid. Searches may be on regions of
+        # any size, so each one runs the palm detector afresh.
+        self.search_hands = self.mp_hands.Hands(static_image_mode=not full_frame, **options)
+        self.roi_hands = self.mp_hands.Hands(static_image_mode=False, **options)
+        self.landmarks = None   # (21, 2) array of full-frame pixel coordinates
+        self.roi = None         # Last crop as (x0, y0, side)
+        self.velocity = np.zeros(2)
+        self.searches = 0
+        self.roi_hits = 0
+        self.roi_misses = 0
+        self._last_time = None
+        self._roi_image = np.empty((roi_size, roi_size, 3), np.uint8)
+        self._search_image = None
+
+    def process(self, frame, now=None, region=None):
+        """Detect the hand in an RGB frame; returns the landmarks or None.
+
+        region (x, y, w, h) limits a search to a crop around that area; it is
+        ignored while a hand is being tracked.
+        """
+        if now is None:
+            now = time.monotonic()
+        landmarks = None
+        if self.landmarks is not None and not self.full_frame:
+            landmarks = self._track(frame, now)
+            if landmarks is None:
+                self.roi_misses += 1
+            else:
+                self.roi_hits += 1
+        if landmarks is None:
+            landmarks = self._search(frame, region)
+            self.searches += 1
+
+        if landmarks is not None and self.landmarks is not None and self._last_time is not None:
+            dt = now - self._last_time
+            if dt > 0:
+                moved = (landmarks.mean(axis=0) - self.landmarks.mean(axis=0)) / dt
+                self.velocity = 0.5 * self.velocity + 0.5 * moved
+        elif landmarks is None:
+            self.velocity[:] = 0
+        self.landmarks = landmarks
+        self._last_time = now if landmarks is not None else None
+        return landmarks
+
+    def _detect(self, hands, image, x0, y0, width, height):
+        """Run a Hands graph and map its landmarks into a (x0, y0, width, height) region."""
+        results = hands.process(image)
+        if not results.multi_hand_landmarks:
+            return None
+        points = results.multi_hand_landmarks[0].landmark
+        landmarks = np.array([(p.x, p.y) for p in points], np.float64)
+        landmarks *= (width, height)
+        landmarks += (x0, y0)
+        return landmarks
+
+    def _search(self, frame, region=None):
+        height, width = frame.shape[:2]
+        self.roi = None
+        if self.full_frame:
+            return self._detect(self.search_hands, frame, 0, 0, width, height)
+        x0, y0, w, h = 0, 0, width, height
+        if region is not None:
+            x0, y0, w, h = self._search_region(region, width, height)
+        if (w, h) == (width, height) and width <= self.search_width:
+            return self._detect(self.search_hands, frame, 0, 0, width, height)
+        scale = min(1.0, self.search_width / w)
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        if self._search_image is None or self._search_image.shape[1::-1] != size:
+            self._search_image = np.empty((size[1], size[0], 3), np.uint8)
+        # Linear is several times faster than area averaging at this size, and
+        # the palm detector downsamples much further anyway
+        cv2.resize(frame[y0:y0 + h, x0:x0 + w], size, dst=self._search_image, interpolation=cv2.INTER_LINEAR)
+        # Landmarks are normalised, so they map straight back to the region
+        return self._detect(self.search_hands, self._search_image, x0, y0, w, h)
+
+    def _search_region(self, region, width, height):
+        """Widen a motion region into a search crop that can hold a whole hand."""
+        x, y, w, h = region
+        # Motion often covers only part of the hand, so pad it by half its
+        # size each way, and never search a crop smaller than the ROI size
+        side = max(w, h)
+        w = min(width, max(w + side, self.roi_size))
+        h = min(height, max(h + side, self.roi_size))
+        x0 = int(min(max(x + region[2] / 2 - w / 2, 0), width - w))
+        y0 = int(min(max(y + region[3] / 2 - h / 2, 0), height - h))
+        return x0, y0, int(w), int(h)
+
+    def _track(self, frame, now):
+        height, width = frame.shape[:2]
+        dt = now - self._last_time if self._last_time is not None else 0.0
+        low = self.landmarks.min(axis=0)
+        high = self.landmarks.max(axis=0)
+        # Lead the crop by the expected motion and widen it by the same amount
+        shift = self.velocity * dt
+        center = (low + high) / 2 + shift
+        side = max(high - low) * self.roi_scale + 2 * np.abs(shift).max()
+        side = int(min(max(side, 64), width, height))
+        x0 = int(min(max(center[0] - side / 2, 0), width - side))
+        y0 = int(min(max(center[1] - side / 2, 0), height - side))
+        self.roi = (x0, y0, side)
+        crop = frame[y0:y0 + side, x0:x0 + side]
+        interpolation = cv2.INTER_AREA if side > self.roi_size else cv2.INTER_LINEAR
+        cv2.resize(crop, (self.roi_size, self.roi_size), dst=self._roi_image, interpolation=interpolation)
+        return self._detect(self.roi_hands, self._roi_image, x0, y0, side, side)
+
+    @property
+    def wrist(self):
+        """The wrist position as integer pixels, or None."""
+        if self.landmarks is None:
+            return None
+        return int(self.landmarks[WRIST][0]), int(self.landmarks[WRIST][1])
+
+    def draw(self, frame):
+        """Draw the landmarks, and the tracking crop, on a frame of the same size."""
+        if self.landmarks is not None:
+            draw_hand(frame, self.landmarks, self.roi)
+
+    def summary(self):
+        return (f"Hand detector: {self.searches} searches, {self.roi_hits} tracked in crop, "
+                f"{self.roi_misses} lost from crop")
+
+    def close(self):
+        self.search_hands.close()
+        self.roi_hands.close()
+
+
+def _worker(conn, shm, shape, options):
+    """Worker process: detect hands in frames placed in shared memory."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # The main process handles Ctrl+C
+    detector = RoiHandDetector(**options)
+    frame = np.ndarray(shape, np.uint8, buffer=shm.buf)
+    try:
+        while True:
+            request = conn.recv_bytes()
+            if not request:
+                break
+            seq, timestamp, x, y, w, h = _REQUEST.unpack(request)
+            landmarks = detector.process(frame, timestamp, (x, y, w, h) if w else None)
+            roi = detector.roi or (0, 0, 0)
+            header = _RESULT.pack(seq, timestamp, landmarks is not None, *roi)
+            conn.send_bytes(header + (landmarks.astype(np.float32).tobytes() if landmarks is not None else b""))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        del frame
+        detector.close()
+
+
+class HandDetectorPool:
+    """RoiHandDetectors in worker processes, fed through shared memory frames.
+
+    Create it before any threads are started: the workers are forked.
+    """
+
+    def __init__(self, frame_shape, workers=1, **options):
+        self.frame_shape = tuple(frame_shape)
+        self.submitted = 0
+        self.skipped = 0
+        self.completed = 0
+        self.latest = None
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._next = 0
+        self._busy = [False] * workers
+        self._sent = {}
+        self._buffers = []
+        self._conns = []
+        self._processes = []
+        context = multiprocessing.get_context("fork")
+        size = int(np.prod(self.frame_shape))
+        for i in range(workers):
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, args=(child, shm, self.frame_shape, options),
+                                      name=f"hand-worker-{i}", daemon=True)
+            process.start()
+            child.close()
+            self._buffers.append((shm, np.ndarray(self.frame_shape, np.uint8, buffer=shm.buf)))
+            self._conns.append(parent)
+            self._processes.append(process)
+
+    def submit(self, frame, timestamp, region=None):
+        """Hand a frame to the next idle worker; returns False if all are busy."""
+        self.poll()
+        workers = len(self._busy)
+        for offset in range(workers):
+            i = (self._next + offset) % workers
+            if not self._busy[i]:
+                break
+        else:
+            self.skipped += 1
+            return False
+        self._next = (i + 1) % workers
+        np.copyto(self._buffers[i][1], frame)
+        self.submitted += 1
+        self._busy[i] = True
+        self._sent[self.submitted] = time.monotonic()
+        self._conns[i].send_bytes(_REQUEST.pack(self.submitted, timestamp, *(region or (0, 0, 0, 0))))
+        return True
+
+    def poll(self):
+        """Collect finished results; returns the newest result so far (or None)."""
+        for i, conn in enumerate(self._conns):
+            if not self._busy[i] or not conn.poll():
+                continue
+            message = conn.recv_bytes()
+            self._busy[i] = False
+            seq, timestamp, found, x0, y0, side = _RESULT.unpack_from(message)
+            latency = time.monotonic() - self._sent.pop(seq)
+            self.completed += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if self.latest is not None and seq < self.latest.seq:
+                continue    # A slower worker finishing an older frame
+            landmarks = None
+            if found:
+                landmarks = np.frombuffer(message, np.float32, offset=_RESULT.size).reshape(-1, 2).astype(np.float64)
+            self.latest = HandResult(seq, timestamp, landmarks, (x0, y0, side) if side else None)
+        return self.latest
+
+    def summary(self):
+        mean = 1000 * self.total_latency / self.completed if self.completed else 0.0
+        return (f"Hand workers: {len(self._processes)}, {self.completed} frames done, {self.skipped} skipped "
+                f"while busy, latency {mean:.1f} ms avg / {1000 * self.max_latency:.1f} ms max")
+
+    def close(self):
+        """Stop the workers and free the shared memory."""
+        for conn in self._conns:
+            try:
+                conn.send_bytes(b"")
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._conns:
+            conn.close()
+        memory = [shm for shm, _ in self._buffers]
+        self._buffers = []  # Drop the array views before closing their buffers
+        for shm in memory:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+
+# Background image writer.
+
+# Saving a picture on the hot path (color conversion, JPEG encoding and an SD
+# card write) can take tens of milliseconds. ImageWriter copies the frame into
+# a bounded queue and returns at once; a worker thread converts, encodes and
+# writes it. When the queue is full it either drops the oldest pending picture
+# ("drop_oldest", the default, so the caller never waits) or blocks ("block").
+
+import collections
+import threading
+import time
+
+import cv2
+import numpy as np
+
+POLICIES = ["drop_oldest", "block"]
+
+
+class ImageWriter:
+    """Writes images to disk on a worker thread from a bounded queue."""
+
+    def __init__(self, max_queue=8, jpeg_quality=90, png_compression=3, policy="drop_oldest"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.max_queue = max_queue
+        self.jpeg_quality = jpeg_quality
+        self.png_compression = png_compression
+        self.policy = policy
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.total_write_ms = 0.0
+        self.max_write_ms = 0.0
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="image-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self):
+        """Number of pictures waiting to be written."""
+        return len(self._queue)
+
+    def submit(self, path, frame, conversion=None):
+        """Queue a copy of frame to be written to path.
+
+        conversion is an optional cv2.cvtColor code applied on the worker
+        thread. Returns False if an older picture had to be dropped.
+        """
+        item = (path, np.copy(frame), conversion)
+        dropped = False
+        with self._cond:
+            if self.policy == "block":
+                self._cond.wait_for(lambda: len(self._queue) < self.max_queue)
+            elif len(self._queue) >= self.max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+                dropped = True
+            self._queue.append(item)
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._cond.notify_all()
+        return not dropped
+
+    def _params(self, path):
+        extension = path.rsplit(".", 1)[-1].lower()
+        if extension in ("jpg", "jpeg"):
+            return [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        if extension == "png":
+            return [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        return []
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or not self._running)
+                if not self._queue:
+                    return
+                path, frame, conversion = self._queue.popleft()
+                self._cond.notify_all()
+
+            start = time.perf_counter()
+            if conversion is not None:
+                frame = cv2.cvtColor(frame, conversion)
+            ok = cv2.imwrite(path, frame, self._params(path))
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+
+            with self._cond:
+                if ok:
+                    self.written += 1
+                    self.total_write_ms += elapsed_ms
+                    self.max_write_ms = max(self.max_write_ms, elapsed_ms)
+                else:
+                    self.failed += 1
+
+    def summary(self):
+        """A one-line description of queue depth and write latency."""
+        mean_ms = self.total_write_ms / self.written if self.written else 0.0
+        return (f"Image writer: {self.written} written, {self.dropped} dropped, {self.failed} failed, "
+                f"queue {self.depth}/{self.max_queue} (max {self.max_depth}), "
+                f"write {mean_ms:.1f} ms avg / {self.max_write_ms:.1f} ms max")
+
+    def close(self, timeout=5.0):
+        """Finish writing queued pictures and stop the worker."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout)
@@ -0,0 +1,265 @@
+#! /usr/bin/env python3
+
+# Hot-path instrumentation for the detection loops.
+
+# The loop calls start() at the top of every frame and mark("stage") after
+# each step; the time since the previous mark is added to that stage. Frames
+# that leave the loop early (a reference refresh, headless mode) simply have
+# fewer stages. Each stage keeps a count, a total, a maximum and a histogram
+# with fixed log-spaced buckets, so recording a time is a few integer
+# additions and never allocates. The histograms are kept twice: cumulative
+# for the Prometheus endpoint, and per window (since the last roll()) for the
+# p50/p95/p99 in the periodic log summary.
+
+# Latencies that do not fit the stage sequence, such as the time from a
+# frame's capture to the loop's decision or from a decision to the servo or
+# valve acting on it, are recorded with observe(name, seconds) into the same
+# kind of histogram. observe() may be called from other threads.
+
+# Timing can be switched off and on at runtime with enable()/disable(); while
+# it is off, start(), mark() and observe() are bound to a function that does
+# nothing. Counters (frames, drops, shots) are plain integers and always kept.
+
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bucket upper bounds: 20 us to ~1.3 s in steps of sqrt(2), plus +Inf
+BUCKET_BASE = 20e-6
+BUCKET_STEP = math.sqrt(2)
+BUCKET_COUNT = 33
+BUCKET_BOUNDS = [BUCKET_BASE * BUCKET_STEP ** i for i in range(BUCKET_COUNT)] + [math.inf]
+_LOG_STEP = math.log(BUCKET_STEP)
+
+
+def _bucket(seconds):
+    if seconds <= BUCKET_BASE:
+        return 0
+    return min(BUCKET_COUNT, int(math.ceil(math.log(seconds / BUCKET_BASE) / _LOG_STEP)))
+
+
+def _noop(*args):
+    pass
+
+
+class _Stage:
+    __slots__ = ("count", "total", "max", "buckets", "window", "previous")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (BUCKET_COUNT + 1)
+        self.window = [0] * (BUCKET_COUNT + 1)
+        self.previous = [0] * (BUCKET_COUNT + 1)
+
+    def quantile(self, q):
+        """Estimated q-quantile in seconds over the current and previous window."""
+        counts = [a + b for a, b in zip(self.window, self.previous)]
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                if i == 0:
+                    return min(BUCKET_BASE * (rank - seen) / n, self.max)
+                if i == BUCKET_COUNT:
+                    return self.max
+                # Interpolate within the bucket on a log scale
+                low = BUCKET_BOUNDS[i - 1]
+                return min(low * BUCKET_STEP ** ((rank - seen) / n), self.max)
+            seen += n
+        return self.max
+
+
+def _record(stage, elapsed):
+    stage.count += 1
+    stage.total += elapsed
+    if elapsed > stage.max:
+        stage.max = elapsed
+    i = _bucket(elapsed)
+    stage.buckets[i] += 1
+    stage.window[i] += 1
+
+
+class StageTimer:
+    """Per-stage latency histograms and counters for a processing loop."""
+
+    def __init__(self, enabled=True):
+        self.frames = 0
+        self.stages = {}
+        self.latencies = {}
+        self.counters = {}
+        self._last = None
+        self._lock = threading.Lock()
+        self.enabled = False
+        if enabled:
+            self.enable()
+        else:
+            self.disable()
+
+    def enable(self):
+        self.enabled = True
+        self.start = self._start
+        self.mark = self._mark
+        self.observe = self._observe
+
+    def disable(self):
+        self.enabled = False
+        self.start = _noop
+        self.mark = _noop
+        self.observe = _noop
+
+    def toggle(self):
+        self.disable() if self.enabled else self.enable()
+
+    def _start(self):
+        """Begin a new frame."""
+        self._last = time.perf_counter()
+        self.frames += 1
+
+    def _mark(self, name):
+        """Charge the time since the previous mark (or start) to a stage."""
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = _Stage()
+        _record(stage, elapsed)
+
+    def _observe(self, name, seconds):
+        """Record a latency measured outside the stage sequence."""
+        with self._lock:
+            latency = self.latencies.get(name)
+            if latency is None:
+                latency = self.latencies[name] = _Stage()
+            _record(latency, max(seconds, 0.0))
+
+    def count(self, name, n=1):
+        """Add n to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set_count(self, name, value):
+        """Set a counter that is kept elsewhere, such as a drop count."""
+        self.counters[name] = value
+
+    def roll(self):
+        """Start a new percentile window; the previous one is still included."""
+        with self._lock:
+            for stage in list(self.stages.values()) + list(self.latencies.values()):
+                stage.previous, stage.window = stage.window, stage.previous
+                stage.window[:] = [0] * len(stage.window)
+
+    @staticmethod
+    def _stats(stages):
+        return {name: {"count": s.count, "mean_ms": 1000 * s.total / s.count, "max_ms": 1000 * s.max,
+                       "p50_ms": 1000 * s.quantile(0.5), "p95_ms": 1000 * s.quantile(0.95),
+                       "p99_ms": 1000 * s.quantile(0.99)}
+                for name, s in list(stages.items()) if s.count}
+
+    def stats(self):
+        """{stage: {"count", "mean_ms", "max_ms", "p50_ms", "p95_ms", "p99_ms"}} in first-seen order."""
+        return self._stats(self.stages)
+
+    def latency_stats(self):
+        """The same statistics for the latencies recorded with observe()."""
+        with self._lock:
+            return self._stats(self.latencies)
+
+    def latency_summary(self):
+        """One log line with p50/p95/p99 per latency."""
+        parts = [f"{name} {s['p50_ms']:.1f}/{s['p95_ms']:.1f}/{s['p99_ms']:.1f}"
+                 for name, s in self.latency_stats().items()]
+        if not self.enabled:
+            parts = ["timers off"]
+        return "Latency (ms p50/p95/p99): " + (", ".join(parts) or "none yet")
+
+    def summary(self):
+        """One log line with p50/p95/p99 per stage and the counters."""
+        if not self.enabled:
+            parts = ["timers off"]
+        else:
+            parts = [f"{name} {s['p50_ms']:.2f}/{s['p95_ms']:.2f}/{s['p99_ms']:.2f}"
+                     for name, s in self.stats().items()] or ["no frames"]
+        counters = ", ".join(f"{name} {value}" for name, value in self.counters.items())
+        return "Stages (ms p50/p95/p99): " + ", ".join(parts) + (f"; {counters}" if counters else "")
+
+    def prometheus(self, prefix):
+        """The metrics in the Prometheus text exposition format."""
+        lines = [f"# HELP {prefix}_stage_seconds Time spent in each stage of the loop",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        stages = list(self.stages.items())
+        for name, s in stages:
+            cumulative = 0
+            for bound, n in zip(BUCKET_BOUNDS, s.buckets):
+                cumulative += n
+                le = "+Inf" if bound == math.inf else f"{bound:.6g}"
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {s.total:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {s.count}')
+        lines += [f"# HELP {prefix}_stage_quantile_seconds Recent stage time percentiles",
+                  f"# TYPE {prefix}_stage_quantile_seconds gauge"]
+        for name, s in stages:
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'{prefix}_stage_quantile_seconds{{stage="{name}",quantile="{q}"}} {s.quantile(q):.6f}')
+        with self._lock:
+            latencies = [(name, s.total, s.count, list(s.buckets), s.quantile(0.5), s.quantile(0.95),
+                          s.quantile(0.99)) for name, s in self.latencies.items()]
+        if latencies:
+            lines += [f"# HELP {prefix}_latency_seconds Capture, decision and actuation latencies",
+                      f"# TYPE {prefix}_latency_seconds histogram"]
+        for name, total, count, buckets, *_ in latencies:
+            cumulative = 0
+            for bound, n in zip(BUCKET_BOUNDS, buckets):
+                cumulative += n
+                le = "+Inf" if bound == math.inf else f"{bound:.6g}"
+                lines.append(f'{prefix}_latency_seconds_bucket{{latency="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_latency_seconds_sum{{latency="{name}"}} {total:.6f}')
+            lines.append(f'{prefix}_latency_seconds_count{{latency="{name}"}} {count}')
+        if latencies:
+            lines += [f"# HELP {prefix}_latency_quantile_seconds Recent latency percentiles",
+                      f"# TYPE {prefix}_latency_quantile_seconds gauge"]
+        for name, _, _, _, *quantiles in latencies:
+            for q, value in zip((0.5, 0.95, 0.99), quantiles):
+                lines.append(f'{prefix}_latency_quantile_seconds{{latency="{name}",quantile="{q}"}} {value:.6f}')
+        lines += [f"# TYPE {prefix}_timers_enabled gauge", f"{prefix}_timers_enabled {int(self.enabled)}"]
+        for name, value in list(self.counters.items()):
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves a StageTimer as Prometheus text at /metrics on localhost."""
+
+    def __init__(self, timer, port, prefix, host="127.0.0.1"):
+        self.timer = timer
+        self.prefix = prefix
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = server.timer.prometheus(server.prefix).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
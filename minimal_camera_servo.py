@@ -3,74 +3,272 @@
 Hand Tracking Camera and Servo Control for Raspberry Pi 5 with Arducam 64MP OV64A40
 This script demonstrates hand tracking with camera capture and servo motor control.
 The servo will follow your hand movements automatically.
+
+Run with --headless to skip all display work (no window, overlays or resize),
+and with --preview PORT to watch an on-demand MJPEG stream on localhost.
+
+A cheap motion gate runs on every frame, and MediaPipe only runs while
+something moves (or a hand is being tracked), searching near the motion.
+With nobody in front of the camera, hand detection costs nothing.
+--no-gate runs it on every frame.
+
+After IDLE_DELAY seconds without motion or a hand, the camera and the loop
+drop to IDLE_FRAME_RATE, and return to FRAME_RATE as soon as anything moves.
+--idle-fps 0 keeps the full rate.
+
+Once a hand is found, MediaPipe runs only every HAND_FLOW_INTERVAL frames.
+In between, the hand is followed with sparse optical flow on a crop around
+it (see optical_flow.py), and the landmarks move with it. Detection runs
+early if the flow loses the hand. --flow 0 runs MediaPipe on every frame.
+
+Frames are timed by the camera's SensorTimestamp, so the hand prediction and
+the gate work on when a frame was captured. The latency from capture to the
+servo decision, and from the decision to the servo command, is printed with
+the stage timings.
 """
 
+import argparse
+import signal
 import time
 import cv2
 import lgpio
 from picamera2 import Picamera2
 import datetime
-import mediapipe as mp
 import numpy as np
+from cascade import GatedStage, MotionGate
+from frame_capture import FrameClock
+from hand_detector import HandDetectorPool, RoiHandDetector, draw_hand
+from image_writer import ImageWriter
+from metrics import MetricsServer, StageTimer
+from optical_flow import FlowTracker
+from predictor import KalmanPredictor
+from power import PowerScheduler
+from servo import ServoDriver
+from preview import OverlayText, PreviewServer
 
 # Configuration
 SERVO_PIN = 18              # GPIO pin for servo (PWM)
 SERVO_MIN_PULSE = 800       # Minimum pulse width in microseconds
 SERVO_MAX_PULSE = 2200      # Maximum pulse width in microseconds
 SERVO_CENTER = (SERVO_MIN_PULSE + SERVO_MAX_PULSE) // 2
+SERVO_DEADBAND = 8          # Changes smaller than this (us) are not sent to the servo
+SERVO_MAX_SLEW = 4000       # Fastest servo movement in us per second
+SERVO_UPDATE_RATE = 50      # Servo commands per second at most
 
 # Camera settings
 FRAME_WIDTH = 1920          # Use higher resolution for Arducam 64MP
 FRAME_HEIGHT = 1080
+FRAME_RATE = 30             # Frame rate while a hand or motion is seen
+IDLE_FRAME_RATE = 5         # Frame rate while nothing moves; 0 disables
+IDLE_DELAY = 30             # Seconds without motion or a hand before dropping to IDLE_FRAME_RATE
 
 # Hand tracking settings
 HAND_TRACKING_CONFIDENCE = 0.5
 HAND_DETECTION_CONFIDENCE = 0.5
 SMOOTHING_FACTOR = 0.2      # Lower = more smoothing, higher = more responsive
+HAND_SEARCH_WIDTH = 640     # Frames are downscaled to this width to search for a hand
+HAND_ROI_SIZE = 256         # A found hand is tracked on a crop resized to this square
+HAND_ROI_SCALE = 2.0        # Crop side relative to the size of the hand
+HAND_WORKERS = 1            # Inference worker processes (0 runs inference in the main loop)
+HAND_RESULT_MAX_AGE = 0.5   # Seconds after which a worker's last result no longer counts
+HAND_GATE_WIDTH = 160       # Width of the tiny frame the motion gate compares
+HAND_GATE_THRESHOLD = 15    # Change in brightness (0-255) that counts as motion
+HAND_GATE_MIN_FRACTION = 0.002 # Fraction of the tiny frame that must change to run detection
+HAND_GATE_COOLDOWN = 3.0    # Seconds detection keeps running after the last motion
+HAND_FLOW_INTERVAL = 5      # MediaPipe every this many frames while the hand is followed by optical flow; 0 disables
+HAND_FLOW_POINTS = 20       # Corners followed inside the hand
+HAND_FLOW_MIN_CONFIDENCE = 0.5 # Fraction of the corners still followed; below it MediaPipe runs again
+HAND_FLOW_MARGIN = 80       # Pixels the hand may move between frames and still be followed
+AIM_LATENCY = 0.15          # Seconds from frame capture until the servo reaches its position; 0 disables prediction
+
+# Display settings
+DISPLAY_WIDTH = 1280        # Size of the monitor window
+DISPLAY_HEIGHT = 720
+PREVIEW_MAX_FPS = 5         # Frame rate cap of the MJPEG preview stream
+PREVIEW_JPEG_QUALITY = 70   # JPEG quality of the MJPEG preview stream
+
+# Photo settings
+PHOTO_JPEG_QUALITY = 95     # JPEG quality of photos saved with 's'
+PHOTO_QUEUE_SIZE = 4        # Photos waiting to be written before the oldest is dropped
+
+# Instrumentation settings
+STAGE_TIMERS = True         # Time every stage of the loop; SIGUSR1 toggles this while running
+METRICS_REPORT_INTERVAL = 30 # Seconds between stage timing summaries
 
 class HandTracker:
-    def __init__(self):
-        self.mp_hands = mp.solutions.hands
-        self.hands = self.mp_hands.Hands(
-            static_image_mode=False,
-            max_num_hands=1,
-            min_detection_confidence=HAND_DETECTION_CONFIDENCE,
-            min_tracking_confidence=HAND_TRACKING_CONFIDENCE
+    def __init__(self, workers=0, flow_interval=0):
+        # Searches a downscaled frame, then tracks the hand on a small crop.
+        # With workers, detection runs in separate processes and the latest
+        # finished result is used. With a flow_interval, the hand is followed
+        # by optical flow and detection only runs every flow_interval frames.
+        options = dict(
+            detection_confidence=HAND_DETECTION_CONFIDENCE,
+            tracking_confidence=HAND_TRACKING_CONFIDENCE,
+            search_width=HAND_SEARCH_WIDTH,
+            roi_size=HAND_ROI_SIZE,
+            roi_scale=HAND_ROI_SCALE
         )
-        self.mp_drawing = mp.solutions.drawing_utils
+        self.detector = None
+        self.pool = None
+        if workers:
+            self.pool = HandDetectorPool((FRAME_HEIGHT, FRAME_WIDTH, 3), workers, **options)
+        else:
+            self.detector = RoiHandDetector(**options)
+        self.flow = None
+        if flow_interval > 1:
+            self.flow = FlowTracker(flow_interval, HAND_FLOW_POINTS, min_confidence=HAND_FLOW_MIN_CONFIDENCE,
+                                    margin=HAND_FLOW_MARGIN)
+        self.landmarks = None
+        self.roi = None
+        self.hand_time = None   # Capture time of the frame the landmarks came from
+        self._seq = None        # Sequence number of the last worker result used
+        self._flow_offset = np.zeros(2)  # Total shift the flow has followed, in pixels
+        self._submitted = {}    # Frame time -> flow offset, for frames sent to the workers
+        self.hand_center = None
         self.last_servo_position = SERVO_CENTER
+        self.predictor = KalmanPredictor()
         
-    def process_frame(self, frame):
-        """Process frame for hand detection and return hand position"""
-        # Convert BGR to RGB for MediaPipe
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = self.hands.process(rgb_frame)
-        
-        hand_center = None
-        
-        if results.multi_hand_landmarks:
-            for hand_landmarks in results.multi_hand_landmarks:
-                # Draw hand landmarks
-                self.mp_drawing.draw_landmarks(
-                    frame, hand_landmarks, self.mp_hands.HAND_CONNECTIONS)
-                
-                # Get hand center (using wrist landmark)
-                wrist = hand_landmarks.landmark[self.mp_hands.HandLandmark.WRIST]
-                hand_center = (int(wrist.x * frame.shape[1]), int(wrist.y * frame.shape[0]))
-                
-                # Draw circle at hand center
-                cv2.circle(frame, hand_center, 10, (0, 255, 0), -1)
-                
-        return hand_center, frame
+    def process_frame(self, frame, frame_time=None, region=None):
+        """Process an RGB camera frame for hand detection and return hand position.
+
+        region (x, y, w, h) is where motion was seen; the search looks there.
+        """
+        if frame_time is None:
+            frame_time = time.monotonic()
+        # Follow the hand with optical flow until a detection is due. Workers
+        # answer a few frames later, so with them the flow also keeps the
+        # hand moving while a detection is in flight.
+        flow = self.flow
+        detect = True
+        if flow is not None and flow.active and (self.pool is not None or not flow.due()):
+            detect = flow.due()
+            if not self._follow(frame, frame_time):
+                detect = True
+            elif not detect and self.pool is None:
+                return self._update_center()
+
+        if self.pool is None:
+            self.landmarks = self.detector.process(frame, frame_time, region)
+            self.roi = self.detector.roi
+            self.hand_time = frame_time
+            fresh = True
+        else:
+            if detect and self.pool.submit(frame, frame_time, region) and flow is not None:
+                self._submitted[frame_time] = self._flow_offset
+            fresh = self._collect(frame_time)
+        # A new detection seeds the flow again, on this frame
+        if flow is not None and fresh:
+            if self.landmarks is None:
+                flow.reset()
+            else:
+                low = self.landmarks.min(axis=0)
+                flow.seed(frame, (*low, *(self.landmarks.max(axis=0) - low)))
+        return self._update_center()
+    
+    def skip_frame(self, frame_time):
+        """Run no detection on this frame; only pick up results still in flight"""
+        if self.pool is None:
+            self.landmarks = self.roi = None
+            if self.flow is not None:
+                self.flow.reset()
+        else:
+            self._collect(frame_time)
+        return self._update_center()
+    
+    def _follow(self, frame, frame_time):
+        """Move the landmarks with the optical flow; False if the flow lost the hand"""
+        if self.landmarks is None:
+            return False
+        x, y = self.flow.box[:2]
+        box = self.flow.follow(frame)
+        if box is None:
+            return False
+        shift = np.array((box[0] - x, box[1] - y))
+        self._flow_offset = self._flow_offset + shift
+        self.landmarks = self.landmarks + shift
+        if self.roi is not None:
+            self.roi = (int(self.roi[0] + shift[0]), int(self.roi[1] + shift[1]), self.roi[2])
+        self.hand_time = frame_time
+        return True
+    
+    def _collect(self, frame_time):
+        """Pick up the newest worker result; True if it is one not used before"""
+        result = self.pool.poll()
+        if result is None or frame_time - result.timestamp > HAND_RESULT_MAX_AGE:
+            self.landmarks = self.roi = None
+            if self.flow is not None:
+                self.flow.reset()
+            return False
+        if result.seq == self._seq:
+            if self.flow is None:
+                self.landmarks, self.roi = result.landmarks, result.roi
+            return False    # With flow, keep the landmarks it has moved since
+        self._seq = result.seq
+        self.landmarks, self.roi, self.hand_time = result.landmarks, result.roi, result.timestamp
+        if self.flow is not None and result.timestamp in self._submitted:
+            # The result is a few frames old: move it on by what the flow
+            # has seen since that frame
+            shift = self._flow_offset - self._submitted[result.timestamp]
+            self._submitted = {t: o for t, o in self._submitted.items() if t > result.timestamp}
+            if self.landmarks is not None:
+                self.landmarks = self.landmarks + shift
+                if self.roi is not None:
+                    self.roi = (int(self.roi[0] + shift[0]), int(self.roi[1] + shift[1]), self.roi[2])
+                self.hand_time = frame_time
+        return True
+    
+    def _update_center(self):
+        # Get hand center (using wrist landmark)
+        self.hand_center = None
+        if self.landmarks is not None:
+            wrist = self.landmarks[0]
+            self.hand_center = (int(wrist[0]), int(wrist[1]))
+        return self.hand_center
+    
+    def draw(self, frame):
+        """Draw the hand landmarks and a circle at the hand center"""
+        if self.landmarks is not None:
+            draw_hand(frame, self.landmarks, self.roi)
+            cv2.circle(frame, self.hand_center, 10, (0, 255, 0), -1)
     
-    def calculate_servo_position(self, hand_center, frame_width):
+    def summary(self):
+        text = self.pool.summary() if self.pool is not None else self.detector.summary()
+        if self.flow is not None:
+            text += "\n" + self.flow.summary()
+        return text
+    
+    @property
+    def inference_cost(self):
+        """Mean seconds per inference in the workers, or None when it runs in this process"""
+        if self.pool is None or not self.pool.completed:
+            return None
+        return self.pool.total_latency / self.pool.completed
+    
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        else:
+            self.detector.close()
+    
+    def calculate_servo_position(self, hand_center, frame_width, frame_time=None, aim_time=None):
         """Calculate servo position based on hand center position"""
         if hand_center is None:
             return self.last_servo_position
         
+        # Aim where the hand will be when the servo gets there. A result
+        # from a worker may be reused for several frames; it only updates
+        # the predictor once.
+        if frame_time is None:
+            frame_time = time.monotonic()
+        if self.predictor.t is None or frame_time > self.predictor.t:
+            self.predictor.update(hand_center, frame_time)
+        if aim_time is None:
+            aim_time = frame_time + AIM_LATENCY
+        hand_x = self.predictor.predict(aim_time)[0]
+        hand_x = max(0, min(frame_width, hand_x))
+        
         # Map hand x-position to servo range
         # Left side of frame = minimum pulse, right side = maximum pulse
-        hand_x = hand_center[0]
         
         # Normalize hand position (0.0 to 1.0)
         normalized_x = hand_x / frame_width
@@ -92,6 +290,31 @@ class HandTracker:
         return int(smoothed_position)
 
 def main():
+    parser = argparse.ArgumentParser(description="Hand tracking camera and servo control")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without a monitor window; no display work is done")
+    parser.add_argument("--preview", type=int, metavar="PORT",
+                        help="serve an MJPEG preview on http://127.0.0.1:PORT/")
+    parser.add_argument("--metrics", type=int, metavar="PORT",
+                        help="serve stage timings and counters on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--no-timers", action="store_true",
+                        help="start with the stage timers off (SIGUSR1 turns them on)")
+    parser.add_argument("--workers", type=int, default=HAND_WORKERS,
+                        help="hand inference worker processes; 0 runs inference in the main loop")
+    parser.add_argument("--flow", type=int, default=HAND_FLOW_INTERVAL, metavar="N",
+                        help="follow the hand with optical flow, running MediaPipe every N frames; 0 disables")
+    parser.add_argument("--no-gate", action="store_true",
+                        help="run hand detection on every frame, not only when something moves")
+    parser.add_argument("--idle-fps", type=float, default=IDLE_FRAME_RATE,
+                        help="frame rate while nothing moves; 0 always runs at full rate")
+    parser.add_argument("--idle-delay", type=float, default=IDLE_DELAY,
+                        help="seconds without motion or a hand before dropping to the idle frame rate")
+    args = parser.parse_args()
+
+    # Initialize hand tracker. Its worker processes are started first, while
+    # this process has no other threads.
+    hand_tracker = HandTracker(args.workers, args.flow)
+
     # Initialize GPIO
     try:
         h = lgpio.gpiochip_open(0)
@@ -99,6 +322,7 @@ def main():
         print("GPIO initialized successfully")
     except Exception as e:
         print(f"Failed to initialize GPIO: {e}")
+        hand_tracker.close()
         return
 
     # Initialize Camera
@@ -109,7 +333,7 @@ def main():
         config = picam2.create_video_configuration(
             main={"size": (FRAME_WIDTH, FRAME_HEIGHT), "format": "RGB888"},
             controls={
-                "FrameRate": 30,
+                "FrameRate": FRAME_RATE,
                 "ExposureTime": 10000,  # 10ms exposure
                 "AnalogueGain": 1.0
             }
@@ -124,17 +348,54 @@ def main():
     except Exception as e:
         print(f"Failed to initialize camera: {e}")
         lgpio.gpiochip_close(h)
+        hand_tracker.close()
         return
 
-    # Initialize hand tracker
-    hand_tracker = HandTracker()
-    
     # Set servo to center position
-    lgpio.tx_servo(h, SERVO_PIN, SERVO_CENTER, 50)
+    servo = ServoDriver(h, SERVO_PIN, SERVO_CENTER, min_pulse=SERVO_MIN_PULSE, max_pulse=SERVO_MAX_PULSE,
+                        deadband=SERVO_DEADBAND, max_slew=SERVO_MAX_SLEW, rate=SERVO_UPDATE_RATE)
     print(f"Servo set to center position ({SERVO_CENTER}μs)")
+
+    # Display: each line of text is a cached overlay, re-rendered only when it changes
+    preview = None
+    if args.preview:
+        preview = PreviewServer(args.preview, max_fps=PREVIEW_MAX_FPS, quality=PREVIEW_JPEG_QUALITY)
+        print(f"MJPEG preview on http://127.0.0.1:{args.preview}/")
+    time_overlay = OverlayText((10, 30), 0.7, (0, 255, 0), 2)
+    servo_overlay = OverlayText((10, 70), 0.7, (0, 255, 0), 2)
+    autofocus_overlay = OverlayText((10, 110), 0.7, (0, 255, 0), 2)
+    tracking_overlay = OverlayText((10, 150), 0.7, (0, 255, 0), 2)
+    hand_overlay = OverlayText((10, 190), 0.7, (0, 255, 0), 2)
+    status_overlays = {
+        True: OverlayText((FRAME_WIDTH - 200, 50), 1, (0, 255, 0), 3),
+        False: OverlayText((FRAME_WIDTH - 200, 50), 1, (0, 0, 255), 3),
+    }
+    status_overlays[True].set_text("TRACKING")
+    status_overlays[False].set_text("NO HAND")
+
+    # Photos are encoded and written on a background thread
+    image_writer = ImageWriter(PHOTO_QUEUE_SIZE, jpeg_quality=PHOTO_JPEG_QUALITY)
+
+    # Stage timers, served on localhost and summarised periodically
+    timer = StageTimer(enabled=STAGE_TIMERS and not args.no_timers)
+    metrics_server = None
+    if args.metrics:
+        metrics_server = MetricsServer(timer, args.metrics, "handtracker")
+        print(f"Metrics on http://127.0.0.1:{args.metrics}/metrics")
+    signal.signal(signal.SIGUSR1, lambda signum, frame: timer.toggle())
+    servo.observe = lambda name, seconds: timer.observe(name, seconds)
+    frame_clock = FrameClock()
+    last_report = time.monotonic()
+
+    # Hand detection only runs while the motion gate is open
+    motion_gate = MotionGate(HAND_GATE_WIDTH, HAND_GATE_THRESHOLD, HAND_GATE_MIN_FRACTION)
+    hand_stage = GatedStage("Hand detection", HAND_GATE_COOLDOWN)
+    power = PowerScheduler(picam2, FRAME_RATE, args.idle_fps, args.idle_delay)
     
     try:
         print("Starting hand tracking camera and servo control...")
+        if args.headless:
+            print("Running headless. Press Ctrl-C to quit.")
         print("Controls:")
         print("- 't' key: Toggle hand tracking mode")
         print("- 'a' key: Move servo left (manual mode)")
@@ -146,51 +407,102 @@ def main():
         print("\nHand tracking is ENABLED by default")
         
         servo_position = SERVO_CENTER
+        display_frame = None    # Display buffers, allocated on the first frame and reused
+        window_frame = None
         autofocus_enabled = True
         hand_tracking_enabled = True
         
         while True:
-            # Capture frame
-            frame = picam2.capture_array()
-            
-            # Convert RGB to BGR for OpenCV display and hand tracking
-            display_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            power.pace()    # While idle, wait for the next (slower) frame slot
+            timer.start()
+            timer.count("frames")
+            if time.monotonic() - last_report >= METRICS_REPORT_INTERVAL:
+                last_report = time.monotonic()
+                print(timer.summary())
+                print(timer.latency_summary())
+                print(servo.summary())
+                print(hand_stage.summary(motion_gate.time, hand_tracker.inference_cost))
+                if hand_tracker.flow is not None:
+                    print(hand_tracker.flow.summary())
+                print(power.summary())
+                timer.roll()
+
+            # Capture frame, timed by when the sensor captured it
+            (frame,), metadata = picam2.capture_arrays(["main"])
+            frame_time = frame_clock.capture_time(metadata.get("SensorTimestamp", 0))
+            timer.mark("capture")
             
-            # Process hand tracking if enabled
+            # Process hand tracking if enabled. MediaPipe takes the RGB
+            # camera frame as it is, and only runs while something moves or
+            # a hand is being tracked; a new search starts where the motion is.
             hand_center = None
+            moved = False
             if hand_tracking_enabled:
-                hand_center, display_frame = hand_tracker.process_frame(display_frame)
+                moved = motion_gate.detect(frame)
+                gate_open = hand_stage.gate(moved, frame_time)
+                timer.mark("gate")
+                if args.no_gate or gate_open or hand_tracker.landmarks is not None:
+                    region = motion_gate.region if hand_tracker.landmarks is None else None
+                    hand_center = hand_stage.run(hand_tracker.process_frame, frame, frame_time, region)
+                else:
+                    hand_center = hand_tracker.skip_frame(frame_time)
+                    hand_stage.skip()
+                timer.mark("hands")
                 
                 # Update servo position based on hand tracking
                 if hand_center is not None:
-                    servo_position = hand_tracker.calculate_servo_position(hand_center, FRAME_WIDTH)
-                    lgpio.tx_servo(h, SERVO_PIN, servo_position, 50)
+                    timer.count("hands_detected")
+                    servo_position = hand_tracker.calculate_servo_position(
+                        hand_center, FRAME_WIDTH, hand_tracker.hand_time, frame_time + AIM_LATENCY)
+                    servo.set(servo_position)
+                    timer.observe("capture_to_decision", time.monotonic() - frame_time)
+                    timer.mark("servo")
+
+            # Full frame rate from the first motion until nothing has moved
+            # for IDLE_DELAY seconds; manual mode always runs at full rate
+            power_state = power.update(moved or hand_center is not None or not hand_tracking_enabled, frame_time)
+            if power_state is not None:
+                print(f"Power state {power_state}: {power.fps:g} fps")
             
+            # Skip all display work unless there is a window or a preview client
+            preview_wanted = preview is not None and preview.wants_frame()
+            if args.headless and not preview_wanted:
+                continue
+
+            # Convert RGB to BGR for OpenCV display, into the buffer of the last frame
+            display_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=display_frame)
+            if hand_center is not None:
+                hand_tracker.draw(display_frame)
+            timer.mark("convert")
+
             # Add information overlay
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cv2.putText(display_frame, f"Time: {timestamp}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-            cv2.putText(display_frame, f"Servo: {servo_position}μs", (10, 70), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-            cv2.putText(display_frame, f"Autofocus: {'ON' if autofocus_enabled else 'OFF'}", (10, 110), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-            cv2.putText(display_frame, f"Hand Tracking: {'ON' if hand_tracking_enabled else 'OFF'}", (10, 150), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+            time_overlay.set_text(f"Time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            servo_overlay.set_text(f"Servo: {servo_position}μs")
+            autofocus_overlay.set_text(f"Autofocus: {'ON' if autofocus_enabled else 'OFF'}")
+            tracking_overlay.set_text(f"Hand Tracking: {'ON' if hand_tracking_enabled else 'OFF'}")
+            for overlay in (time_overlay, servo_overlay, autofocus_overlay, tracking_overlay):
+                overlay.draw(display_frame)
             
             if hand_center and hand_tracking_enabled:
-                cv2.putText(display_frame, f"Hand: ({hand_center[0]}, {hand_center[1]})", (10, 190), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                hand_overlay.set_text(f"Hand: ({hand_center[0]}, {hand_center[1]})")
+                hand_overlay.draw(display_frame)
             
             # Add tracking status indicator
-            status_color = (0, 255, 0) if hand_center else (0, 0, 255)
-            status_text = "TRACKING" if hand_center else "NO HAND"
-            cv2.putText(display_frame, status_text, (FRAME_WIDTH - 200, 50), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, status_color, 3)
+            status_overlays[hand_center is not None].draw(display_frame)
+
+            timer.mark("overlay")
+
+            if preview_wanted:
+                preview.publish(display_frame)
+            if args.headless:
+                timer.mark("display")
+                continue
             
             # Resize for display (optional - makes window more manageable)
-            display_frame = cv2.resize(display_frame, (1280, 720))
+            window_frame = cv2.resize(display_frame, (DISPLAY_WIDTH, DISPLAY_HEIGHT), dst=window_frame)
             
-            cv2.imshow("Hand Tracking - Arducam 64MP OV64A40", display_frame)
+            cv2.imshow("Hand Tracking - Arducam 64MP OV64A40", window_frame)
+            timer.mark("display")
             
             # Handle key presses
             key = cv2.waitKey(1) & 0xFF
@@ -202,24 +514,23 @@ def main():
                 print(f"Hand tracking {'enabled' if hand_tracking_enabled else 'disabled'}")
             elif key == ord('a') and not hand_tracking_enabled:  # Move servo left (manual mode only)
                 servo_position = max(SERVO_MIN_PULSE, servo_position - 100)
-                lgpio.tx_servo(h, SERVO_PIN, servo_position, 50)
+                servo.set(servo_position)
                 print(f"Servo moved left to {servo_position}μs")
             elif key == ord('d') and not hand_tracking_enabled:  # Move servo right (manual mode only)
                 servo_position = min(SERVO_MAX_PULSE, servo_position + 100)
-                lgpio.tx_servo(h, SERVO_PIN, servo_position, 50)
+                servo.set(servo_position)
                 print(f"Servo moved right to {servo_position}μs")
             elif key == ord('c'):  # Center servo
                 servo_position = SERVO_CENTER
                 hand_tracker.last_servo_position = SERVO_CENTER  # Reset smoothing
-                lgpio.tx_servo(h, SERVO_PIN, servo_position, 50)
+                servo.set(servo_position)
                 print(f"Servo centered at {servo_position}μs")
             elif key == ord('s'):  # Save photo
                 filename = f"photo_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-                # Save full resolution image
-                full_frame = picam2.capture_array()
-                bgr_frame = cv2.cvtColor(full_frame, cv2.COLOR_RGB2BGR)
-                cv2.imwrite(filename, bgr_frame)
-                print(f"Photo saved as {filename}")
+                # Save the current full resolution frame (without overlays)
+                image_writer.submit(filename, frame, cv2.COLOR_RGB2BGR)
+                timer.count("photos")
+                print(f"Photo queued as {filename}")
             elif key == ord('f'):  # Toggle autofocus
                 autofocus_enabled = not autofocus_enabled
                 if autofocus_enabled:
@@ -237,10 +548,24 @@ def main():
     finally:
         # Cleanup
         print("Cleaning up...")
-        lgpio.tx_servo(h, SERVO_PIN, 0, 0)  # Disable servo PWM
+        servo.close()  # Stop sending and disable servo PWM
+        print(servo.summary())
+        print(timer.summary())
+        print(timer.latency_summary())
+        print(hand_stage.summary(motion_gate.time, hand_tracker.inference_cost))
+        print(power.summary())
+        if metrics_server is not None:
+            metrics_server.close()
         lgpio.gpiochip_close(h)
         picam2.stop()
-        cv2.destroyAllWindows()
+        if preview is not None:
+            preview.close()
+        image_writer.close()
+        print(image_writer.summary())
+        hand_tracker.close()
+        print(hand_tracker.summary())
+        if not args.headless:
+            cv2.destroyAllWindows()
         print("Done!")
 
 if __name__ == "__main__":
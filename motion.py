@@ -0,0 +1,328 @@
+#! /usr/bin/env python3
+
+# Multi-resolution motion detection helpers for the Water Blaster.
+
+# In pyramid mode the background model runs on a frame downscaled by 1/2, 1/4
+# or 1/8, which is where the candidate target is found. The expensive
+# full-resolution blur, difference and contour steps then run only inside the
+# bounding rectangle of that candidate, and the refined rectangle is mapped
+# back to full frame coordinates for drawing and aiming.
+
+# Blobs are extracted from the threshold mask by one of two backends.
+# "contours" traces every outline with findContours and measures each one in
+# a Python loop, which gets slow on a noisy mask with hundreds of specks.
+# "components" labels the mask with connectedComponentsWithStats, which
+# returns the area and bounding box of every blob in one call, and filters
+# them with NumPy. Its area is the blob's pixel count, a little larger than
+# the area inside the traced contour, so on noisy masks the two backends keep
+# somewhat different blobs near min_area. "contours" is the default: it is
+# faster on clean and sparse masks, which are most frames, and only a noisy
+# mask (dusk, rain) makes "components" worth it.
+
+# MotionDetector runs the per-frame steps of the detection loop (downscale,
+# blur, background model, dilation) on work buffers it allocates once, when it
+# sees the first frame, and every OpenCV call writes into them through dst=. A
+# 1080p frame then costs no new arrays per frame instead of several megabytes.
+# This spares the allocator and the garbage collector; it does not make the
+# OpenCV calls themselves faster. The blur has three backends: "gaussian" (the
+# original), "box" (cv2.blur, a running sum whose cost does not depend on the
+# kernel size) and "stack" (cv2.stackBlur, close to a Gaussian at a fraction
+# of the cost). The box and stack kernels are sized to smooth about as much as
+# the Gaussian. Exclusion zones (see exclusion.py) are cleared from the
+# threshold mask before it is dilated.
+
+# Most masks are empty, or nearly so. An empty mask is caught with a single
+# countNonZero and the frame exits early: there is nothing to dilate or label.
+# Otherwise MotionDetector reduces the mask to a grid of blocks (16x16 pixels
+# by default) holding each block's mean, with an area resize of the mask
+# padded to whole blocks. (A NumPy reshape and sum gives the same grid but at
+# 1080p it took longer than the dilation it saves.) The mean is a uint8, so
+# blocks are at most 16x16 pixels: in a larger block one pixel at 255 averages
+# to less than 0.5 and rounds away. Blocks with fewer than block_threshold
+# foreground pixels are cleared, which also drops isolated noise specks; if
+# none is left the frame exits early as well. Neighbouring active blocks are
+# grouped, and dilation and blob extraction run only on the bounding
+# rectangles of the groups (padded by the reach of the dilation). Inactive
+# blocks are empty, so a blob can never cross from one group into another and
+# the blobs found are the same as on the whole mask.
+
+import math
+
+import cv2
+import numpy as np
+
+BLOB_BACKENDS = ["contours", "components"]
+BLUR_BACKENDS = ["gaussian", "box", "stack"]
+DILATE_ITERATIONS = 2       # 3x3 dilations applied to the threshold mask; each grows a blob by 1 pixel
+MAX_BLOCK_SIZE = 16         # Largest grid block whose uint8 mean still counts a single foreground pixel
+
+
+def scaled_blur_size(blur_size, scale):
+    """An odd blur kernel covering the same area of the scene at 1/scale size."""
+    return max(3, int(blur_size / scale) | 1)
+
+
+def downscale(gray, scale, dst=None):
+    """Shrink a grayscale frame by an integer factor (area averaging)."""
+    height, width = gray.shape[:2]
+    return cv2.resize(gray, (width // scale, height // scale), dst=dst, interpolation=cv2.INTER_AREA)
+
+
+def blur_kernel(blur_size, backend="gaussian"):
+    """Kernel size for a blur backend that smooths about as much as a Gaussian of blur_size."""
+    # The sigma OpenCV uses for a Gaussian kernel of this size when sigma is 0
+    sigma = 0.3 * ((blur_size - 1) * 0.5 - 1) + 0.8
+    if backend == "box":
+        # A box of width n has a standard deviation of n / sqrt(12)
+        return max(3, int(round(sigma * math.sqrt(12))) | 1)
+    if backend == "stack":
+        # Stack blur weights fall off linearly; radius r has variance r(r + 2) / 6
+        return max(3, 2 * int(round(math.sqrt(1 + 6 * sigma * sigma) - 1)) + 1)
+    return blur_size
+
+
+def blur(gray, blur_size, backend="gaussian", dst=None):
+    """Smooth a grayscale frame with one of BLUR_BACKENDS, about as much as a Gaussian of blur_size."""
+    size = blur_kernel(blur_size, backend)
+    if backend == "box":
+        return cv2.blur(gray, (size, size), dst=dst)
+    if backend == "stack":
+        return cv2.stackBlur(gray, (size, size), dst=dst)
+    return cv2.GaussianBlur(gray, (size, size), 0, dst=dst)
+
+
+def largest_contour(thresh, min_area):
+    """The largest external contour with an area above min_area, or None."""
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    largest = None
+    max_area = 0
+    for c in contours:
+        area = cv2.contourArea(c)
+        if area > min_area and area > max_area:
+            max_area = area
+            largest = c
+    return largest
+
+
+def _component_stats(thresh, min_area, labels=None):
+    """Stats rows (x, y, w, h, area) of the 8-connected blobs larger than min_area,
+    and the (x, y) offset of the labelled region they are relative to.
+
+    labels is an optional flat int32 buffer, at least the size of the mask,
+    that the label image is written into instead of a new array.
+    """
+    # Label only the part of the mask that has anything in it: a quiet mask
+    # then costs next to nothing
+    x, y, w, h = cv2.boundingRect(thresh)
+    if w == 0:
+        return np.empty((0, 5), np.int32), (0, 0)
+    if labels is not None:
+        labels = labels[:w * h].reshape(h, w)   # Contiguous, so OpenCV writes into it
+    # Grana's algorithm is several times faster here than the default for 32-bit labels
+    _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(thresh[y:y + h, x:x + w], 8, cv2.CV_32S,
+                                                                   cv2.CCL_GRANA, labels=labels)
+    stats = stats[1:]   # Label 0 is the background
+    return stats[stats[:, cv2.CC_STAT_AREA] > min_area], (x, y)
+
+
+def find_blobs(thresh, min_area, backend="contours", labels=None):
+    """Bounding boxes (x, y, w, h) of all blobs with an area above min_area."""
+    if backend == "components":
+        stats, (x, y) = _component_stats(thresh, min_area, labels)
+        return [(bx + x, by + y, bw, bh) for bx, by, bw, bh, _ in stats.tolist()]
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) > min_area]
+
+
+def largest_blob(thresh, min_area, backend="contours"):
+    """Bounding box (x, y, w, h) of the largest blob with an area above min_area, or None."""
+    if backend == "components":
+        stats, (x, y) = _component_stats(thresh, min_area)
+        if not len(stats):
+            return None
+        bx, by, bw, bh, _ = stats[np.argmax(stats[:, cv2.CC_STAT_AREA])].tolist()
+        return (bx + x, by + y, bw, bh)
+    contour = largest_contour(thresh, min_area)
+    return None if contour is None else cv2.boundingRect(contour)
+
+
+def refine_target(gray, reference, rect, scale, blur_size, threshold, min_area, margin=8, backend="contours"):
+    """Refine a coarse target rectangle using the full-resolution frame.
+
+    gray is the unblurred full-resolution frame, reference the background
+    model at the coarse scale and rect the coarse (x, y, w, h) of the target.
+    Only the region of interest around the target (plus margin coarse pixels)
+    is blurred and compared at full resolution. Returns (x, y, w, h) in full
+    frame coordinates; if nothing survives at full resolution the coarse
+    rectangle is scaled up instead.
+    """
+    x, y, w, h = rect
+    ref_height, ref_width = reference.shape[:2]
+    # Work on a region aligned to the coarse grid so the two scales line up
+    cx0 = max(x - margin, 0)
+    cy0 = max(y - margin, 0)
+    cx1 = min(x + w + margin, ref_width)
+    cy1 = min(y + h + margin, ref_height)
+    x0, y0, x1, y1 = cx0 * scale, cy0 * scale, cx1 * scale, cy1 * scale
+
+    roi = cv2.GaussianBlur(gray[y0:y1, x0:x1], (blur_size, blur_size), 0)
+    ref = cv2.resize(reference[cy0:cy1, cx0:cx1], (x1 - x0, y1 - y0), interpolation=cv2.INTER_LINEAR)
+    delta = cv2.absdiff(ref, roi)
+    thresh = cv2.threshold(delta, threshold, 255, cv2.THRESH_BINARY)[1]
+    thresh = cv2.dilate(thresh, None, iterations=2)
+
+    blob = largest_blob(thresh, min_area, backend)
+    if blob is None:
+        return (x * scale, y * scale, w * scale, h * scale)
+    rx, ry, rw, rh = blob
+    return (rx + x0, ry + y0, rw, rh)
+
+
+def _merge_rects(rects):
+    """Merge overlapping (x0, y0, x1, y1) rectangles until none overlap."""
+    merged = True
+    while merged and len(rects) > 1:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+class MotionDetector:
+    """The detection loop's blur, background and dilation steps on preallocated buffers."""
+
+    def __init__(self, background, blur_size=21, scale=1, blur_backend="gaussian", exclude=None,
+                 block_size=16, block_threshold=1):
+        # background: engine from background.py; it writes its mask into our buffer
+        # blur_size: Gaussian kernel size at the (downscaled) detection size
+        # scale: integer downscale factor before blurring (pyramid mode)
+        # exclude: ExclusionZones whose motion is dropped from the mask
+        # block_size: side of the activity grid blocks in pixels, up to MAX_BLOCK_SIZE;
+        #   0 processes the whole mask
+        # block_threshold: foreground pixels for a block to be active
+        if not 0 <= block_size <= MAX_BLOCK_SIZE:
+            raise ValueError(f"Block size must be between 0 and {MAX_BLOCK_SIZE}, not {block_size}")
+        self.background = background
+        self.blur_size = blur_size
+        self.scale = scale
+        self.blur_backend = blur_backend
+        self.exclude = exclude
+        self.block_size = block_size
+        self.block_threshold = block_threshold
+        self.regions = []       # (x, y, w, h) of the parts of the mask with motion
+        self.frames = 0
+        self.early_exits = 0    # Frames without a single active block
+        self.active_blocks = 0  # Active blocks, summed over frames
+        self.shape = None
+        self.small = None       # Downscaled frame, in pyramid mode
+        self.gray = None        # Blurred frame the background model works on
+        self.mask = None        # Foreground mask from the background model
+        self.dilated = None     # Dilated mask, ready for blob extraction
+        self.labels = None      # Flat label image for the "components" blob backend
+        self.allowed = None     # 0 inside the exclusion zones, 255 elsewhere
+        self.activity = None    # Mean of each block, 0-255
+        self.active = None      # 255 for the active blocks
+        self.block_labels = None  # Label image of the active blocks
+        self._padded = None     # The mask buffer, padded to whole blocks
+        self._keep = None       # The active blocks at mask size, for clearing the others
+
+    def configure(self, shape):
+        """Allocate the work buffers for frames of the given (height, width)."""
+        height, width = shape[:2]
+        size = (height // self.scale, width // self.scale)
+        self.shape = shape[:2]
+        self.small = np.empty(size, np.uint8) if self.scale > 1 else None
+        self.gray = np.empty(size, np.uint8)
+        self.mask = np.empty(size, np.uint8)
+        if self.block_size:
+            # The mask is a view of a buffer padded to whole blocks; the padding stays 0
+            b = self.block_size
+            rows, cols = -(-size[0] // b), -(-size[1] // b)
+            self._padded = np.zeros((rows * b, cols * b), np.uint8)
+            self.mask = self._padded[:size[0], :size[1]]
+            self.activity = np.empty((rows, cols), np.uint8)
+            self.active = np.empty((rows, cols), np.uint8)
+            self.block_labels = np.empty((rows, cols), np.int32)
+            self._keep = np.empty(self._padded.shape, np.uint8) if self.block_threshold > 1 else None
+        self.dilated = np.empty(size, np.uint8)
+        self.labels = np.empty(size[0] * size[1], np.int32)
+        self.allowed = self.exclude.rasterize(size) if self.exclude else None
+
+    def prepare(self, luma):
+        """Downscale and blur a grayscale frame; returns the blurred frame (a reused buffer)."""
+        if luma.shape[:2] != self.shape:
+            self.configure(luma.shape)
+        if self.small is not None:
+            luma = downscale(luma, self.scale, dst=self.small)
+        return blur(luma, self.blur_size, self.blur_backend, dst=self.gray)
+
+    def foreground(self, freeze=()):
+        """Compare the prepared frame with the background model and dilate the result.
+
+        Returns the regions (x, y, w, h) of self.dilated that hold motion; the
+        rest of that buffer is stale. An empty list means nothing moved.
+        """
+        self.background.apply(self.gray, freeze, dst=self.mask)
+        if self.allowed is not None:
+            cv2.bitwise_and(self.mask, self.allowed, dst=self.mask)
+        self.frames += 1
+        height, width = self.mask.shape
+        if not self.block_size:
+            cv2.dilate(self.mask, None, dst=self.dilated, iterations=DILATE_ITERATIONS)
+            self.regions = [(0, 0, width, height)]
+            return self.regions
+
+        self.regions = []
+        if not cv2.countNonZero(self.mask):
+            self.early_exits += 1
+            return self.regions
+        rows, cols = self.activity.shape
+        cv2.resize(self._padded, (cols, rows), dst=self.activity, interpolation=cv2.INTER_AREA)
+        # A block's mean is 255 * pixels / size^2, rounded; up to 16x16 one pixel still counts
+        b = self.block_size
+        level = max(1, int(round(255 * self.block_threshold / (b * b))))
+        cv2.threshold(self.activity, level - 1, 255, cv2.THRESH_BINARY, dst=self.active)
+        if self._keep is not None:
+            # Clear the blocks that are not active (noise specks)
+            cv2.resize(self.active, self._keep.shape[::-1], dst=self._keep, interpolation=cv2.INTER_NEAREST)
+            cv2.bitwise_and(self._padded, self._keep, dst=self._padded)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(self.active, self.block_labels, connectivity=8)
+        if count == 1:
+            self.early_exits += 1
+            return self.regions
+        self.active_blocks += int(stats[1:, cv2.CC_STAT_AREA].sum())
+
+        # Dilate each group of active blocks, plus the pixels the dilation grows into
+        pad = DILATE_ITERATIONS
+        rects = [(max(x * b - pad, 0), max(y * b - pad, 0), min((x + w) * b + pad, width),
+                  min((y + h) * b + pad, height)) for x, y, w, h, _ in stats[1:].tolist()]
+        for x0, y0, x1, y1 in _merge_rects(rects):
+            cv2.dilate(self.mask[y0:y1, x0:x1], None, dst=self.dilated[y0:y1, x0:x1], iterations=DILATE_ITERATIONS)
+            self.regions.append((x0, y0, x1 - x0, y1 - y0))
+        return self.regions
+
+    def blobs(self, min_area, backend="contours"):
+        """Bounding boxes of the blobs in the last foreground mask (see find_blobs)."""
+        blobs = []
+        for x, y, w, h in self.regions:
+            blobs += [(bx + x, by + y, bw, bh)
+                      for bx, by, bw, bh in find_blobs(self.dilated[y:y + h, x:x + w], min_area, backend, self.labels)]
+        return blobs
+
+    def summary(self):
+        if not self.block_size:
+            return "Blocks: off"
+        blocks = self.activity.size if self.activity is not None else 0
+        busy = self.frames - self.early_exits
+        active = 100 * self.active_blocks / (busy * blocks) if busy and blocks else 0.0
+        exits = 100 * self.early_exits / self.frames if self.frames else 0.0
+        return (f"Blocks: {self.early_exits} of {self.frames} frames exited early ({exits:.0f}%), "
+                f"{active:.1f}% of blocks active on the others")
@@ -0,0 +1,145 @@
+#! /usr/bin/env python3
+
+# Sparse optical-flow tracking of one target between full detections.
+
+# Once a target is found there is no need to run the whole detector on every
+# frame just to see where it went. FlowTracker seeds up to max_points corners
+# (cv2.goodFeaturesToTrack) inside the target's box and follows them on the
+# next frames with pyramidal Lucas-Kanade flow (cv2.calcOpticalFlowPyrLK),
+# on a crop of the box plus margin pixels instead of the whole frame. On
+# crops this small, building the pyramids is most of the cost, so the window
+# is small and there are only as many levels as the margin needs. Every
+# point is tracked forward and then back again, and is kept only if it comes
+# back within max_error pixels of where it started. The box moves by the
+# median shift of the points that were kept, so a few points that slip onto
+# the background do not drag it along. Colour frames can be passed as they
+# are: only the crops are converted to grayscale.
+
+# Confidence is the fraction of the seeded points still kept. The caller runs
+# a full detection (and seeds again) when due() says so: every interval
+# frames, or on the frame after the confidence dropped below min_confidence
+# or fewer than min_points were left.
+
+import math
+
+import cv2
+import numpy as np
+
+
+class FlowTracker:
+    """Follows one box (x, y, w, h) between full detections with sparse Lucas-Kanade flow."""
+
+    def __init__(self, interval=5, max_points=20, min_points=4, min_confidence=0.5, margin=16,
+                 win_size=9, levels=None, max_error=1.0, conversion=cv2.COLOR_RGB2GRAY):
+        # interval: frames between full detections while the target is followed
+        # margin: pixels the target may move between two frames
+        # levels: pyramid levels; by default enough for a window of win_size to reach margin
+        # conversion: cv2.cvtColor code for the crops of 3-channel frames
+        if levels is None:
+            levels = max(1, math.ceil(math.log2(max(margin, 1) / (win_size / 2))))
+        self.interval = interval
+        self.max_points = max_points
+        self.min_points = min_points
+        self.min_confidence = min_confidence
+        self.margin = margin
+        self.max_error = max_error
+        self.conversion = conversion
+        self.lk_params = dict(winSize=(win_size, win_size), maxLevel=levels,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        self.box = None
+        self.points = None      # (N, 1, 2) float32 corners in frame pixels
+        self.confidence = 0.0
+        self.since_seed = 0     # Frames followed since the last full detection
+        self.seeded = 0         # Points found when seeded
+        self.seeds = 0
+        self.followed = 0       # Frames on which flow replaced a full detection
+        self.lost = 0           # Times the confidence dropped before the interval ran out
+        self._prev = None       # Crop of the last frame around the box
+        self._origin = (0, 0)   # Its top left corner in the frame
+
+    @property
+    def active(self):
+        return self.points is not None
+
+    def due(self):
+        """True when the next frame needs a full detection."""
+        return self.points is None or self.since_seed >= self.interval
+
+    def reset(self):
+        self.box = self.points = self._prev = None
+        self.confidence = 0.0
+
+    def _crop(self, frame, x0, y0, x1, y1):
+        crop = frame[y0:y1, x0:x1]
+        return cv2.cvtColor(crop, self.conversion) if crop.ndim == 3 else crop
+
+    def seed(self, frame, box):
+        """Pick corners inside the box of a frame; False if there are too few to follow."""
+        height, width = frame.shape[:2]
+        x, y, w, h = box
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1, y1 = min(int(x + w), width), min(int(y + h), height)
+        self.since_seed = 0
+        corners = None
+        if x1 - x0 >= 3 and y1 - y0 >= 3:
+            corners = cv2.goodFeaturesToTrack(self._crop(frame, x0, y0, x1, y1), self.max_points, 0.01, 3)
+        if corners is None or len(corners) < self.min_points:
+            self.reset()
+            return False
+        self.points = corners + np.float32((x0, y0))
+        self.seeded = len(corners)
+        self.confidence = 1.0
+        self.box = tuple(float(v) for v in box)
+        self._remember(frame)
+        self.seeds += 1
+        return True
+
+    def _remember(self, frame):
+        height, width = frame.shape[:2]
+        x, y, w, h = self.box
+        x0, y0 = max(int(x) - self.margin, 0), max(int(y) - self.margin, 0)
+        x1, y1 = min(int(x + w) + self.margin, width), min(int(y + h) + self.margin, height)
+        self._origin = (x0, y0)
+        crop = self._crop(frame, x0, y0, x1, y1)
+        # A grayscale crop is a view of a frame that may be reused; a converted one is already a copy
+        self._prev = crop if frame.ndim == 3 else crop.copy()
+
+    def follow(self, frame):
+        """Move the box to this frame.
+
+        Returns the new box, or None if the target was lost; the next frame
+        then needs a full detection.
+        """
+        if self.points is None:
+            return None
+        self.since_seed += 1
+        x0, y0 = self._origin
+        crop = self._crop(frame, x0, y0, x0 + self._prev.shape[1], y0 + self._prev.shape[0])
+        start = self.points - np.float32((x0, y0))
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._prev, crop, start, None, **self.lk_params)
+        back, status_back, _ = cv2.calcOpticalFlowPyrLK(crop, self._prev, moved, None, **self.lk_params)
+        error = np.abs(start - back).reshape(-1, 2).max(axis=1)
+        good = (status.ravel() == 1) & (status_back.ravel() == 1) & (error < self.max_error)
+        kept = int(good.sum())
+        self.confidence = kept / self.seeded
+        if kept < self.min_points or self.confidence < self.min_confidence:
+            self.lost += 1
+            self.reset()
+            return None
+
+        # Median shift (np.median costs more than the flow itself on 20 points)
+        shifts = (moved - start)[good].reshape(-1, 2)
+        shifts.sort(axis=0)
+        dx, dy = shifts[kept // 2]
+        x, y, w, h = self.box
+        self.box = (x + float(dx), y + float(dy), w, h)
+        self.points = moved[good] + np.float32((x0, y0))
+        self._remember(frame)
+        self.followed += 1
+        return self.box
+
+    def summary(self):
+        frames = self.followed + self.seeds
+        share = 100 * self.followed / frames if frames else 0.0
+        return (f"Flow: followed the target on {self.followed} frames ({share:.0f}% of those with a target), "
+                f"{self.seeds} full detections seeded it, lost it {self.lost} times")
@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+
+# Activity-driven frame rate scheduling.
+
+# Most of the night nothing moves in front of the camera, and running the
+# camera and the detection loop at full rate only heats up the enclosure.
+# PowerScheduler keeps two power states. In "idle" the camera's FrameRate is
+# lowered to idle_fps and the loop is paced to the same rate. The moment the
+# loop reports activity (motion, a tracked target, a shot in progress) it
+# switches to "active" and restores the full frame rate. It drops back to
+# idle only after idle_delay seconds without any activity.
+
+# For each state it keeps the wall time and the CPU time this process (all
+# of its threads) used, so the summary shows where the time went and what
+# the average CPU use was in each state.
+
+import time
+
+POWER_STATES = ["active", "idle"]
+
+
+class PowerScheduler:
+    """Lowers the camera and loop rate while the scene is idle."""
+
+    def __init__(self, camera=None, active_fps=30, idle_fps=5, idle_delay=30.0):
+        # camera: Picamera2 whose FrameRate control is switched, or None to
+        # only pace the loop
+        self.camera = camera
+        self.active_fps = active_fps
+        self.idle_fps = idle_fps
+        self.idle_delay = idle_delay
+        self.state = "active"
+        self.switches = 0
+        self.wall = dict.fromkeys(POWER_STATES, 0.0)
+        self.cpu = dict.fromkeys(POWER_STATES, 0.0)
+        now = time.monotonic()
+        self._since = now
+        self._since_cpu = time.process_time()
+        self._last_active = now
+        self._next_frame = now
+
+    def update(self, active, now=None):
+        """Report whether anything is happening; returns the new state if it changed."""
+        if now is None:
+            now = time.monotonic()
+        if active:
+            self._last_active = now
+            if self.state == "idle":
+                return self._switch("active", now)
+        elif self.state == "active" and self.idle_fps and now - self._last_active >= self.idle_delay:
+            return self._switch("idle", now)
+        return None
+
+    def _switch(self, state, now):
+        self._account(now)
+        self.state = state
+        self.switches += 1
+        self._next_frame = now
+        if self.camera is not None:
+            self.camera.set_controls({"FrameRate": self.fps})
+        return state
+
+    def _account(self, now):
+        cpu = time.process_time()
+        self.wall[self.state] += now - self._since
+        self.cpu[self.state] += cpu - self._since_cpu
+        self._since = now
+        self._since_cpu = cpu
+
+    @property
+    def fps(self):
+        return self.idle_fps if self.state == "idle" else self.active_fps
+
+    def pace(self):
+        """While idle, sleep until the next frame is due; call once per loop."""
+        if self.state != "idle":
+            return
+        now = time.monotonic()
+        if self._next_frame > now:
+            time.sleep(self._next_frame - now)
+            now = self._next_frame
+        self._next_frame = max(self._next_frame + 1.0 / self.idle_fps, now)
+
+    def summary(self):
+        self._account(time.monotonic())
+        parts = []
+        for state in POWER_STATES:
+            wall = self.wall[state]
+            cpu = 100 * self.cpu[state] / wall if wall else 0.0
+            parts.append(f"{state} {wall / 60:.1f} min at {cpu:.0f}% CPU")
+        wall = sum(self.wall.values())
+        cpu = 100 * sum(self.cpu.values()) / wall if wall else 0.0
+        return f"Power: {self.state} now, " + ", ".join(parts) + f"; {cpu:.0f}% CPU overall, {self.switches} switches"
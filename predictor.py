@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+
+# Latency-compensated aiming.
+
+# By the time a frame has been captured, processed and the servo has slewed,
+# a moving target is somewhere else. KalmanPredictor is a constant-velocity
+# Kalman filter on the target's (x, y) position; predict(t) estimates where
+# the target will be at time t, so the servo can be pointed at
+# "frame time + measured end-to-end latency" instead of where the target was.
+
+# The x and y axes are independent with the same noise model, so the filter
+# runs as two 2-state filters sharing one covariance, in plain Python floats.
+
+
+class KalmanPredictor:
+    """Constant-velocity Kalman filter for a target position in pixels."""
+
+    def __init__(self, process_noise=2000.0, measurement_noise=25.0, max_gap=1.0):
+        # process_noise: acceleration noise spectral density (px^2/s^3)
+        # measurement_noise: variance of a measured position (px^2)
+        self.q = process_noise
+        self.r = measurement_noise
+        self.max_gap = max_gap
+        self.t = None
+
+    def _start(self, position, t):
+        self.pos = [float(position[0]), float(position[1])]
+        self.vel = [0.0, 0.0]
+        # Covariance [[pp, pv], [pv, vv]], shared by both axes
+        self.pp = self.r
+        self.pv = 0.0
+        self.vv = 1e4
+        self.t = t
+
+    def update(self, position, t):
+        """Add a measured position at time t (seconds)."""
+        if self.t is None or t - self.t > self.max_gap or t < self.t:
+            self._start(position, t)
+            return
+        dt = t - self.t
+        q = self.q
+        # Predict
+        pp = self.pp + dt * (2 * self.pv + dt * self.vv) + q * dt ** 3 / 3
+        pv = self.pv + dt * self.vv + q * dt ** 2 / 2
+        vv = self.vv + q * dt
+        # Correct
+        s = pp + self.r
+        kp = pp / s
+        kv = pv / s
+        for axis in (0, 1):
+            predicted = self.pos[axis] + self.vel[axis] * dt
+            residual = position[axis] - predicted
+            self.pos[axis] = predicted + kp * residual
+            self.vel[axis] += kv * residual
+        self.pp = (1 - kp) * pp
+        self.pv = (1 - kp) * pv
+        self.vv = vv - kv * pv
+        self.t = t
+
+    def predict(self, t):
+        """Estimated (x, y) at time t, or None before the first update."""
+        if self.t is None:
+            return None
+        dt = t - self.t
+        return (self.pos[0] + self.vel[0] * dt, self.pos[1] + self.vel[1] * dt)
+
+    @property
+    def velocity(self):
+        return tuple(self.vel) if self.t is not None else (0.0, 0.0)
@@ -0,0 +1,176 @@
+#! /usr/bin/env python3
+
+# Display helpers for running with or without a monitor.
+
+# PreviewServer is an optional MJPEG stream on localhost (open
+# http://127.0.0.1:<port>/ in a browser, or tunnel it over ssh). Frames are
+# only converted and JPEG-encoded while a client is connected, on the
+# server's own thread, and no faster than max_fps.
+
+# OverlayText renders a line of text once into a cached layer and pastes it
+# onto each frame. The layer is only redrawn when the text changes, so a
+# timestamp with one-second resolution is rendered once per second.
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+class OverlayText:
+    """A line of text drawn from a cached layer instead of cv2.putText every frame."""
+
+    def __init__(self, org, scale, color, thickness, font=cv2.FONT_HERSHEY_SIMPLEX):
+        self.org = org
+        self.scale = scale
+        self.color = color
+        self.thickness = thickness
+        self.font = font
+        self.text = None
+        self.layer = None
+        self.mask = None
+        self.renders = 0
+
+    def set_text(self, text):
+        """Update the text; the layer is only re-rendered if it changed."""
+        if text == self.text:
+            return
+        self.text = text
+        (width, height), baseline = cv2.getTextSize(text, self.font, self.scale, self.thickness)
+        pad = self.thickness
+        self._top = height + pad
+        shape = (height + baseline + 2 * pad, width + 2 * pad)
+        # Render the glyph shape once, then paint it in the text color
+        self.mask = np.zeros(shape, np.uint8)
+        cv2.putText(self.mask, text, (pad, self._top), self.font, self.scale, 255, self.thickness, cv2.LINE_8)
+        cv2.threshold(self.mask, 127, 255, cv2.THRESH_BINARY, dst=self.mask)
+        self.layer = np.empty(shape + (3,), np.uint8)
+        self.layer[:] = self.color
+        self.renders += 1
+
+    def draw(self, frame):
+        """Composite the cached layer onto frame in place."""
+        if self.layer is None:
+            return
+        x = self.org[0] - self.thickness
+        y = self.org[1] - self._top
+        # Clip the layer to the frame
+        x0, y0 = max(x, 0), max(y, 0)
+        x1 = min(x + self.layer.shape[1], frame.shape[1])
+        y1 = min(y + self.layer.shape[0], frame.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            return
+        layer = self.layer[y0 - y:y1 - y, x0 - x:x1 - x]
+        mask = self.mask[y0 - y:y1 - y, x0 - x:x1 - x]
+        cv2.copyTo(layer, mask, frame[y0:y1, x0:x1])
+
+
+class PreviewServer:
+    """An on-demand MJPEG preview served over HTTP on localhost."""
+
+    def __init__(self, port, max_fps=5, quality=70, host="127.0.0.1"):
+        self.max_fps = max_fps
+        self.quality = quality
+        self.clients = 0
+        self.encoded = 0
+        self._frame = None
+        self._spare = None
+        self._conversion = None
+        self._jpeg = None
+        self._jpeg_id = 0
+        self._last_publish = 0.0
+        self._pending = threading.Event()
+        self._cond = threading.Condition()
+        self._running = True
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._stream(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="preview-http", daemon=True).start()
+        threading.Thread(target=self._encode_loop, name="preview-encode", daemon=True).start()
+
+    def wants_frame(self):
+        """True if a client is connected and the frame rate cap allows a new frame."""
+        return self.clients > 0 and time.monotonic() - self._last_publish >= 1.0 / self.max_fps
+
+    def publish(self, frame, conversion=None):
+        """Hand a frame to the encoder, optionally with a cv2.cvtColor code to apply first.
+
+        The frame is copied, so the caller may reuse its buffer. Does nothing
+        unless wants_frame() is true.
+        """
+        if not self.wants_frame():
+            return
+        self._last_publish = time.monotonic()
+        with self._cond:
+            if self._frame is None or self._frame.shape != frame.shape:
+                self._frame = np.empty_like(frame)
+            np.copyto(self._frame, frame)
+            self._conversion = conversion
+        self._pending.set()
+
+    def _encode_loop(self):
+        while self._running:
+            if not self._pending.wait(timeout=1.0):
+                continue
+            self._pending.clear()
+            # Swap buffers so publish() can fill the other one while we encode
+            with self._cond:
+                frame, self._frame, self._spare = self._frame, self._spare, self._frame
+                conversion = self._conversion
+            if conversion is not None:
+                frame = cv2.cvtColor(frame, conversion)
+            ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if not ok:
+                continue
+            with self._cond:
+                self._jpeg = jpeg.tobytes()
+                self._jpeg_id += 1
+                self.encoded += 1
+                self._cond.notify_all()
+
+    def _stream(self, handler):
+        if handler.path not in ("/", "/stream.mjpg"):
+            handler.send_error(404)
+            return
+        handler.send_response(200)
+        handler.send_header("Cache-Control", "no-cache")
+        handler.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        handler.end_headers()
+        with self._cond:
+            self.clients += 1
+        last_id = 0
+        try:
+            while self._running:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._jpeg_id != last_id or not self._running, timeout=5.0)
+                    if self._jpeg_id == last_id:
+                        continue
+                    jpeg, last_id = self._jpeg, self._jpeg_id
+                handler.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n")
+                handler.wfile.write(f"Content-Length: {len(jpeg)}\r\n\r\n".encode())
+                handler.wfile.write(jpeg)
+                handler.wfile.write(b"\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._cond:
+                self.clients -= 1
+
+    def close(self):
+        self._running = False
+        self._pending.set()
+        with self._cond:
+            self._cond.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
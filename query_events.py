@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Query the Water Blaster event logs offline.
+
+Reads the events_<date>_<n>.jsonl files written by event_log.py.
+
+Usage:
+    python3 query_events.py --shots-per-night           # one line per night
+    python3 query_events.py --type shot refresh --since 2024-06-01
+    python3 query_events.py --type perf --csv > perf.csv
+"""
+
+import argparse
+import collections
+import csv
+import datetime
+import json
+import sys
+
+from event_log import EVENT_TYPES, read_events
+
+NIGHT_START_HOUR = 12       # A "night" runs from noon to noon, so one night is one row
+
+
+def parse_date(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def night_of(ts):
+    """The date a night started on, for an event timestamp."""
+    moment = datetime.datetime.fromtimestamp(ts) - datetime.timedelta(hours=NIGHT_START_HOUR)
+    return moment.date()
+
+
+def shots_per_night(events):
+    counts = collections.Counter(night_of(event["ts"]) for event in events)
+    print("night,shots")
+    for night in sorted(counts):
+        print(f"{night.isoformat()},{counts[night]}")
+
+
+def print_events(events, as_csv):
+    if not as_csv:
+        for event in events:
+            when = datetime.datetime.fromtimestamp(event["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+            fields = {k: v for k, v in event.items() if k not in ("ts", "type")}
+            print(f"{when} {event['type']:<8} {json.dumps(fields)}")
+        return
+    events = list(events)
+    columns = ["ts", "type"] + sorted({k for event in events for k in event} - {"ts", "type"})
+    writer = csv.DictWriter(sys.stdout, columns)
+    writer.writeheader()
+    writer.writerows(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query Water Blaster event logs")
+    parser.add_argument("--dir", default="logs", help="directory with the event log files")
+    parser.add_argument("--type", nargs="+", choices=EVENT_TYPES, help="only these event types")
+    parser.add_argument("--since", type=parse_date, help="start date/time (ISO format)")
+    parser.add_argument("--until", type=parse_date, help="end date/time (ISO format)")
+    parser.add_argument("--shots-per-night", action="store_true", help="count shots per night")
+    parser.add_argument("--csv", action="store_true", help="print events as CSV")
+    args = parser.parse_args()
+
+    if args.shots_per_night:
+        shots_per_night(read_events(args.dir, types={"shot"}, since=args.since, until=args.until))
+        return
+    types = set(args.type) if args.type else None
+    print_events(read_events(args.dir, types=types, since=args.since, until=args.until), args.csv)
+
+
+if __name__ == "__main__":
+    main()
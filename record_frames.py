@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Record camera frames for replaying the Water Blaster loop off the Pi.
+
+Captures the same streams water_blaster_pi5.py uses (RGB main and YUV420
+lores) with their sensor timestamps into a recording directory of
+memory-mapped .npy files; see replay.py. Replay it with benchmark_replay.py.
+
+Usage:
+    python3 record_frames.py recordings/garden --seconds 60
+    python3 record_frames.py recordings/dusk --frames 900 --no-lores
+"""
+
+import argparse
+import time
+
+from picamera2 import Picamera2
+
+from replay import RecordingWriter
+
+FRAME_WIDTH = 640           # Same sizes as water_blaster_pi5.py
+FRAME_HEIGHT = 480
+LORES_WIDTH = 320
+LORES_HEIGHT = 240
+FPS = 30
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record camera frames for replay")
+    parser.add_argument("directory", help="recording directory to create")
+    parser.add_argument("--seconds", type=float, default=30, help="length of the recording")
+    parser.add_argument("--frames", type=int, help="number of frames (overrides --seconds)")
+    parser.add_argument("--no-lores", action="store_true", help="record only the main stream")
+    args = parser.parse_args()
+
+    frames = args.frames or int(args.seconds * FPS)
+    picam2 = Picamera2()
+    main_config = {"size": (FRAME_WIDTH, FRAME_HEIGHT), "format": "RGB888"}
+    controls = {"FrameRate": FPS}
+    if args.no_lores:
+        config = picam2.create_video_configuration(main=main_config, controls=controls)
+    else:
+        config = picam2.create_video_configuration(main=main_config, controls=controls,
+                                                   lores={"size": (LORES_WIDTH, LORES_HEIGHT), "format": "YUV420"})
+    picam2.configure(config)
+    picam2.start()
+    time.sleep(2.0)  # Allow camera to stabilize
+
+    writer = None
+    names = ["main"] if args.no_lores else ["main", "lores"]
+    try:
+        for i in range(frames):
+            arrays, metadata = picam2.capture_arrays(names)
+            timestamp = metadata.get("SensorTimestamp", time.monotonic_ns()) / 1e9
+            if writer is None:
+                lores_shape = None if args.no_lores else arrays[1].shape
+                writer = RecordingWriter(args.directory, frames, arrays[0].shape, lores_shape, FPS)
+            writer.write(arrays[0], timestamp, None if args.no_lores else arrays[1])
+            if (i + 1) % FPS == 0:
+                print(f"\r{i + 1}/{frames} frames", end="", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        picam2.stop()
+        if writer is not None:
+            writer.close()
+            print(f"\nRecorded {writer.count} frames to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#! /usr/bin/env python3
+
+# Frame recordings and replay backends for the Water Blaster.
+
+# A recording is a directory of memory-mapped NumPy arrays: main.npy (RGB
+# frames), lores.npy (the raw YUV420 lores buffers, optional), timestamps.npy
+# (capture times in seconds) and meta.json. RecordingWriter writes one frame
+# at a time straight into the mapped files, so long recordings never have to
+# fit in memory.
+
+# install() puts stand-ins for the picamera2 and lgpio modules into
+# sys.modules. ReplayPicamera2 serves the recorded frames through the same
+# calls the scripts use (capture_array, capture_arrays), either as fast as
+# they are asked for or paced at the recorded frame times. When paced, a
+# FrameRate control below the recording's rate skips frames the way a slower
+# camera would. Unpaced replay only makes sense with synchronous capture: a
+# capture thread would run through the whole recording at once. FakeGpio
+# records every servo and output command with the frame it happened on, so
+# the detection loop can run and be measured on any Linux machine.
+
+import _thread
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+import cv2
+import numpy as np
+
+
+class RecordingWriter:
+    """Writes frames into a recording directory of memory-mapped arrays."""
+
+    def __init__(self, directory, frames, main_shape, lores_shape=None, fps=30):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.count = 0
+        self.fps = fps
+        self.main = np.lib.format.open_memmap(os.path.join(directory, "main.npy"), mode="w+",
+                                              dtype=np.uint8, shape=(frames,) + tuple(main_shape))
+        self.lores = None
+        if lores_shape is not None:
+            self.lores = np.lib.format.open_memmap(os.path.join(directory, "lores.npy"), mode="w+",
+                                                   dtype=np.uint8, shape=(frames,) + tuple(lores_shape))
+        self.timestamps = np.zeros(frames, np.float64)
+
+    def write(self, main, timestamp, lores=None):
+        self.main[self.count] = main
+        if self.lores is not None:
+            self.lores[self.count] = lores
+        self.timestamps[self.count] = timestamp
+        self.count += 1
+
+    def close(self):
+        self.main.flush()
+        if self.lores is not None:
+            self.lores.flush()
+        np.save(os.path.join(self.directory, "timestamps.npy"), self.timestamps[:self.count])
+        meta = {"frames": self.count, "fps": self.fps, "main_shape": list(self.main.shape[1:]),
+                "lores_shape": list(self.lores.shape[1:]) if self.lores is not None else None}
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+
+class Recording:
+    """A recording opened read-only; frames are paged in from disk on demand."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.frames = self.meta["frames"]
+        self.main = np.load(os.path.join(directory, "main.npy"), mmap_mode="r")
+        lores_path = os.path.join(directory, "lores.npy")
+        self.lores = np.load(lores_path, mmap_mode="r") if os.path.exists(lores_path) else None
+        self.timestamps = np.load(os.path.join(directory, "timestamps.npy"))
+
+
+def make_synthetic(directory, frames=600, fps=30, size=(640, 480), lores_size=(320, 240), seed=1):
+    """Write a repeatable test scene: a blob walks in, stands still, and walks off.
+
+    The scene repeats every 10 seconds, so a 20 s recording holds two visits.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    ground = np.empty((height, width, 3), np.uint8)
+    ground[:] = np.linspace(60, 140, width, dtype=np.uint8)[None, :, None]
+    lores_width, lores_height = lores_size
+    writer = RecordingWriter(directory, frames, (height, width, 3), (lores_height * 3 // 2, lores_width), fps)
+    for i in range(frames):
+        t = i / fps
+        frame = ground.copy()
+        frame += rng.integers(0, 6, frame.shape, dtype=np.uint8)    # Sensor noise
+        phase = t % 10.0
+        if 2.0 <= phase < 8.0:
+            # Walk in over 2 s, stand for 3 s, walk off over 1 s
+            if phase < 4.0:
+                x = int(-80 + (phase - 2.0) / 2.0 * 380)
+            elif phase < 7.0:
+                x = 300
+            else:
+                x = int(300 + (phase - 7.0) * 400)
+            cv2.rectangle(frame, (x, 260), (x + 80, 330), (230, 220, 200), -1)
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        yuv = np.full((lores_height * 3 // 2, lores_width), 128, np.uint8)
+        yuv[:lores_height] = cv2.resize(gray, lores_size, interpolation=cv2.INTER_AREA)
+        writer.write(frame, t, yuv)
+    writer.close()
+
+
+class ReplayPicamera2:
+    """Stands in for picamera2.Picamera2, serving frames from a Recording."""
+
+    recording = None
+    realtime = False
+    on_frame = None     # Called with the frame index before each frame is returned
+
+    def __init__(self, *args, **kwargs):
+        self.config = None
+        self.index = -1
+        self.frame_rate = None
+        self._start = None
+
+    def create_video_configuration(self, main=None, lores=None, **kwargs):
+        return {"main": main or {}, "lores": lores, **kwargs}
+
+    create_preview_configuration = create_video_configuration
+    create_still_configuration = create_video_configuration
+
+    def configure(self, config):
+        self.config = config
+        self.set_controls(config.get("controls") or {})
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+    def set_controls(self, controls):
+        if "FrameRate" in controls:
+            self.frame_rate = controls["FrameRate"]
+
+    def _next(self):
+        recording = self.recording
+        step = 1
+        if self.realtime and self.frame_rate and self.index >= 0:
+            step = max(1, int(round(recording.meta["fps"] / self.frame_rate)))
+        self.index += step
+        if self.index >= recording.frames:
+            # End of the recording: stop the loop the same way Ctrl+C would
+            if threading.current_thread() is threading.main_thread():
+                raise KeyboardInterrupt
+            _thread.interrupt_main()
+            raise EOFError("End of recording")
+        if self.index == 0:
+            self._start = time.monotonic()
+        if self.realtime:
+            due = self._start + recording.timestamps[self.index] - recording.timestamps[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if self.on_frame is not None:
+            self.on_frame(self.index)
+        return self.index
+
+    def _main(self, i):
+        frame = np.array(self.recording.main[i])
+        size = self.config["main"].get("size")
+        if size is not None and (frame.shape[1], frame.shape[0]) != tuple(size):
+            frame = cv2.resize(frame, tuple(size), interpolation=cv2.INTER_AREA)
+        return frame
+
+    def _lores(self, i, main):
+        width, height = self.config["lores"]["size"]
+        recorded = self.recording.lores
+        if recorded is not None and recorded.shape[1:] == (height * 3 // 2, width):
+            return np.array(recorded[i])
+        # No matching lores recording: derive the Y plane from the main frame
+        yuv = np.full((height * 3 // 2, width), 128, np.uint8)
+        gray = cv2.cvtColor(main, cv2.COLOR_RGB2GRAY)
+        yuv[:height] = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+        return yuv
+
+    def _metadata(self, i):
+        return {"SensorTimestamp": int(self.recording.timestamps[i] * 1e9)}
+
+    def capture_array(self, name="main"):
+        i = self._next()
+        main = self._main(i)
+        return self._lores(i, main) if name == "lores" else main
+
+    def capture_arrays(self, names=("main",)):
+        i = self._next()
+        main = self._main(i)
+        arrays = [self._lores(i, main) if name == "lores" else main for name in names]
+        return arrays, self._metadata(i)
+
+    def capture_metadata(self):
+        return self._metadata(max(self.index, 0))
+
+
+class FakeGpio:
+    """Stands in for the lgpio calls the scripts use and records a command trace.
+
+    Each trace entry is (frame index, seconds since start, command, pin, value)
+    with command "servo" (value is the pulse width) or "write".
+    """
+
+    SET_PULL_UP = 32
+
+    def __init__(self, debug_switch=False):
+        self.debug_switch = debug_switch
+        self.frame = -1
+        self.trace = []
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _record(self, command, pin, value):
+        with self._lock:
+            self.trace.append((self.frame, round(time.monotonic() - self._start, 4), command, pin, int(value)))
+
+    def module(self):
+        """A module object with the lgpio functions, for sys.modules["lgpio"]."""
+        lgpio = types.ModuleType("lgpio")
+        lgpio.SET_PULL_UP = self.SET_PULL_UP
+        lgpio.error = RuntimeError
+        lgpio.gpiochip_open = lambda chip: 0
+        lgpio.gpiochip_close = lambda h: 0
+        lgpio.gpio_claim_output = lambda h, pin, *args: 0
+        lgpio.gpio_claim_input = lambda h, pin, *args: 0
+        lgpio.gpio_free = lambda h, pin: 0
+        lgpio.gpio_write = lambda h, pin, value: self._record("write", pin, value)
+        # A grounded debug switch reads 0
+        lgpio.gpio_read = lambda h, pin: 0 if self.debug_switch else 1
+        lgpio.tx_servo = lambda h, pin, width, freq=50, *args: self._record("servo", pin, width) or 0
+        return lgpio
+
+
+def install(recording, realtime=False, debug_switch=False):
+    """Replace the picamera2 and lgpio modules with replay backends.
+
+    Must be called before the script under test imports them. Returns the
+    FakeGpio, whose trace holds every command issued.
+    """
+    gpio = FakeGpio(debug_switch)
+
+    def on_frame(index):
+        gpio.frame = index
+
+    ReplayPicamera2.recording = recording
+    ReplayPicamera2.realtime = realtime
+    ReplayPicamera2.on_frame = staticmethod(on_frame)
+    picamera2 = types.ModuleType("picamera2")
+    picamera2.Picamera2 = ReplayPicamera2
+    sys.modules["picamera2"] = picamera2
+    sys.modules["lgpio"] = gpio.module()
+    return gpio
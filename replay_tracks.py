@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Replay logged target tracks to measure how well aiming leads a moving target.
+
+Reads the "track" events written by water_blaster_pi5.py --log-tracks. For
+each latency, every logged position is used to aim at where the target will
+be that many seconds later, first naively (where it was seen) and then with
+the Kalman prediction, and the aim is compared with the target's actual
+position at that time (interpolated between logged positions).
+
+Usage:
+    python3 replay_tracks.py                       # latencies 0.05 0.1 0.15 0.2 0.3
+    python3 replay_tracks.py --latency 0.12 --dir logs
+"""
+
+import argparse
+import bisect
+import collections
+
+import numpy as np
+
+from event_log import read_events
+from predictor import KalmanPredictor
+
+FRAME_WIDTH = 640
+SERVO_RANGE = 2200 - 800    # Pulse width range (µs) across the frame width, as in water_blaster_pi5.py
+
+
+def load_tracks(directory):
+    tracks = collections.defaultdict(list)
+    for event in read_events(directory, types={"track"}):
+        tracks[event["id"]].append((event["t"], event["x"], event["y"]))
+    return {track_id: sorted(points) for track_id, points in tracks.items() if len(points) > 2}
+
+
+def position_at(points, times, t):
+    """Interpolated (x, y) at time t, or None outside the track's lifetime."""
+    if t < times[0] or t > times[-1]:
+        return None
+    i = bisect.bisect_left(times, t)
+    if times[i] == t:
+        return points[i][1:]
+    (t0, x0, y0), (t1, x1, y1) = points[i - 1], points[i]
+    f = (t - t0) / (t1 - t0)
+    return x0 + f * (x1 - x0), y0 + f * (y1 - y0)
+
+
+def aim_errors(tracks, latency):
+    """Horizontal aim errors (pixels) for naive and predicted aiming."""
+    naive, predicted = [], []
+    for points in tracks.values():
+        times = [p[0] for p in points]
+        predictor = KalmanPredictor()
+        for t, x, y in points:
+            predictor.update((x, y), t)
+            truth = position_at(points, times, t + latency)
+            if truth is None:
+                continue
+            naive.append(abs(x - truth[0]))
+            predicted.append(abs(predictor.predict(t + latency)[0] - truth[0]))
+    return np.array(naive), np.array(predicted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare naive and predictive aiming on logged tracks")
+    parser.add_argument("--dir", default="logs", help="directory with the event log files")
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.05, 0.1, 0.15, 0.2, 0.3],
+                        help="aiming latencies to evaluate, in seconds")
+    args = parser.parse_args()
+
+    tracks = load_tracks(args.dir)
+    if not tracks:
+        print("No track events found; run water_blaster_pi5.py with --log-tracks")
+        return
+    print(f"{len(tracks)} tracks, {sum(len(p) for p in tracks.values())} positions")
+    print(f"{'latency':>8} {'naive mean':>11} {'p95':>7} {'kalman mean':>12} {'p95':>7}  (px / servo µs)")
+    to_us = SERVO_RANGE / FRAME_WIDTH
+    for latency in args.latency:
+        naive, predicted = aim_errors(tracks, latency)
+        if not len(naive):
+            continue
+        print(f"{latency:>7.2f}s {naive.mean():>6.1f}/{naive.mean() * to_us:<4.0f} "
+              f"{np.percentile(naive, 95):>7.1f} {predicted.mean():>7.1f}/{predicted.mean() * to_us:<4.0f} "
+              f"{np.percentile(predicted, 95):>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+
+# Rate-limited servo output shared by the Water Blaster scripts.
+
+# The detection loops compute a new pulse width every frame, but most of those
+# are the same as, or within a few microseconds of, the last one. ServoDriver
+# takes the latest wanted pulse width with set() and sends it from its own
+# thread at a fixed update rate: requests that arrive between two updates are
+# coalesced, changes smaller than the deadband are not sent at all, and large
+# moves are spread over several updates so the servo never moves faster than
+# max_slew microseconds per second. Counts of issued and suppressed commands
+# show how much lgpio traffic this saves. If an observe callback is given, it
+# is called with ("decision_to_servo", seconds) when the first command for a
+# new request is sent.
+
+import threading
+import time
+
+import lgpio
+
+
+class ServoDriver:
+    """Sends servo pulse widths from a timer thread with deadband and slew limiting."""
+
+    def __init__(self, h, pin, initial, min_pulse=500, max_pulse=2500, deadband=5, max_slew=4000,
+                 rate=50, freq=50, observe=None):
+        self.h = h
+        self.pin = pin
+        self.min_pulse = min_pulse
+        self.max_pulse = max_pulse
+        self.deadband = deadband
+        self.max_slew = max_slew
+        self.rate = rate
+        self.freq = freq
+        self.observe = observe
+        self.issued = 0
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._target = self._clamp(initial)
+        self._pending = False
+        self._requested = None
+        self._goal = self._target
+        self.position = self._target
+        self._send(self.position)
+        self._thread = threading.Thread(target=self._run, name="servo", daemon=True)
+        self._thread.start()
+
+    def _clamp(self, duty):
+        return max(self.min_pulse, min(self.max_pulse, int(duty)))
+
+    def set(self, duty):
+        """Request a new pulse width; it is sent at the next update if it differs enough."""
+        with self._lock:
+            if self._pending:
+                self.suppressed += 1    # The previous request was never sent
+            self._target = self._clamp(duty)
+            self._pending = True
+            self._requested = time.monotonic()
+
+    def _run(self):
+        interval = 1.0 / self.rate
+        max_step = max(1, int(self.max_slew * interval))
+        due = time.monotonic()
+        while not self._stop.is_set():
+            due += interval
+            self._update(max_step)
+            delay = due - time.monotonic()
+            if delay < 0:
+                due = time.monotonic()  # Fell behind; don't send a burst to catch up
+            elif self._stop.wait(delay):
+                break
+
+    def _update(self, max_step):
+        with self._lock:
+            requested = None
+            if self._pending:
+                self._pending = False
+                if abs(self._target - self._goal) < self.deadband:
+                    self.suppressed += 1
+                else:
+                    self._goal = self._target
+                    requested = self._requested
+            if self._goal == self.position:
+                return
+            step = max(-max_step, min(max_step, self._goal - self.position))
+            self.position += step
+        self._send(self.position)
+        if requested is not None and self.observe is not None:
+            self.observe("decision_to_servo", time.monotonic() - requested)
+
+    def _send(self, duty):
+        lgpio.tx_servo(self.h, self.pin, duty, self.freq)
+        self.issued += 1
+
+    def summary(self):
+        return f"Servo: {self.issued} commands issued, {self.suppressed} suppressed"
+
+    def close(self, disable=True):
+        """Stop the update thread and, by default, turn the servo PWM off."""
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        if disable:
+            lgpio.tx_servo(self.h, self.pin, 0, 0)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Suggest exclusion zones from the Water Blaster's false-trigger heatmap.
+
+water_blaster_pi5.py counts, per cell of the frame, how many tracks passed
+through it and ended without being fired at (or confirmed by the
+classifier). Cells that keep collecting such tracks are bushes, flags or
+roads. This finds the areas with at least --min-count of them, smooths and
+pads them, and outlines each one as a polygon in main frame pixels. The
+polygons are printed, and can be added to an exclusion file with --output
+(keeping the zones already in it) and drawn over the heatmap with --image.
+
+Usage:
+    python3 suggest_exclusions.py logs/trigger_heatmap.npz
+    python3 suggest_exclusions.py logs/trigger_heatmap.npz --min-count 20 --output exclusion.json --image heat.png
+"""
+
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from exclusion import ExclusionZones
+
+
+def hot_regions(heat, min_count, close, margin):
+    """A uint8 mask of the cells with at least min_count triggers, gaps closed and padded by margin cells."""
+    mask = np.where(heat >= min_count, 255, 0).astype(np.uint8)
+    if close > 0:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * close + 1, 2 * close + 1))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    if margin > 0:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * margin + 1, 2 * margin + 1))
+        mask = cv2.dilate(mask, kernel)
+    return mask
+
+
+def outline(mask, cell, min_area, tolerance):
+    """Simplified outer contours of the mask, in frame pixels, with an area above min_area."""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    polygons = []
+    for contour in contours:
+        if cv2.contourArea(contour) * cell * cell < min_area:
+            continue
+        contour = cv2.approxPolyDP(contour, tolerance, True)
+        if len(contour) >= 3:
+            polygons.append(contour.reshape(-1, 2).astype(np.float64) * cell)
+    return polygons
+
+
+def draw(heat, zones, suggested, frame_size, path):
+    """Save the heatmap in false colour at frame size, with existing zones in white and suggestions in green."""
+    scaled = np.zeros(heat.shape, np.uint8) if heat.max() == 0 else \
+        cv2.convertScaleAbs(heat, alpha=255.0 / heat.max())
+    image = cv2.applyColorMap(cv2.resize(scaled, frame_size, interpolation=cv2.INTER_NEAREST), cv2.COLORMAP_JET)
+    if zones is not None:
+        cv2.polylines(image, [np.round(p).astype(np.int32) for p in zones.polygons], True, (255, 255, 255), 2)
+    cv2.polylines(image, [np.round(p).astype(np.int32) for p in suggested], True, (0, 255, 0), 2)
+    cv2.imwrite(path, image)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn the false-trigger heatmap into exclusion zones")
+    parser.add_argument("heatmap", help="heatmap file saved by water_blaster_pi5.py")
+    parser.add_argument("--min-count", type=float, default=10, help="unconfirmed triggers for a cell to be hot")
+    parser.add_argument("--close", type=int, default=2, help="join hot cells up to this many cells apart")
+    parser.add_argument("--margin", type=int, default=1, help="cells added around each hot area")
+    parser.add_argument("--min-area", type=float, default=400, help="smallest zone kept, in frame pixels")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="polygon simplification, in cells")
+    parser.add_argument("--output", metavar="FILE", help="add the zones to this exclusion file")
+    parser.add_argument("--image", metavar="PNG", help="draw the heatmap and the zones")
+    args = parser.parse_args()
+
+    with np.load(args.heatmap) as saved:
+        heat = saved["heat"]
+        cell = int(saved["cell"])
+        frame_size = tuple(int(v) for v in saved["frame_size"])
+        triggers = int(saved["triggers"])
+    print(f"{triggers} unconfirmed triggers on a {frame_size[0]}x{frame_size[1]} frame, "
+          f"hottest cell {heat.max():.0f}")
+
+    existing = None
+    if args.output and os.path.exists(args.output):
+        existing = ExclusionZones.load(args.output, frame_size)
+        # Only suggest what the current zones do not already cover
+        allowed = existing.rasterize(heat.shape)
+        heat = np.where(allowed > 0, heat, 0)
+
+    mask = hot_regions(heat, args.min_count, args.close, args.margin)
+    suggested = outline(mask, cell, args.min_area, args.tolerance)
+    frame_area = frame_size[0] * frame_size[1]
+    for i, polygon in enumerate(suggested, 1):
+        zone = np.zeros(heat.shape, np.uint8)
+        cv2.fillPoly(zone, [np.round(polygon / cell).astype(np.int32)], 1)
+        counts = heat[zone > 0]
+        area = cv2.contourArea(polygon.astype(np.float32))
+        peak = counts.max() if counts.size else 0
+        print(f"Zone {i}: {100 * area / frame_area:.1f}% of the frame, up to {peak:.0f} triggers per cell")
+        print("  " + " ".join(f"{int(x)},{int(y)}" for x, y in polygon))
+    if not suggested:
+        print(f"No area with {args.min_count:g} or more unconfirmed triggers")
+
+    if args.image:
+        draw(heat, existing, suggested, frame_size, args.image)
+        print(f"Saved {args.image}")
+    if args.output and suggested:
+        polygons = (existing.polygons if existing is not None else []) + suggested
+        ExclusionZones(polygons, frame_size).save(args.output)
+        print(f"Saved {len(polygons)} zones to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#! /usr/bin/env python3
+
+# Multi-target tracking for the Water Blaster.
+
+# Every motion blob in a frame is associated with an existing track or starts
+# a new one, so each animal keeps a stable ID while it is in view. Association
+# is done on whole arrays: centroid distances and box overlaps (IoU) between
+# all tracks and all blobs are computed in one go with NumPy, and pairs are
+# then taken greedily from the cheapest. Each track keeps its age, velocity
+# and how long it has been standing still (dwell), so the acquisition timer
+# runs per animal instead of resetting whenever the largest blob changes.
+
+import itertools
+
+import numpy as np
+
+POLICIES = ["dwell", "largest", "oldest", "center"]
+
+
+class Track:
+    """One tracked blob. Boxes are (x, y, w, h) in frame pixels."""
+
+    def __init__(self, track_id, box, now):
+        self.id = track_id
+        self.box = box
+        self.center = (box[0] + box[2] / 2, box[1] + box[3] / 2)
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.misses = 0
+        self.velocity = (0.0, 0.0)
+        self.still_since = None
+
+    @property
+    def area(self):
+        return self.box[2] * self.box[3]
+
+    def age(self, now):
+        return now - self.first_seen
+
+    def dwell(self, now):
+        """Seconds the track has been stationary, or 0 if it is moving."""
+        return 0.0 if self.still_since is None else now - self.still_since
+
+    def update(self, box, now, still_threshold, smoothing):
+        center = (box[0] + box[2] / 2, box[1] + box[3] / 2)
+        dt = now - self.last_seen
+        if dt > 0:
+            vx = (center[0] - self.center[0]) / dt
+            vy = (center[1] - self.center[1]) / dt
+            self.velocity = (self.velocity[0] + smoothing * (vx - self.velocity[0]),
+                             self.velocity[1] + smoothing * (vy - self.velocity[1]))
+        movement = abs(center[0] - self.center[0]) + abs(center[1] - self.center[1])
+        if movement < still_threshold:
+            if self.still_since is None:
+                self.still_since = now
+        else:
+            self.still_since = None
+        self.box = box
+        self.center = center
+        self.last_seen = now
+        self.hits += 1
+        self.misses = 0
+
+
+def box_iou(a, b):
+    """IoU between every box in a (N, 4) and every box in b (M, 4) as an (N, M) array."""
+    ax0, ay0 = a[:, 0:1], a[:, 1:2]
+    ax1, ay1 = ax0 + a[:, 2:3], ay0 + a[:, 3:4]
+    bx0, by0 = b[:, 0], b[:, 1]
+    bx1, by1 = bx0 + b[:, 2], by0 + b[:, 3]
+    iw = np.clip(np.minimum(ax1, bx1) - np.maximum(ax0, bx0), 0, None)
+    ih = np.clip(np.minimum(ay1, by1) - np.maximum(ay0, by0), 0, None)
+    inter = iw * ih
+    union = a[:, 2:3] * a[:, 3:4] + b[:, 2] * b[:, 3] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+class Tracker:
+    """Associates blobs with persistent tracks across frames."""
+
+    def __init__(self, max_distance=100, min_iou=0.1, max_misses=5, still_threshold=50, smoothing=0.5):
+        self.max_distance = max_distance
+        self.min_iou = min_iou
+        self.max_misses = max_misses
+        self.still_threshold = still_threshold
+        self.smoothing = smoothing
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes, now):
+        """Update the tracks with this frame's blobs, an (N, 4) array of boxes.
+
+        Returns the tracks that were seen in this frame.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        matched_tracks = set()
+        matched_boxes = set()
+
+        if self.tracks and len(boxes):
+            track_boxes = np.array([t.box for t in self.tracks], dtype=np.float64)
+            track_centers = track_boxes[:, :2] + track_boxes[:, 2:] / 2
+            box_centers = boxes[:, :2] + boxes[:, 2:] / 2
+            distance = np.linalg.norm(track_centers[:, None, :] - box_centers[None, :, :], axis=2)
+            iou = box_iou(track_boxes, boxes)
+            # A pair may match if the boxes overlap or the centroids are close;
+            # prefer overlapping pairs, then the closest
+            valid = (iou >= self.min_iou) | (distance <= self.max_distance)
+            cost = np.where(valid, distance * (1.0 - iou), np.inf)
+            for flat in np.argsort(cost, axis=None):
+                ti, bi = divmod(int(flat), len(boxes))
+                if not np.isfinite(cost[ti, bi]):
+                    break
+                if ti in matched_tracks or bi in matched_boxes:
+                    continue
+                box = tuple(int(v) for v in boxes[bi])
+                self.tracks[ti].update(box, now, self.still_threshold, self.smoothing)
+                matched_tracks.add(ti)
+                matched_boxes.add(bi)
+
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+
+        for bi in range(len(boxes)):
+            if bi not in matched_boxes:
+                self.tracks.append(Track(next(self._ids), tuple(int(v) for v in boxes[bi]), now))
+
+        return [t for t in self.tracks if t.misses == 0]
+
+    def follow(self, track_id, box, now):
+        """Move one track to a box found without a full detection (optical flow, say).
+
+        The other tracks are left as they are: they were not looked for, so
+        they do not miss. Returns the list of tracks seen, the one that moved.
+        """
+        for track in self.tracks:
+            if track.id == track_id:
+                track.update(tuple(int(v) for v in box), now, self.still_threshold, self.smoothing)
+                return [track]
+        return []
+
+    def reset(self):
+        self.tracks = []
+
+
+def select_track(tracks, policy, now, current_id=None, frame_center=None, min_dwell=0.0):
+    """Choose which track the servo should engage.
+
+    The currently engaged track is kept while it is visible, unless it is not
+    yet acquired (dwell below min_dwell) and another track is. Otherwise the
+    best track by policy wins: longest "dwell", "largest" area, "oldest", or
+    nearest the frame "center".
+    """
+    if not tracks:
+        return None
+    current = next((t for t in tracks if t.id == current_id), None)
+    if current is not None:
+        if current.dwell(now) >= min_dwell or not any(t.dwell(now) >= min_dwell for t in tracks):
+            return current
+
+    if policy == "largest":
+        return max(tracks, key=lambda t: t.area)
+    if policy == "oldest":
+        return min(tracks, key=lambda t: t.first_seen)
+    if policy == "center" and frame_center is not None:
+        return min(tracks, key=lambda t: abs(t.center[0] - frame_center[0]) + abs(t.center[1] - frame_center[1]))
+    return max(tracks, key=lambda t: (t.dwell(now), t.area))
@@ -10,16 +10,86 @@
 # and fire a water valve relay.
 
 # Start the code from your terminal: python3 water_blaster_rpi5.py
-# A monitor window will open to show the targeting video. On startup, a
-# reference frame is captured. When a new object is detected, a green targeting
-# rectangle appears, and the state changes to "Occupied". If the target
-# remains still for MIN_AQUIRE_TIME seconds, a picture is saved to the
-# 'trigger_pictures' directory, and the water valve is opened for a few seconds.
-
-# To prevent false triggers from gradual changes (like clouds), the reference
-# frame is updated periodically. If too many triggers occur, a refresh is forced.
-
-# Logs all activity to a file named "log_<date_time>.txt".
+# By default frames are captured on a background thread into a small ring
+# buffer and the detector always works on the newest one. Use
+# "--capture sync" to capture and process on a single thread instead.
+# A monitor window will open to show the targeting video. In the field, use
+# "--headless" to skip all display work, optionally with "--preview 8080" to
+# watch an MJPEG stream at http://127.0.0.1:8080/ only when needed. Per-stage
+# timings are logged with the frame rates; "--metrics 9100" also serves them
+# at http://127.0.0.1:9100/metrics, and "kill -USR1" switches the timers off
+# and on while running. On startup, a reference frame is captured. When a new
+# object is detected, a green targeting rectangle appears, and the state
+# changes to "Occupied". Every moving object gets its own track with a stable
+# ID; the servo engages one of them, chosen by TRACK_PRIORITY. A Kalman filter
+# per target predicts where it will be once the servo gets there (AIM_LATENCY
+# seconds after the frame), and the servo is aimed at that point. Once a
+# target is engaged, the full detection runs only every FLOW_INTERVAL frames;
+# in between, the target is followed with sparse optical flow on a small crop
+# around it (see optical_flow.py), and a full detection runs early if the flow
+# loses it ("--flow 0" detects every frame). If the engaged target remains
+# still for MIN_AQUIRE_TIME seconds, a picture is saved to the
+# 'trigger_pictures' directory, and the water valve is opened for a few
+# seconds. Pictures are written by a background thread, so the valve never
+# waits on disk. A short video clip from before and after each acquisition or
+# shot is saved to the 'clips' directory (disable with "--no-clips"). The
+# valve and servo sweep run on their own thread, so detection keeps running
+# during a shot and the sweep follows the target if it moves.
+
+# Every frame is timed by when the camera captured it: its SensorTimestamp is
+# mapped to the monotonic clock, and the acquisition, reference refresh and
+# shot rate-limit timers all run on that capture time rather than on the wall
+# clock. The latency from capture to the loop's decision, and from a decision
+# to the servo moving or the valve opening, is logged with the stage timings.
+
+# To prevent false triggers from gradual changes (like clouds), the background
+# model adapts a little on every frame (or, with "--background static", a
+# single reference frame is replaced periodically). The model is not updated
+# where a target is being tracked. If too many triggers occur, the background
+# is rebuilt from the current frame.
+
+# With "--pyramid 4" (or 2, 8) motion is searched for on a downscaled frame and
+# only the region around the chosen target is processed at full resolution.
+# This keeps the frame rate up when FRAME_WIDTH/FRAME_HEIGHT are raised.
+# The detection steps reuse preallocated buffers from frame to frame, and
+# "--blur box" or "--blur stack" swaps the Gaussian blur for a cheaper one.
+# The motion mask is checked on a grid of BLOCK_SIZE blocks first: frames
+# with no active block skip dilation and blob extraction, and the others run
+# them only around the active blocks ("--block-size 0" processes the whole
+# mask every frame).
+
+# "--verify models/deer.onnx" adds a check before firing: the box around each
+# target is classified with a small ONNX model (see classifier.py), a few
+# times per track, and only targets of the CLASSIFIER_POSITIVE classes are
+# fired at. Each track's label is shown next to its ID.
+
+# After IDLE_DELAY seconds with no motion and no target, the camera frame rate
+# and the loop drop to IDLE_FRAME_RATE, and they return to FRAME_RATE on the
+# first frame with motion. Time and CPU use in each power state are logged
+# with the frame rates. "--idle-fps 0" keeps the full rate at all times.
+
+# Motion inside the polygons in exclusion.json (EXCLUSION_FILE) is ignored by
+# the gate and the background stage. Tracks that end without being fired at
+# (or, with "--verify", confirmed) are counted in a heatmap in HEATMAP_FILE;
+# suggest_exclusions.py turns its hot areas into polygons for the file.
+
+# A cheap frame-difference gate runs on every frame. While nothing moves and
+# nothing is being tracked, the blur, background and blob stages are skipped,
+# apart from a full pass every GATE_IDLE_INTERVAL frames so the background
+# keeps learning and very slow movers are still found. "--no-gate" always
+# runs the full pipeline. The gate's hit rate and the time it saved are logged
+# with the frame rates.
+
+# The camera delivers two streams: a full-size RGB "main" stream used only for
+# display and trigger pictures, and a small YUV420 "lores" stream whose Y
+# (luma) plane goes straight to the detector without a color conversion.
+# Detection coordinates are scaled up to the main stream for drawing and for
+# aiming the servo. "--stream main" detects on the converted main stream.
+
+# Logs all activity as structured events (messages, state changes, shots,
+# reference refreshes and performance samples) to logs/events_<date>_<n>.jsonl.
+# The log is written in batches by a background thread and rotates daily or
+# by size. Use query_events.py to read it, e.g. "--shots-per-night".
 
 # The code uses the rpi-lgpio library, which provides stable servo control via
 # the 'lgd' daemon.
@@ -28,13 +98,33 @@
 # Modernized for Raspberry Pi 5 by AI Assistant 10/26/2023
 
 # Import the necessary packages
+import argparse
 import datetime
 from datetime import timedelta
 import time
 import cv2
 import lgpio
+import numpy as np
 import os
+import signal
 from picamera2 import Picamera2
+from actuator import FiringScheduler
+from servo import ServoDriver
+from background import ENGINES, create_background
+from cascade import GatedStage, MotionGate
+from classifier import RoiClassifier, TrackVerifier, load_labels
+from clip_recorder import ClipRecorder
+from event_log import EventLog
+from exclusion import ExclusionZones, TriggerHeatmap
+from frame_capture import CaptureThread, FrameClock, FrameRing, RateMeter
+from metrics import MetricsServer, StageTimer
+from image_writer import POLICIES, ImageWriter
+from motion import BLOB_BACKENDS, BLUR_BACKENDS, MAX_BLOCK_SIZE, MotionDetector, refine_target, scaled_blur_size
+from optical_flow import FlowTracker
+from predictor import KalmanPredictor
+from power import PowerScheduler
+from preview import OverlayText, PreviewServer
+from tracker import POLICIES as TRACK_POLICIES, Tracker, select_track
 
 # --- Configuration Constants ---
 
@@ -54,33 +144,177 @@ FRAME_WIDTH = 640           # Video frame width in pixels
 FRAME_HEIGHT = 480          # Video frame height in pixels
 MIN_CONTOUR_AREA = 500      # Ignore motion contours smaller than this area
 TARGET_MOVEMENT_THRESHOLD = 50 # How many pixels a target can move and still be "stationary"
+TRACK_MAX_DISTANCE = 100    # Max pixels a target can move between frames and keep its track
+FLOW_INTERVAL = 5           # Full detection every this many frames while a target is followed by optical flow; 0 disables
+FLOW_POINTS = 20            # Corners followed inside the engaged target's box
+FLOW_MIN_CONFIDENCE = 0.5   # Fraction of the corners still followed; below it detection runs again
+FLOW_MARGIN = 60            # Pixels the target may move between frames and still be followed
+TRACK_MAX_MISSES = 5        # Frames a track survives without a matching blob
+TRACK_PRIORITY = "dwell"    # Which track to engage: "dwell", "largest", "oldest" or "center"
 THRESHOLD_SENSITIVITY = 25  # Object detection sensitivity (1-100). Lower is more sensitive.
 BLUR_SIZE = 21              # Blur kernel size to smooth image and reduce noise
+BLUR_BACKEND = "gaussian"   # "gaussian", or the cheaper "box" or "stack" blur of about the same strength
+BLOCK_SIZE = 16             # Motion activity grid block size in detection pixels (at most 16); 0 disables the grid
+BLOCK_MIN_PIXELS = 1        # Foreground pixels for a grid block to count as active
+BACKGROUND_ENGINE = "running" # One of background.ENGINES; "static" is a single reference frame
+FREEZE_MARGIN = 20          # Pixels around a target where the background is not updated
+BLOB_BACKEND = "contours"   # "contours" (outline tracing) or "components" (one labelling pass, faster on noisy masks)
+PYRAMID_SCALE = 1           # Search for motion at 1/N size (1, 2, 4 or 8); 1 disables
+DETECT_STREAM = "lores"     # Detect on the "lores" luma plane or the converted "main" stream
+LORES_WIDTH = 320           # Detection (lores) stream width in pixels
+LORES_HEIGHT = 240          # Detection (lores) stream height in pixels
+FRAME_RATE = 30             # Camera frame rate while anything is happening
+IDLE_FRAME_RATE = 5         # Camera and processing frame rate while the scene is empty; 0 disables
+IDLE_DELAY = 30             # Seconds without motion or targets before dropping to IDLE_FRAME_RATE
+
+# Capture constants
+CAPTURE_MODE = "threaded"   # "threaded" (capture thread + ring buffer) or "sync"
+CAPTURE_RING_SLOTS = 3      # Number of preallocated frame buffers in the ring
+FPS_REPORT_INTERVAL = 30    # Seconds between capture/processing FPS log lines
+STAGE_TIMERS = True         # Time every stage of the loop; SIGUSR1 toggles this while running
+
+# Target verification (enabled with --verify MODEL)
+CLASSIFIER_POSITIVE = ["deer"] # Class labels that may be fired at
+CLASSIFIER_INPUT_SIZE = 224 # Side of the square input the model expects
+CLASSIFIER_SCALE = 1 / 255  # Input pixel scale factor
+CLASSIFIER_MEAN = (0, 0, 0) # Per-channel value subtracted before scaling
+CLASSIFIER_SWAP_RB = False  # True if the model expects BGR input
+CLASSIFIER_THRESHOLD = 0.6  # Mean probability of the positive classes needed to fire
+CLASSIFIER_CHECKS = 3       # Classifications per track before its verdict is final
+CLASSIFIER_INTERVAL = 0.5   # Seconds between the classifications of a track
+
+# Motion gate
+GATE_WIDTH = 160            # Width of the tiny frame the gate compares
+GATE_THRESHOLD = 15         # Change in brightness (0-255) that counts as motion
+GATE_MIN_FRACTION = 0.001   # Fraction of the tiny frame that must change to open the gate
+GATE_COOLDOWN = 2.0         # Seconds the full pipeline keeps running after the last motion
+GATE_IDLE_INTERVAL = 15     # Run the full pipeline at least once every this many frames
+
+# Trigger picture constants
+PICTURE_FORMAT = "jpg"      # "jpg" or "png"
+PICTURE_JPEG_QUALITY = 90   # JPEG quality (0-100)
+PICTURE_PNG_COMPRESSION = 3 # PNG compression level (0-9)
+PICTURE_QUEUE_SIZE = 8      # Pictures waiting to be written before the queue policy applies
+PICTURE_QUEUE_POLICY = "drop_oldest" # "drop_oldest" (never wait) or "block"
+
+# Event log constants
+LOG_DIR = "logs"            # Directory for the JSONL event logs
+LOG_MAX_BYTES = 10_000_000  # Start a new log file when one reaches this size
+LOG_RETENTION_DAYS = 30     # Delete log files older than this
+LOG_FLUSH_INTERVAL = 2.0    # Seconds between batched writes
+LOG_FLUSH_SIZE = 100        # Write early once this many events are waiting
+
+# Exclusion zone constants
+EXCLUSION_FILE = "exclusion.json" # Polygons where motion is ignored (see exclusion.py); optional
+HEATMAP_FILE = "logs/trigger_heatmap.npz" # Where unconfirmed triggers are counted, across runs
+HEATMAP_CELL = 4            # Main frame pixels per heatmap cell
+
+# Event clip constants
+CLIP_PRE_SECONDS = 5        # Seconds of video kept from before an event
+CLIP_POST_SECONDS = 5       # Seconds of video recorded after the last event
+CLIP_FPS = 10               # Frame rate of the clip buffer
+CLIP_WIDTH = 320            # Clip frame size; frames are downscaled before buffering
+CLIP_HEIGHT = 240
+CLIP_JPEG_QUALITY = 70      # JPEG quality of the buffered frames
+CLIP_MAX_SECONDS = 60       # Longest clip; sustained activity is saved as consecutive clips
+
+# Display constants
+PREVIEW_MAX_FPS = 5         # Frame rate cap of the MJPEG preview stream
+PREVIEW_JPEG_QUALITY = 70   # JPEG quality of the MJPEG preview stream
 
 # Servo constants
 SERVO_MAX_RANGE = 2200      # Max pulse width in microseconds (us) for servo
 SERVO_MIN_RANGE = 800       # Min pulse width in microseconds (us) for servo
 SERVO_CENTER_ADJ = 0        # Fine-tune servo center alignment (us)
 SERVO_TRIGGER_SWEEP = 100   # How far (in us) to sweep the servo when shooting
+SERVO_TRIGGER_SWEEPS = 5    # Number of left/right sweeps per shot
+SERVO_SWEEP_STEP = 0.2      # Seconds spent at each side of a sweep
+VALVE_MAX_OPEN_TIME = 3.0   # Hard deadline (seconds) after which the valve is always closed
+SERVO_DEADBAND = 8          # Aiming changes smaller than this (us) are not sent to the servo
+SERVO_MAX_SLEW = 4000       # Fastest servo movement in us per second
+SERVO_UPDATE_RATE = 50      # Servo commands per second at most (the PWM frequency)
 SERVO_CENTER = int((SERVO_MIN_RANGE + SERVO_MAX_RANGE) / 2 + SERVO_CENTER_ADJ)
+AIM_LATENCY = 0.15          # Measured seconds from frame capture until the servo reaches its new position
+
+# --- Command Line ---
+parser = argparse.ArgumentParser(description="Motion-controlled water blaster")
+parser.add_argument("--capture", choices=["threaded", "sync"], default=CAPTURE_MODE,
+                    help="capture on a background thread, or in series with processing")
+parser.add_argument("--background", choices=ENGINES, default=BACKGROUND_ENGINE,
+                    help="background model used for motion detection")
+parser.add_argument("--blobs", choices=BLOB_BACKENDS, default=BLOB_BACKEND,
+                    help="how blobs are extracted from the motion mask")
+parser.add_argument("--blur", choices=BLUR_BACKENDS, default=BLUR_BACKEND,
+                    help="blur used to smooth the detection frame")
+parser.add_argument("--block-size", type=int, choices=range(MAX_BLOCK_SIZE + 1), default=BLOCK_SIZE, metavar="N",
+                    help=f"motion activity grid block size, up to {MAX_BLOCK_SIZE}; 0 dilates and labels the whole mask")
+parser.add_argument("--pyramid", type=int, choices=[1, 2, 4, 8], default=PYRAMID_SCALE,
+                    help="search for motion at 1/N resolution, refine only around the target")
+parser.add_argument("--flow", type=int, default=FLOW_INTERVAL, metavar="N",
+                    help="follow the engaged target with optical flow, detecting fully every N frames; 0 disables")
+parser.add_argument("--track-priority", choices=TRACK_POLICIES, default=TRACK_PRIORITY,
+                    help="which tracked target the servo engages")
+parser.add_argument("--aim-latency", type=float, default=AIM_LATENCY,
+                    help="seconds to lead a moving target by; 0 aims where it was seen")
+parser.add_argument("--log-tracks", action="store_true",
+                    help="log every tracked position, for replay_tracks.py")
+parser.add_argument("--verify", metavar="MODEL",
+                    help="only fire at targets an ONNX classifier puts in a positive class")
+parser.add_argument("--labels", metavar="FILE",
+                    help="class labels of the --verify model, one per line (default: MODEL with .txt)")
+parser.add_argument("--positive", nargs="+", default=CLASSIFIER_POSITIVE,
+                    help="class labels that may be fired at")
+parser.add_argument("--idle-fps", type=float, default=IDLE_FRAME_RATE,
+                    help="frame rate while nothing is happening; 0 always runs at full rate")
+parser.add_argument("--idle-delay", type=float, default=IDLE_DELAY,
+                    help="seconds without motion or targets before dropping to the idle frame rate")
+parser.add_argument("--exclude", metavar="FILE", default=EXCLUSION_FILE,
+                    help="JSON file of polygons where motion is ignored (see suggest_exclusions.py)")
+parser.add_argument("--heatmap", metavar="FILE", default=HEATMAP_FILE,
+                    help="file the false-trigger heatmap is kept in")
+parser.add_argument("--no-gate", action="store_true",
+                    help="run the full detection pipeline on every frame")
+parser.add_argument("--stream", choices=["lores", "main"], default=DETECT_STREAM,
+                    help="camera stream used for motion detection")
+parser.add_argument("--picture-queue", choices=POLICIES, default=PICTURE_QUEUE_POLICY,
+                    help="what to do when the trigger picture queue is full")
+parser.add_argument("--no-clips", action="store_true",
+                    help="do not record video clips around events")
+parser.add_argument("--headless", action="store_true",
+                    help="run without a monitor window; no display work is done")
+parser.add_argument("--preview", type=int, metavar="PORT",
+                    help="serve an MJPEG preview on http://127.0.0.1:PORT/")
+parser.add_argument("--metrics", type=int, metavar="PORT",
+                    help="serve stage timings and counters on http://127.0.0.1:PORT/metrics")
+parser.add_argument("--no-timers", action="store_true",
+                    help="start with the stage timers off (SIGUSR1 turns them on)")
+args = parser.parse_args()
 
 # --- Initialization ---
 
+# Set up the event clip recorder. Its worker process is started here, before
+# any other threads exist.
+clipRecorder = None
+if not args.no_clips:
+    clipRecorder = ClipRecorder("clips", CLIP_PRE_SECONDS, CLIP_POST_SECONDS, CLIP_FPS,
+                                (CLIP_WIDTH, CLIP_HEIGHT), CLIP_JPEG_QUALITY, max_seconds=CLIP_MAX_SECONDS)
+
 # Set up logging
 startTime = datetime.datetime.now()
-log_filename = "log_" + startTime.strftime("%Y_%m_%d__%H_%M_%S") + ".txt"
-logfile = open(log_filename, "w")
+eventLog = EventLog(LOG_DIR, max_bytes=LOG_MAX_BYTES, retention_days=LOG_RETENTION_DAYS,
+                    flush_interval=LOG_FLUSH_INTERVAL, flush_size=LOG_FLUSH_SIZE)
 
 def log_message(message):
-    """Prints a message to the console and writes it to the log file."""
+    """Prints a message to the console and records it in the event log."""
     print(message)
-    logfile.write(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {message}\n")
-    logfile.flush() # Ensure message is written immediately
+    eventLog.emit("message", text=message)
 
 log_message("Starting Water Blaster System...")
 
-# Set up a directory to save pictures to
+# Set up a directory to save pictures to, and the writer that saves them
 os.makedirs("trigger_pictures", exist_ok=True)
+imageWriter = ImageWriter(PICTURE_QUEUE_SIZE, jpeg_quality=PICTURE_JPEG_QUALITY,
+                          png_compression=PICTURE_PNG_COMPRESSION, policy=args.picture_queue)
 
 # Initialize GPIO
 try:
@@ -93,114 +327,449 @@ try:
     lgpio.gpio_write(h, TRIGGER, 0) # Ensure relay is off
 except Exception as e:
     log_message(f"FATAL: Could not initialize GPIO. Is lgd running? Error: {e}")
+    eventLog.close()
     exit()
 
 # Initialize Camera
 try:
     picam2 = Picamera2()
-    config = picam2.create_video_configuration(main={"size": (FRAME_WIDTH, FRAME_HEIGHT), "format": "RGB888"})
+    if args.stream == "lores":
+        config = picam2.create_video_configuration(main={"size": (FRAME_WIDTH, FRAME_HEIGHT), "format": "RGB888"},
+                                                   lores={"size": (LORES_WIDTH, LORES_HEIGHT), "format": "YUV420"},
+                                                   controls={"FrameRate": FRAME_RATE})
+        detectWidth, detectHeight = LORES_WIDTH, LORES_HEIGHT
+    else:
+        config = picam2.create_video_configuration(main={"size": (FRAME_WIDTH, FRAME_HEIGHT), "format": "RGB888"},
+                                                   controls={"FrameRate": FRAME_RATE})
+        detectWidth, detectHeight = FRAME_WIDTH, FRAME_HEIGHT
     picam2.configure(config)
+
+    def grab_frame():
+        """Capture one frame as ((main RGB frame, grayscale detection frame), SensorTimestamp)."""
+        if args.stream == "lores":
+            (mainArray, loresArray), metadata = picam2.capture_arrays(["main", "lores"])
+            # The Y plane is the top detectHeight rows of the YUV420 buffer
+            return (mainArray, loresArray[:detectHeight, :detectWidth]), metadata.get("SensorTimestamp", 0)
+        (frame,), metadata = picam2.capture_arrays(["main"])
+        # Converted into the same buffer every frame; the ring copies it out in threaded mode
+        return (frame, cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=grayBuffer)), metadata.get("SensorTimestamp", 0)
+
+    grayBuffer = np.empty((detectHeight, detectWidth), np.uint8)
+
     picam2.start()
     log_message("Camera initialized. Warming up...")
     time.sleep(2.0) # Allow camera to stabilize
+
+    # In threaded mode, frames are captured continuously into a ring buffer.
+    # Either way each frame is stamped with its capture time.
+    frameClock = FrameClock()
+    captureThread = None
+    if args.capture == "threaded":
+        frameRing = FrameRing(CAPTURE_RING_SLOTS)
+        captureThread = CaptureThread(grab_frame, frameRing, frameClock)
+        captureThread.start()
+    log_message(f"Capture mode: {args.capture}, detecting on {args.stream} stream at {detectWidth}x{detectHeight}")
 except Exception as e:
     log_message(f"FATAL: Could not initialize camera. Is it connected properly? Error: {e}")
     lgpio.gpiochip_close(h)
+    eventLog.close()
     exit()
 
-# Initialize servo to the center position
-lgpio.tx_servo(h, SERVO, SERVO_CENTER, 50) # 50Hz is standard for servos
-time.sleep(1)
+# Stage timings, and the latencies the servo and valve report back
+stageTimer = StageTimer(enabled=STAGE_TIMERS and not args.no_timers)
+
+def observe_latency(name, seconds):
+    stageTimer.observe(name, seconds)   # Looked up on each call; toggled by SIGUSR1
+
+# Initialize servo to the center position. All servo moves go through the
+# driver, which coalesces them and sends them at a fixed rate.
+servo = ServoDriver(h, SERVO, SERVO_CENTER, min_pulse=SERVO_MIN_RANGE, max_pulse=SERVO_MAX_RANGE,
+                    deadband=SERVO_DEADBAND, max_slew=SERVO_MAX_SLEW, rate=SERVO_UPDATE_RATE,
+                    observe=observe_latency)
+
+# The firing scheduler owns the valve, and the servo while a shot is running
+firing = FiringScheduler(h, TRIGGER, servo, SERVO_TRIGGER_SWEEP, sweeps=SERVO_TRIGGER_SWEEPS,
+                         step=SERVO_SWEEP_STEP, max_open_time=VALVE_MAX_OPEN_TIME, observe=observe_latency)
+
+# Exclusion zones are dropped from the motion masks; the heatmap learns new ones
+exclusionZones = None
+if os.path.exists(args.exclude):
+    try:
+        exclusionZones = ExclusionZones.load(args.exclude, (FRAME_WIDTH, FRAME_HEIGHT))
+    except (OSError, ValueError, KeyError) as e:
+        log_message(f"FATAL: Could not load the exclusion zones {args.exclude}. Error: {e}")
+        lgpio.gpiochip_close(h)
+        eventLog.close()
+        exit()
+    log_message(f"Excluding {len(exclusionZones)} zones ({100 * exclusionZones.coverage():.0f}% of the frame) "
+                f"from {args.exclude}")
+heatmap = TriggerHeatmap.load(args.heatmap, (FRAME_WIDTH, FRAME_HEIGHT), HEATMAP_CELL)
+confirmedIds = set()    # Tracks fired at or accepted by the classifier
 
 # Initialize state variables
-firstFrame = None
-refFrameTime = datetime.datetime.now()
+background = create_background(args.background, THRESHOLD_SENSITIVITY)
+backgroundReady = False
+freezeRegions = []
+log_message(f"Background engine: {args.background}")
+
+# Detection-scale parameters. Sizes in the constants are in main frame pixels;
+# the detection stream may be smaller, and in pyramid mode the background
+# model works on a further downscaled frame, so areas and margins shrink with it
+detectScale = FRAME_WIDTH / detectWidth
+scale = args.pyramid
+detectBlurSize = scaled_blur_size(BLUR_SIZE, detectScale)
+detectMinArea = MIN_CONTOUR_AREA / (detectScale * detectScale)
+coarseBlurSize = scaled_blur_size(BLUR_SIZE, detectScale * scale)
+coarseMinArea = detectMinArea / (scale * scale)
+coarseFreezeMargin = int(FREEZE_MARGIN / (detectScale * scale))
+coarseToMain = detectScale * scale
+
+# Blur, background and dilation write into buffers allocated once, on the first frame
+motionDetector = MotionDetector(background, coarseBlurSize, scale, args.blur, exclusionZones,
+                                block_size=args.block_size, block_threshold=BLOCK_MIN_PIXELS)
+
+# Targets are tracked in main frame coordinates
+tracker = Tracker(TRACK_MAX_DISTANCE, max_misses=TRACK_MAX_MISSES, still_threshold=TARGET_MOVEMENT_THRESHOLD)
+engagedId = None
+predictors = {}
+
+# Between full detections the engaged target is followed by optical flow, on the detection frame
+flowTracker = None
+if args.flow > 1:
+    flowTracker = FlowTracker(args.flow, FLOW_POINTS, min_confidence=FLOW_MIN_CONFIDENCE,
+                              margin=max(4, int(FLOW_MARGIN / detectScale)))
+if scale > 1:
+    log_message(f"Pyramid detection at 1/{scale} scale")
+
+# Optional classifier that must confirm a target before it is fired at
+verifier = None
+if args.verify:
+    try:
+        labelsPath = args.labels or os.path.splitext(args.verify)[0] + ".txt"
+        classifier = RoiClassifier(args.verify, load_labels(labelsPath), input_size=CLASSIFIER_INPUT_SIZE,
+                                   scale=CLASSIFIER_SCALE, mean=CLASSIFIER_MEAN, swap_rb=CLASSIFIER_SWAP_RB)
+        verifier = TrackVerifier(classifier, args.positive, threshold=CLASSIFIER_THRESHOLD,
+                                 checks=CLASSIFIER_CHECKS, interval=CLASSIFIER_INTERVAL)
+    except (OSError, ValueError, cv2.error) as e:
+        log_message(f"FATAL: Could not load the classifier {args.verify}. Error: {e}")
+        lgpio.gpiochip_close(h)
+        eventLog.close()
+        exit()
+    log_message(f"Verifying targets with {args.verify}; firing at {', '.join(args.positive)}")
+
+# Display: status and clock text come from cached overlay layers
+preview = None
+if args.preview:
+    preview = PreviewServer(args.preview, max_fps=PREVIEW_MAX_FPS, quality=PREVIEW_JPEG_QUALITY)
+    log_message(f"MJPEG preview on http://127.0.0.1:{args.preview}/")
+displayFrame = None     # BGR copy for cv2.imshow, reused every frame
+statusOverlay = OverlayText((10, 20), 0.7, (0, 0, 255), 2)
+clockOverlay = OverlayText((10, FRAME_HEIGHT - 10), 0.5, (0, 0, 255), 1)
+
+refFrameTime = time.monotonic()   # Capture time of the frame the background was rebuilt from
 monitorText = "Unoccupied"
-targetFirstAquiredTime = datetime.datetime.fromtimestamp(0) # Use a valid old date
+lastMonitorText = monitorText
 shotsSinceRefresh = 0
 totalShots = 0
 lastTargetX = 0
 lastTargetY = 0
 forceRefresh = False
+motionGate = MotionGate(GATE_WIDTH, GATE_THRESHOLD, GATE_MIN_FRACTION, exclude=exclusionZones)
+detectionStage = GatedStage("Detection", GATE_COOLDOWN)
+idleFrames = 0
+power = PowerScheduler(picam2, FRAME_RATE, args.idle_fps, args.idle_delay)
+processMeter = RateMeter()
+metricsServer = None
+if args.metrics:
+    metricsServer = MetricsServer(stageTimer, args.metrics, "waterblaster")
+    log_message(f"Metrics on http://127.0.0.1:{args.metrics}/metrics")
+
+def toggle_timers(signum, frame):
+    stageTimer.toggle()
+    log_message(f"Stage timers {'on' if stageTimer.enabled else 'off'}")
+
+signal.signal(signal.SIGUSR1, toggle_timers)
+lastFpsReport = time.monotonic()
 
 # --- Main Loop ---
 try:
+    # Give the servo time to reach the center. Inside the try, so Ctrl+C (or
+    # the end of a replayed recording) here still shuts down cleanly.
+    time.sleep(1)
     while True:
+        # While idle, wait for the next (slower) frame slot before starting
+        power.pace()
+        stageTimer.start()
+
         # Check the debug switch. If switch is grounded, debug is on (no firing).
         debugging = lgpio.gpio_read(h, DEBUG_SWITCH) == 0
 
         # Grab the current frame from the camera
-        frame = picam2.capture_array()
-        
-        # Convert to grayscale and blur for motion detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        gray = cv2.GaussianBlur(gray, (BLUR_SIZE, BLUR_SIZE), 0)
-
-        # If reference frame is old or a refresh is forced, update it
-        if firstFrame is None or (datetime.datetime.now() - refFrameTime).seconds > REF_FRAME_TIME_LIMIT or forceRefresh:
-            log_message("Updating video reference frame.")
-            firstFrame = gray
-            refFrameTime = datetime.datetime.now()
-            shotsSinceRefresh = 0
-            forceRefresh = False
-            continue
+        if captureThread is not None:
+            latest = frameRing.latest(timeout=2.0)
+            if latest is None:
+                log_message(f"FATAL: No frames from capture thread. Error: {captureThread.error}")
+                break
+            _, frameTime, sensorTimestamp, (frame, luma) = latest
+            captureFps = captureThread.meter.rate
+            stageTimer.set_count("dropped", frameRing.dropped)
+        else:
+            (frame, luma), sensorTimestamp = grab_frame()
+            frameTime = frameClock.capture_time(sensorTimestamp)
+        processMeter.tick()
+        stageTimer.count("frames")
+        if captureThread is None:
+            captureFps = processMeter.rate
+
+        # Periodically report capture and processing rates
+        if time.monotonic() - lastFpsReport >= FPS_REPORT_INTERVAL:
+            lastFpsReport = time.monotonic()
+            dropped = frameRing.dropped if captureThread is not None else 0
+            log_message(f"Capture {captureFps:.1f} fps, processing {processMeter.rate:.1f} fps, "
+                        f"dropped {dropped} frames")
+            log_message(imageWriter.summary())
+            log_message(servo.summary())
+            log_message(stageTimer.summary())
+            log_message(stageTimer.latency_summary())
+            log_message(detectionStage.summary(motionGate.time))
+            log_message(motionDetector.summary())
+            if flowTracker is not None:
+                log_message(flowTracker.summary())
+            log_message(power.summary())
+            heatmap.save(args.heatmap)
+            if verifier is not None:
+                log_message(verifier.summary())
+            stageTimer.roll()
+            eventLog.emit("perf", capture_fps=round(captureFps, 1), process_fps=round(processMeter.rate, 1),
+                          dropped=dropped, picture_queue=imageWriter.depth,
+                          pictures_dropped=imageWriter.dropped, picture_max_ms=round(imageWriter.max_write_ms, 1),
+                          servo_issued=servo.issued, servo_suppressed=servo.suppressed,
+                          gate_hit_rate=round(detectionStage.hit_rate, 3),
+                          gate_saved_s=round(detectionStage.saved(), 1), early_exits=motionDetector.early_exits,
+                          flow_followed=flowTracker.followed if flowTracker is not None else 0, power=power.state,
+                          power_idle_s=round(power.wall["idle"]), power_active_s=round(power.wall["active"]))
+        stageTimer.mark("capture")
+
+        # Check for motion since the last frame. The full pipeline runs while
+        # the gate is open, while anything is tracked, and on a heartbeat.
+        moved = motionGate.detect(luma)
+        gateOpen = detectionStage.gate(moved, frameTime)
+        idleFrames += 1
+        fullPass = (args.no_gate or gateOpen or tracker.tracks or not backgroundReady or forceRefresh
+                    or idleFrames >= GATE_IDLE_INTERVAL)
+        stageTimer.mark("gate")
+
+        # Between full detections, follow the engaged target with optical flow.
+        # If the flow loses it, the full detection runs on this frame instead.
+        flowBox = None
+        flowSeed = None         # Box to seed the flow with after a full detection
+        if flowTracker is not None and engagedId is not None and not flowTracker.due() and not forceRefresh:
+            flowBox = flowTracker.follow(luma)
+            stageTimer.mark("flow")
+
+        if flowBox is not None:
+            # Only the engaged target was looked for; the background model waits.
+            # The gate did not close, so these frames count in the flow stats, not as skips.
+            blobs = []
+        elif fullPass:
+            idleFrames = 0
+            stageStart = time.perf_counter()
+
+            # Blur the grayscale detection frame to reduce noise (into a reused buffer)
+            gray = motionDetector.prepare(luma)
+            stageTimer.mark("blur")
+
+            # Rebuild the background on startup or when a refresh is forced. The
+            # static engine is also rebuilt when it gets old; adaptive engines keep
+            # themselves current. Never take a new reference while the valve is spraying.
+            refFrameExpired = not background.adaptive and frameTime - refFrameTime > REF_FRAME_TIME_LIMIT
+            if (not backgroundReady or refFrameExpired or forceRefresh) and not firing.busy:
+                log_message("Updating video reference frame.")
+                reason = "forced" if forceRefresh else "expired" if backgroundReady else "startup"
+                eventLog.emit("refresh", reason=reason, engine=args.background)
+                background.reset(gray)
+                backgroundReady = True
+                tracker.reset()
+                predictors.clear()
+                if flowTracker is not None:
+                    flowTracker.reset()
+                heatmap.discard()
+                confirmedIds.clear()
+                refFrameTime = frameTime
+                shotsSinceRefresh = 0
+                forceRefresh = False
+                continue
+
+            # Compare the frame against the background model, which also learns
+            # from it everywhere except around the last known target. Only the
+            # regions with active blocks are dilated; none means nothing moved.
+            motionRegions = motionDetector.foreground(freezeRegions)
+            stageTimer.mark("background")
+
+            # Find all moving objects and follow each one with its own track
+            blobs = motionDetector.blobs(coarseMinArea, args.blobs) if motionRegions else []
+            stageTimer.mark("blobs")
+            detectionStage.record(time.perf_counter() - stageStart)
+        else:
+            # Nothing moved and nothing is tracked: there is nothing to find
+            blobs = []
+            detectionStage.skip()
+        # Tracks, dwell and the refresh timers all run on the frame's capture time
+        now = frameTime
+        if flowBox is not None:
+            visible = tracker.follow(engagedId, [v * detectScale for v in flowBox], now)
+        else:
+            visible = tracker.update([(x * coarseToMain, y * coarseToMain, w * coarseToMain, h * coarseToMain)
+                                      for (x, y, w, h) in blobs], now)
+        # On flow frames only the engaged track was looked for. The others
+        # seen at the last full detection are still there: keep them out of
+        # the background model and on the live feed, at their last boxes.
+        shown = [t for t in tracker.tracks if t.misses == 0] if flowBox is not None else visible
+        freezeRegions = [(int(x / coarseToMain) - coarseFreezeMargin, int(y / coarseToMain) - coarseFreezeMargin,
+                          int(w / coarseToMain) + 2 * coarseFreezeMargin, int(h / coarseToMain) + 2 * coarseFreezeMargin)
+                         for (x, y, w, h) in (t.box for t in shown)]
+
+        # Pick the track the servo engages; it stays engaged while visible
+        engaged = select_track(visible, args.track_priority, now, engagedId,
+                               (FRAME_WIDTH / 2, FRAME_HEIGHT / 2), MIN_AQUIRE_TIME)
+        engagedId = engaged.id if engaged is not None else None
+        target_found = engaged is not None
+        stageTimer.mark("track")
+
+        # Classify the tracks that are due, all in one batch, before anything
+        # is drawn on the frame. Each track is only classified a few times.
+        if verifier is not None:
+            for trackId in verifier.update(frame, visible, now):
+                label, score = verifier.describe(trackId)
+                if verifier.verdict(trackId):
+                    confirmedIds.add(trackId)
+                eventLog.emit("verify", track=trackId, label=label, score=round(score, 3),
+                              positive=verifier.verdict(trackId))
+            stageTimer.mark("verify")
+
+        # Outline every track on the live feed
+        for track in shown:
+            (x, y, boxW, boxH) = track.box
+            text = str(track.id)
+            if verifier is not None and verifier.verdict(track.id) is not None:
+                text += f" {verifier.describe(track.id)[0]}"
+            cv2.rectangle(frame, (x, y), (x + boxW, y + boxH), (255, 255, 0), 1)
+            cv2.putText(frame, text, (x, max(y - 4, 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 0), 1)
+        stageTimer.mark("draw")
 
-        # Compute the difference between the current and reference frames
-        frameDelta = cv2.absdiff(firstFrame, gray)
-        thresh = cv2.threshold(frameDelta, THRESHOLD_SENSITIVITY, 255, cv2.THRESH_BINARY)[1]
-        thresh = cv2.dilate(thresh, None, iterations=2)
-        
-        # Find contours of moving objects
-        contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Find the largest moving object
-        largest_contour = None
-        max_area = 0
-        for c in contours:
-            area = cv2.contourArea(c)
-            if area > MIN_CONTOUR_AREA and area > max_area:
-                max_area = area
-                largest_contour = c
-
-        target_found = largest_contour is not None
-        
         if target_found:
-            (x, y, w, h) = cv2.boundingRect(largest_contour)
-            centerX = x + w // 2
-            centerY = y + h // 2
+            if scale > 1 and flowBox is None:
+                # Refine the coarse box at full detection resolution
+                coarseBox = tuple(int(v / coarseToMain) for v in engaged.box)
+                (x, y, boxW, boxH) = refine_target(luma, background.background(), coarseBox,
+                                                   scale, detectBlurSize, THRESHOLD_SENSITIVITY, detectMinArea,
+                                                   backend=args.blobs)
+                # Map from detection to main frame coordinates
+                centerX = int((x + boxW / 2) * detectScale)
+                centerY = int((y + boxH / 2) * detectScale)
+            else:
+                centerX = int(engaged.center[0])
+                centerY = int(engaged.center[1])
+                (x, y, boxW, boxH) = (v / detectScale for v in engaged.box)
+
+            # A full detection (re)seeds the flow on the engaged target's box
+            if flowTracker is not None and flowBox is None:
+                flowSeed = (x, y, boxW, boxH)
             
             # Draw targeting box on the live feed
             cv2.rectangle(frame, (centerX - 20, centerY - 20), (centerX + 20, centerY + 20), (0, 255, 0), 2)
 
-            # Check if the target is stationary
-            movement = abs(lastTargetX - centerX) + abs(lastTargetY - centerY)
-            if movement < TARGET_MOVEMENT_THRESHOLD:
-                if monitorText != "Acquired":
-                    targetFirstAquiredTime = datetime.datetime.now()
-                monitorText = "Acquired"
-            else:
-                monitorText = "Tracking"
-                targetFirstAquiredTime = datetime.datetime.fromtimestamp(0) # Reset timer
+            # Predict where the target will be when the servo gets there
+            predictor = predictors.setdefault(engaged.id, KalmanPredictor())
+            predictor.update((centerX, centerY), frameTime)
+            aimX, aimY = predictor.predict(frameTime + args.aim_latency)
+            aimX = min(max(aimX, 0), FRAME_WIDTH)
+            if args.aim_latency > 0:
+                cv2.circle(frame, (int(aimX), int(aimY)), 4, (0, 255, 0), -1)
+
+            # The engaged target is acquired while its track is stationary
+            monitorText = "Acquired" if engaged.still_since is not None else "Tracking"
             
             lastTargetX = centerX
             lastTargetY = centerY
             
             # Aim the servo
-            # Scale target's X position to the servo's pulse width range
-            duty = SERVO_MIN_RANGE + (centerX / FRAME_WIDTH) * (SERVO_MAX_RANGE - SERVO_MIN_RANGE)
-            lgpio.tx_servo(h, SERVO, int(duty), 50)
+            # Scale the predicted X position to the servo's pulse width range
+            duty = SERVO_MIN_RANGE + (aimX / FRAME_WIDTH) * (SERVO_MAX_RANGE - SERVO_MIN_RANGE)
+            if firing.busy:
+                firing.set_center(duty) # Keep the sweep on the moving target
+            else:
+                servo.set(duty)
 
         else: # No target found
             monitorText = "Unoccupied"
-            targetFirstAquiredTime = datetime.datetime.fromtimestamp(0)
-            lgpio.tx_servo(h, SERVO, SERVO_CENTER, 50) # Return servo to center
+            if flowTracker is not None:
+                flowTracker.reset()
+            if not firing.busy:
+                servo.set(SERVO_CENTER) # Return servo to center
+
+        # Keep a predictor running for every other track, so a switch of
+        # target is aimed with a warmed-up velocity estimate
+        for track in visible:
+            if track is not engaged:
+                predictors.setdefault(track.id, KalmanPredictor()).update(track.center, frameTime)
+        if len(predictors) > len(tracker.tracks):
+            live = {t.id for t in tracker.tracks}
+            for trackId in [i for i in predictors if i not in live]:
+                del predictors[trackId]
+        if verifier is not None and len(verifier) > len(tracker.tracks):
+            verifier.prune({t.id for t in tracker.tracks})
+
+        # Tracks that end without being confirmed count as false triggers
+        live = {t.id for t in tracker.tracks}
+        heatmap.update(visible, live, confirmedIds)
+        confirmedIds &= live
+        if args.log_tracks:
+            for track in visible:
+                x, y = (centerX, centerY) if track is engaged else track.center
+                eventLog.emit("track", id=track.id, t=round(frameTime, 4), x=round(x, 1), y=round(y, 1),
+                              engaged=track is engaged)
+        stageTimer.mark("aim")
+        if flowSeed is not None:
+            flowTracker.seed(luma, flowSeed)
+            stageTimer.mark("flow")
+
+        # Full frame rate from the first sign of motion until the scene has
+        # been empty for IDLE_DELAY seconds
+        powerState = power.update(moved or bool(tracker.tracks) or firing.busy, now)
+        if powerState is not None:
+            log_message(f"Power state {powerState}: {power.fps:g} fps")
+            eventLog.emit("power", state=powerState, fps=power.fps)
+
+        # Record state changes
+        if monitorText != lastMonitorText:
+            eventLog.emit("state", state=monitorText, previous=lastMonitorText,
+                          track=engagedId, tracks=len(visible))
+            if monitorText == "Acquired" and clipRecorder is not None:
+                clipRecorder.trigger("acquired")
+            lastMonitorText = monitorText
+
+        # Buffer a small copy of the frame (with the targeting box) for event clips
+        if clipRecorder is not None:
+            clipRecorder.add(frame, cv2.COLOR_RGB2BGR)
+        stageTimer.mark("clip")
 
         # --- Firing Logic ---
         if monitorText == "Acquired":
-            time_acquired = (datetime.datetime.now() - targetFirstAquiredTime).seconds
-            time_since_refresh = (datetime.datetime.now() - refFrameTime).seconds
-
-            if time_acquired >= MIN_AQUIRE_TIME:
+            time_acquired = engaged.dwell(now)
+            time_since_refresh = now - refFrameTime
+
+            if firing.busy:
+                # Restart the target's acquisition timer once the current shot is over
+                engaged.still_since = now
+            elif time_acquired >= MIN_AQUIRE_TIME and verifier is not None and not verifier.verdict(engaged.id):
+                # Not confirmed by the classifier. Undecided targets wait for
+                # their remaining checks; rejected ones restart the timer.
+                if verifier.verdict(engaged.id) is False:
+                    label, score = verifier.describe(engaged.id)
+                    log_message(f"Target {engaged.id} classified as {label} ({score:.2f}). Not firing.")
+                    engaged.still_since = now
+            elif time_acquired >= MIN_AQUIRE_TIME:
                 if time_since_refresh < MIN_TIME_FROM_LAST_REF_FRAME_UPDATE and totalShots > 0:
                     log_message("Acquired too soon after refresh. Forcing new reference frame.")
                     forceRefresh = True
@@ -208,28 +777,26 @@ try:
 
                 if shotsSinceRefresh < MAX_SHOTS and not debugging:
                     totalShots += 1
+                    stageTimer.count("shots")
                     shotsSinceRefresh += 1
                     
-                    log_message(f"Shot {shotsSinceRefresh}/{MAX_SHOTS} at X:{lastTargetX} Y:{lastTargetY}. Total shots: {totalShots}")
+                    log_message(f"Shot {shotsSinceRefresh}/{MAX_SHOTS} at target {engaged.id} X:{lastTargetX} Y:{lastTargetY}. "
+                                f"Total shots: {totalShots}")
                     
                     # Save a picture of the target
-                    img_path = f"trigger_pictures/trigger_{startTime.strftime('%Y%m%d_%H%M%S')}_{totalShots}.jpg"
-                    # Convert to BGR for saving with OpenCV
-                    bgr_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                    cv2.imwrite(img_path, bgr_frame)
-
-                    # Fire the water valve and sweep the servo
-                    lgpio.gpio_write(h, TRIGGER, 1)
-                    current_duty = lgpio.tx_servo(h, SERVO, 0, 0)[0] # Get current pulse width
-                    
-                    for i in range(5): # Sweep 5 times
-                        lgpio.tx_servo(h, SERVO, int(current_duty + SERVO_TRIGGER_SWEEP), 50)
-                        time.sleep(0.2)
-                        lgpio.tx_servo(h, SERVO, int(current_duty - SERVO_TRIGGER_SWEEP), 50)
-                        time.sleep(0.2)
-                    
-                    lgpio.gpio_write(h, TRIGGER, 0)
-                    targetFirstAquiredTime = datetime.datetime.fromtimestamp(0) # Reset timer to prevent rapid re-fire
+                    img_path = f"trigger_pictures/trigger_{startTime.strftime('%Y%m%d_%H%M%S')}_{totalShots}.{PICTURE_FORMAT}"
+                    # Converted to BGR and saved on the writer thread
+                    imageWriter.submit(img_path, frame, cv2.COLOR_RGB2BGR)
+                    if clipRecorder is not None:
+                        clipRecorder.trigger("shot")
+                    confirmedIds.add(engaged.id)
+                    eventLog.emit("shot", shot=shotsSinceRefresh, total=totalShots, track=engaged.id,
+                                  x=lastTargetX, y=lastTargetY, duty=int(duty), picture=img_path,
+                                  sensor_ts=sensorTimestamp, latency_ms=round(1000 * (time.monotonic() - frameTime), 1))
+
+                    # Fire the water valve and sweep the servo around the target.
+                    # This returns immediately; the shot runs in the background.
+                    firing.fire(duty)
 
                     if shotsSinceRefresh >= MAX_SHOTS:
                         log_message(f"Max shot limit ({MAX_SHOTS}) reached. Forcing reference frame update.")
@@ -237,41 +804,97 @@ try:
                 
                 elif debugging:
                     log_message("Target acquired, but DEBUG mode is ON. Not firing.")
-                    # Reset timer to avoid spamming the log
-                    targetFirstAquiredTime = datetime.datetime.fromtimestamp(0)
-
+                    # Restart the timer to avoid spamming the log
+                    engaged.still_since = now
+        stageTimer.mark("fire")
+        stageTimer.observe("capture_to_decision", time.monotonic() - frameTime)
 
         # --- Display Video Feed ---
-        # Draw status text on the frame
+        # Skip all display work unless there is a window or a preview client
+        previewWanted = preview is not None and preview.wants_frame()
+        if args.headless and not previewWanted:
+            continue
+
+        # Draw status text on the frame. The overlays are only re-rendered
+        # when their text changes (the clock once per second).
         status_text = f"Status: {monitorText}"
         if debugging:
             status_text += " (DEBUG MODE)"
-        cv2.putText(frame, status_text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-        cv2.putText(frame, datetime.datetime.now().strftime("%A %d %B %Y %I:%M:%S%p"), (10, frame.shape[0] - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-        
+        status_text += f" {captureFps:.0f}/{processMeter.rate:.0f} fps"
+        statusOverlay.set_text(status_text)
+        clockOverlay.set_text(datetime.datetime.now().strftime("%A %d %B %Y %I:%M:%S%p"))
+        statusOverlay.draw(frame)
+        clockOverlay.draw(frame)
+
+        if previewWanted:
+            preview.publish(frame, cv2.COLOR_RGB2BGR)
+        if args.headless:
+            stageTimer.mark("display")
+            continue
+
         # Convert back to BGR for display with cv2.imshow
-        display_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        cv2.imshow("Water Blaster Feed", display_frame)
+        displayFrame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=displayFrame)
+        cv2.imshow("Water Blaster Feed", displayFrame)
+        stageTimer.mark("display")
 
         key = cv2.waitKey(1) & 0xFF
         if key == ord("q"):
             log_message("'q' key pressed. Exiting.")
             break
 
+except KeyboardInterrupt:
+    log_message("Interrupted. Exiting.")
+
 finally:
     # --- Cleanup ---
     log_message("Shutting down...")
-    logfile.close()
+
+    # Stop the capture thread before the camera goes away
+    if 'captureThread' in locals() and captureThread is not None:
+        captureThread.stop()
     
+    # Abort any shot in progress; this also closes the valve
+    if 'firing' in locals():
+        firing.stop()
+    if 'servo' in locals():
+        servo.close()   # Stop sending and disable servo PWM
+        log_message(servo.summary())
+    if 'detectionStage' in locals():
+        log_message(detectionStage.summary(motionGate.time))
+    if 'motionDetector' in locals():
+        log_message(motionDetector.summary())
+    if 'flowTracker' in locals() and flowTracker is not None:
+        log_message(flowTracker.summary())
+    if 'verifier' in locals() and verifier is not None:
+        log_message(verifier.summary())
+    if 'power' in locals():
+        log_message(power.summary())
+    if 'heatmap' in locals():
+        heatmap.save(args.heatmap)
+        log_message(heatmap.summary())
+    if 'stageTimer' in locals():
+        log_message(stageTimer.latency_summary())
+
     # Safely close GPIO resources
     if 'h' in locals():
         lgpio.gpio_write(h, TRIGGER, 0) # Make sure valve is off
-        lgpio.tx_servo(h, SERVO, 0, 0)   # Disable servo PWM
         lgpio.gpiochip_close(h)
     
-    # Stop camera and close windows
+    # Stop camera, preview server and close windows
     if 'picam2' in locals():
         picam2.stop()
-    cv2.destroyAllWindows()
-    log_message("System stopped.")
\ No newline at end of file
+    if 'preview' in locals() and preview is not None:
+        preview.close()
+    if 'metricsServer' in locals() and metricsServer is not None:
+        metricsServer.close()
+    if not args.headless:
+        cv2.destroyAllWindows()
+
+    # Let the writer finish any pictures still in its queue
+    imageWriter.close()
+    log_message(imageWriter.summary())
+    if clipRecorder is not None:
+        clipRecorder.close()
+        log_message(f"Saved {clipRecorder.clips} event clips.")
+    log_message("System stopped.")
+    eventLog.close()